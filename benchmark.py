@@ -0,0 +1,195 @@
+import argparse
+import logging
+import json
+import os
+import sys
+import timeit
+import damage_simulator
+
+settings = {
+    'unit_lists': ['unit_lists/heat_test.json', 'unit_lists/speed_test.json', 'unit_lists/wantec.json',
+                   'unit_lists/synthetic_units.json', 'unit_lists/skill_cgr.json'],
+    'range_determinations': ['fixed_short', 'fixed_medium', 'fixed_long', 'random', 'fast_unit_minimizes_damage',
+                             'fast_unit_causes_slow_approach', 'initiative_helps_faster_minimize_hit_chance',
+                             'initiative_helps_faster_maximize_damage'],
+    'max_units': 8,  # Only the first max_units units of each list are paired, to keep big lists quick
+    'battle_runs': 200,  # Battles per pairing for the one_vs_one benchmark
+    'grid_battle_runs': 50,  # battle_runs for the whole-grid benchmark
+    'unit_creates': 20000,
+    'exact_range_determinations': ['random'],  # The exact engine is checked against sampling for these
+    'exact_battle_runs': 10000,  # Sampled battles per pairing that the exact engine has to beat, as in config.json
+    'exact_sampler': 'scalar',  # Engine the exact engine is checked against
+    'repeats': 3,  # Each benchmark is timed this many times and the best time is kept
+    'seed': 1,
+    'output_dir': 'benchmark_output',  # results and baseline are written here
+    'results': 'benchmark_results.json',
+    'baseline': 'benchmark_baseline.json',
+    'save_baseline': False,
+    'threshold': 0.2,  # Fractional slowdown against the baseline that counts as a regression
+    'debug': False
+}
+
+
+def settings_get_from_command_line():
+    parser = argparse.ArgumentParser()
+    for argument in settings:
+        if isinstance(settings[argument], bool):
+            parser.add_argument('--' + argument, action="store_true")
+        elif isinstance(settings[argument], int):
+            parser.add_argument('--' + argument, type=int)
+        elif isinstance(settings[argument], float):
+            parser.add_argument('--' + argument, type=float)
+        elif isinstance(settings[argument], list):
+            parser.add_argument('--' + argument, action="append")
+        else:
+            parser.add_argument('--' + argument)
+    args = parser.parse_args()
+    for arg in vars(args):
+        if getattr(args, arg) is not None:
+            if getattr(args, arg):
+                settings[arg] = getattr(args, arg)
+
+
+def logging_configure(debug=False):
+    # The simulator logs through the same root logger, so anything below WARNING would be timed along with it
+    if debug:
+        log_level = logging.DEBUG
+    else:
+        log_level = logging.WARNING
+    log_format = '%(message)s'
+    logging.basicConfig(level=log_level, format=log_format)
+
+
+def best_time(benchmark, *benchmark_args):
+    best = None
+    for repeat in range(0, int(settings['repeats'])):
+        start = timeit.default_timer()
+        benchmark(*benchmark_args)
+        elapsed = timeit.default_timer() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def battles_run(unit_list, pairings, battle_runs):
+    # The configured engine through its real entry point, one pairing at a time in this process
+    for attacker_index, defender_index in pairings:
+        damage_simulator.matchup_battles(unit_list[attacker_index], unit_list[defender_index], battle_runs,
+                                         seed=int(settings['seed']))
+
+
+def units_create(unit_list, unit_creates):
+    for unit_create in range(0, unit_creates):
+        damage_simulator.unit_create_from_dict(unit_list[unit_create % len(unit_list)])
+
+
+def grid_run(unit_list, pairings):
+    damage_simulator.grid_run(unit_list, unit_list, pairings)
+
+
+def benchmarks_run():
+    # Returns {benchmark name: {'value': ..., 'unit': ..., 'better': 'higher' or 'lower'}}
+    damage_simulator.config['engine'] = 'scalar'
+    damage_simulator.config['workers'] = 1
+    damage_simulator.config['seed'] = int(settings['seed'])
+    results = {}
+    for unit_list_path in settings['unit_lists']:
+        list_name = os.path.splitext(os.path.basename(unit_list_path))[0]
+        unit_list = damage_simulator.unit_list_read_from_json(unit_list_path)[:int(settings['max_units'])]
+        pairings = damage_simulator.unit_list_pairings(unit_list)
+        elapsed = best_time(units_create, unit_list, int(settings['unit_creates']))
+        results['unit_create_from_dict/' + list_name] = {'value': settings['unit_creates'] / elapsed,
+                                                         'unit': 'units/s', 'better': 'higher'}
+        for range_determination in settings['range_determinations']:
+            damage_simulator.config['range_determination'] = range_determination
+            elapsed = best_time(battles_run, unit_list, pairings, int(settings['battle_runs']))
+            battles = len(pairings) * int(settings['battle_runs'])
+            results['matchup_battles/' + list_name + '/' + range_determination] = {'value': battles / elapsed,
+                                                                               'unit': 'battles/s',
+                                                                               'better': 'higher'}
+            damage_simulator.config['battle_runs'] = int(settings['grid_battle_runs'])
+            elapsed = best_time(grid_run, unit_list, pairings)
+            results['grid/' + list_name + '/' + range_determination] = {'value': elapsed, 'unit': 's',
+                                                                         'better': 'lower'}
+            print(list_name + ' ' + range_determination + ': ' +
+                  str(int(results['matchup_battles/' + list_name + '/' + range_determination]['value'])) +
+                  ' battles/s, grid ' + str(round(elapsed, 3)) + 's')
+        for range_determination in settings['exact_range_determinations']:
+            # The exact engine, fallbacks included, against sampling the same pairings
+            damage_simulator.config['range_determination'] = range_determination
+            elapsed = {}
+            for engine in ['exact', settings['exact_sampler']]:
+                damage_simulator.config['engine'] = engine
+                elapsed[engine] = best_time(battles_run, unit_list, pairings, int(settings['exact_battle_runs']))
+            damage_simulator.config['engine'] = 'scalar'
+            results['exact_speedup/' + list_name + '/' + range_determination] = {
+                'value': elapsed[settings['exact_sampler']] / elapsed['exact'], 'unit': 'x', 'better': 'higher'}
+            print(list_name + ' ' + range_determination + ': exact ' + str(round(elapsed['exact'], 3)) + 's, ' +
+                  settings['exact_sampler'] + ' ' + str(round(elapsed[settings['exact_sampler']], 3)) + 's')
+    return results
+
+
+def exact_losses_find(results):
+    # The exact engine is only worth using where it beats sampling
+    losses = []
+    for name in sorted(results):
+        if name.startswith('exact_speedup/') and results[name]['value'] < 1:
+            losses.append(name + ': ' + str(round(results[name]['value'], 3)) + 'x')
+    return losses
+
+
+def regressions_find(results, baseline):
+    regressions = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        value = results[name]['value']
+        baseline_value = baseline[name]['value']
+        if results[name]['better'] == 'higher':
+            regressed = value < baseline_value * (1 - float(settings['threshold']))
+        else:
+            regressed = value > baseline_value * (1 + float(settings['threshold']))
+        if regressed:
+            regressions.append(name + ': ' + str(round(value, 3)) + ' ' + results[name]['unit'] + ' (baseline ' +
+                               str(round(baseline_value, 3)) + ')')
+    return regressions
+
+
+def output_path(file_name):
+    return os.path.join(settings['output_dir'], file_name)
+
+
+def json_write(data, file_path):
+    if not os.path.isdir(settings['output_dir']):
+        os.makedirs(settings['output_dir'])
+    with open(file_path, 'w') as outfile:
+        json.dump(data, outfile, sort_keys=True, indent=4, separators=(',', ': '))
+
+
+if __name__ == "__main__":
+    settings_get_from_command_line()
+    logging_configure(settings['debug'])
+    benchmark_results = benchmarks_run()
+    json_write(benchmark_results, output_path(settings['results']))
+    benchmark_failed = False
+    for exact_loss in exact_losses_find(benchmark_results):
+        logging.error('Exact engine slower than ' + settings['exact_sampler'] + ': ' + exact_loss)
+        benchmark_failed = True
+    if settings['save_baseline']:
+        json_write(benchmark_results, output_path(settings['baseline']))
+        print('Baseline saved to ' + output_path(settings['baseline']))
+    elif os.path.isfile(output_path(settings['baseline'])):
+        with open(output_path(settings['baseline'])) as baseline_file:
+            benchmark_baseline = json.load(baseline_file)
+        benchmark_regressions = regressions_find(benchmark_results, benchmark_baseline)
+        for regression in benchmark_regressions:
+            logging.error('Regression: ' + regression)
+        if len(benchmark_regressions) > 0:
+            benchmark_failed = True
+        else:
+            print('No regressions against ' + output_path(settings['baseline']))
+    else:
+        logging.warning('No baseline at ' + output_path(settings['baseline']) +
+                        '; run with --save_baseline to make one.')
+    if benchmark_failed:
+        sys.exit(1)
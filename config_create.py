@@ -2,16 +2,25 @@ import argparse
 import logging
 import json
 import os
+import re
+import sys
 
 settings = {
     'base_config': 'config.json',
     'new_config': 'config_pv.json',
     'pv': 20,
+    'pv_min': 0,  # With pv_min and pv_max, one config is written per PV bracket instead of one for pv
+    'pv_max': 0,
+    'pv_bracket': 1,  # PVs per bracket
+    'skills': [],  # Empty means any
+    'types': [],
+    'move_min': 0,
+    'move_max': 0,  # 0 means no limit
     'attacker_list': 'unit_lists/xotl_skill4.json',
     'defender_list':  'unit_lists/xotl_skill3.json',
-    'limit_specials': False,  # Not yet supported
+    'limit_specials': False,  # Only keep units whose specials are all in supported_specials
     'supported_specials': ['RFA', 'SHLD', 'AMS', 'RAMS', 'ARM', 'CR', 'CASE', 'CASEII',
-                           'BHJ2', 'BHJ3', 'RHS', 'STL', 'ENE', 'LG', 'VLG', 'SLG'],
+                           'BHJ2', 'BHJ3', 'RHS', 'STL', 'ENE', 'LG', 'VLG', 'SLG', 'HT', 'IF', 'LRM', 'SRM'],
     'debug': False
 }
 
@@ -53,6 +62,9 @@ def config_read(config_file):
 
 
 def json_load_byteified(file_handle):
+    # Python 3 strings are already text, so only Python 2 needs the unicode -> str pass
+    if sys.version_info[0] >= 3:
+        return json.load(file_handle)
     return _byteify(
         json.load(file_handle, object_hook=_byteify),
         ignore_dicts=True
@@ -60,6 +72,8 @@ def json_load_byteified(file_handle):
 
 
 def json_loads_byteified(json_text):
+    if sys.version_info[0] >= 3:
+        return json.loads(json_text)
     return _byteify(
         json.loads(json_text, object_hook=_byteify),
         ignore_dicts=True
@@ -78,7 +92,7 @@ def _byteify(data, ignore_dicts=False):
     if isinstance(data, dict) and not ignore_dicts:
         return {
             _byteify(key, ignore_dicts=True): _byteify(value, ignore_dicts=True)
-            for key, value in data.iteritems()
+            for key, value in data.items()
         }
     # if it's anything else, return it in its original form
     return data
@@ -86,28 +100,101 @@ def _byteify(data, ignore_dicts=False):
 
 def config_write(config, file_path):
     with open(file_path, 'w') as outfile:
-        json.dump(config, outfile, sort_keys=True, indent=4)
-
-
-def unit_list_get(unit_file):
-    unit_data = config_read(unit_file)
-    unit_list = []
-    for unit in unit_data:
-        if unit['points'] == settings['pv']:
-            if settings['limit_specials']:
-                # TODO - support this
-                pass
-            unit_list.append(unit['name'])
-    return unit_list
+        json.dump(config, outfile, sort_keys=True, indent=4, separators=(',', ': '))
+
+
+def special_code(special):
+    # 'HT1/1/0' -> 'HT', 'IF1' -> 'IF'; specials such as BHJ2 are matched whole first
+    if special in settings['supported_specials']:
+        return special
+    return re.match(r'[A-Za-z]*', special).group(0)
+
+
+class UnitIndex(object):
+    # Positions of a list's units by points, skill, type, move and special, so every query is a few set operations
+
+    def __init__(self, units):
+        self.units = units
+        self.fields = {'points': {}, 'skill': {}, 'type': {}, 'move': {}, 'special': {}}
+        for position, unit in enumerate(units):
+            for field in ['points', 'skill', 'type', 'move']:
+                self.fields[field].setdefault(unit.get(field), set()).add(position)
+            for special in unit.get('special', []):
+                self.fields['special'].setdefault(special, set()).add(position)
+
+    def positions(self, field, values):
+        found = set()
+        for value in values:
+            found |= self.fields[field].get(value, set())
+        return found
+
+    def query(self, points=None, skills=None, types=None, move_min=0, move_max=0, supported_specials=None):
+        # Names of the units matching every filter given, in list order
+        positions = set(range(0, len(self.units)))
+        if points is not None:
+            positions &= self.positions('points', points)
+        if skills:
+            positions &= self.positions('skill', skills)
+        if types:
+            positions &= self.positions('type', types)
+        if move_min > 0 or move_max > 0:
+            positions &= self.positions('move', [move for move in self.fields['move'] if move is not None and
+                                                 move >= move_min and (move_max == 0 or move <= move_max)])
+        if supported_specials is not None:
+            for special in self.fields['special']:
+                if special_code(special) not in supported_specials:
+                    positions -= self.fields['special'][special]
+        return [self.units[position]['name'] for position in sorted(positions)]
+
+
+def pv_brackets():
+    # Lists of PVs, one per config to write
+    if settings['pv_min'] > 0 and settings['pv_max'] > 0:
+        return [list(range(low, min(low + settings['pv_bracket'], settings['pv_max'] + 1)))
+                for low in range(settings['pv_min'], settings['pv_max'] + 1, settings['pv_bracket'])]
+    return [[settings['pv']]]
+
+
+def new_config_path(pv_bracket, bracket_count):
+    if pv_bracket[0] == pv_bracket[-1]:
+        bracket_name = str(pv_bracket[0])
+    else:
+        bracket_name = str(pv_bracket[0]) + '-' + str(pv_bracket[-1])
+    if settings['new_config'] is None:
+        return os.path.splitext(settings['base_config'])[0] + bracket_name + \
+               os.path.splitext(settings['base_config'])[1]
+    if bracket_count > 1:
+        return os.path.splitext(settings['new_config'])[0] + bracket_name + os.path.splitext(settings['new_config'])[1]
+    return settings['new_config']
+
+
+def configs_create(base_config):
+    # Each unit list is read and indexed once, however many brackets are written
+    unit_indexes = {}
+    for unit_file in [settings['attacker_list'], settings['defender_list']]:
+        if unit_file not in unit_indexes:
+            unit_indexes[unit_file] = UnitIndex(config_read(unit_file))
+    filters = {'skills': [int(skill) for skill in settings['skills']],
+               'types': [int(unit_type) for unit_type in settings['types']],
+               'move_min': int(settings['move_min']), 'move_max': int(settings['move_max'])}
+    if settings['limit_specials']:
+        filters['supported_specials'] = set(settings['supported_specials'])
+    brackets = pv_brackets()
+    for pv_bracket in brackets:
+        new_config = dict(base_config)
+        new_config['attacker_list'] = unit_indexes[settings['attacker_list']].query(points=pv_bracket, **filters)
+        new_config['defender_list'] = unit_indexes[settings['defender_list']].query(points=pv_bracket, **filters)
+        new_config_file = new_config_path(pv_bracket, len(brackets))
+        # A single config is always written, as before brackets; of many, the empty ones are left out
+        if len(brackets) > 1 and (len(new_config['attacker_list']) == 0 or len(new_config['defender_list']) == 0):
+            logging.warning('No matching attackers or defenders for ' + new_config_file + '; not written.')
+            continue
+        config_write(new_config, new_config_file)
+        logging.info('Wrote ' + new_config_file + ': ' + str(len(new_config['attacker_list'])) + ' attackers, ' +
+                     str(len(new_config['defender_list'])) + ' defenders')
 
 
 if __name__ == "__main__":
     settings_get_from_command_line()
     logging_configure(settings['debug'])
-    base_config = config_read(settings['base_config'])
-    base_config['attacker_list'] = unit_list_get(settings['attacker_list'])
-    base_config['defender_list'] = unit_list_get(settings['defender_list'])
-    if settings['new_config'] is None:
-        settings['new_config'] = os.path.splitext(settings['base_config'])[0] + str(settings['pv']) + \
-                                 os.path.splitext(settings['base_config'])[1]
-    config_write(base_config, settings['new_config'])
+    configs_create(config_read(settings['base_config']))
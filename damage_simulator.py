@@ -4,14 +4,52 @@ import shutil
 import random
 import csv
 import json
+import re
 import argparse
 import sys
+import hashlib
+import heapq
+import multiprocessing
+import collections
+import copy
+import itertools
+import math
+import decimal
+import sqlite3
+import socket
+import threading
+import time
+import timeit
+from multiprocessing.connection import Client, Listener
+try:
+    import numpy
+except ImportError:
+    numpy = None
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    import queue
+except ImportError:
+    import Queue as queue
 
 __version__ = 1.8
+RULES_VERSION = 1  # Bump whenever a rules change makes cached results stale
+CATALOG_VERSION = 1  # Bump whenever the unit catalog sidecar layout changes
 CONFIG_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), 'config.json')
 
 # Constants for use below
+PY3 = sys.version_info[0] >= 3
 MAX_ROUNDS = 100  # Avoid runaways
+PROFILE_PHASES = ['range_get', 'to_hit', 'motive_check', 'damage_apply', 'apply_crit', 'round_complete', 'output']
+HISTOGRAMS = ['rounds', 'attacker_armor', 'attacker_structure', 'defender_armor', 'defender_structure']
+CATALOG_CHUNK_SIZE = 65536  # Characters of a unit list read at a time while streaming it
+JSON_WHITESPACE = re.compile(r'\s*')
+DICE_BUFFER_SIZE = 4096  # Rolls of each kind generated at a time by DiceSource
+BATTLE_DICE_BUFFER_SIZE = 64  # Smaller buffers when DiceSource is reseeded for every battle
+COORDINATOR_POLL_SECONDS = 1  # How often waiting coordinator threads check whether the run is over
+AUTHKEY_VARIABLE = 'ALPHASTRIKE_AUTHKEY'  # Where the distributed authkey is read from when the config has none
 
 SHORT_RANGE = 0
 MEDIUM_RANGE = 1
@@ -43,16 +81,101 @@ WIGE = 5
 ATTACKER = 0
 DEFENDER = 0
 
+# Special abilities checked during a battle, compiled into CombatUnit.sa_flags
+SA_SHLD = 1 << 0
+SA_RFA = 1 << 1
+SA_ENE = 1 << 2
+SA_AMS = 1 << 3
+SA_CR = 1 << 4
+SA_CASE = 1 << 5
+SA_CASEII = 1 << 6
+SA_STL = 1 << 7
+SA_BHJ2 = 1 << 8
+SA_BHJ3 = 1 << 9
+SA_RHS = 1 << 10
+SA_MISSILES = 1 << 11  # LRM#, SRM# or IF#, which AMS works against
+SA_FLAGS = {
+    'SHLD': SA_SHLD,
+    'RFA': SA_RFA,
+    'ENE': SA_ENE,
+    'AMS': SA_AMS,
+    'RAMS': SA_AMS,
+    'CR': SA_CR,
+    'CASE': SA_CASE,
+    'CASEII': SA_CASEII,
+    'STL': SA_STL,
+    'BHJ2': SA_BHJ2,
+    'BHJ3': SA_BHJ3,
+    'RHS': SA_RHS
+}
+
+# Chance of each 2d6 total
+TWO_D6_ODDS = [(roll, (6 - abs(roll - 7)) / 36.0) for roll in range(2, 13)]
+# Chance the slower unit's 2d6 initiative roll beats the faster unit's (ties go to the faster unit)
+INITIATIVE_SLOWER_WINS = sum(slower_chance * faster_chance for slower_roll, slower_chance in TWO_D6_ODDS
+                             for faster_roll, faster_chance in TWO_D6_ODDS if slower_roll > faster_roll)
+
+# Crit effects, looked up in CRIT_TABLES by the (CR-modified) 2d6 roll
+CRIT_NONE = 0
+CRIT_AMMO_EXPLOSION = 1
+CRIT_ENGINE = 2  # Mech: +1 heat whenever it fires; a second one destroys it
+CRIT_FIRE_CONTROL = 3
+CRIT_WEAPON = 4
+CRIT_MP = 5
+CRIT_DESTROYED = 6
+CRIT_CREW_STUNNED = 7
+CRIT_CREW_KILLED = 8
+CRIT_VEHICLE_ENGINE = 9  # Vehicle: movement and weapons halved; a second one destroys it
+CRIT_NAMES = ['No crit', 'Ammo explosion', 'Engine hit', 'Fire control hit', 'Weapon hit', 'MP hit', 'Unit destroyed',
+              'Crew stunned', 'Crew killed', 'Engine hit']
+CRIT_TABLES = {
+    # Index 0 to 12; CR can take a 2 or 3 down to 0 or 1
+    MECH: [CRIT_NONE, CRIT_NONE, CRIT_AMMO_EXPLOSION, CRIT_ENGINE, CRIT_FIRE_CONTROL, CRIT_NONE, CRIT_WEAPON, CRIT_MP,
+           CRIT_WEAPON, CRIT_NONE, CRIT_FIRE_CONTROL, CRIT_ENGINE, CRIT_DESTROYED],
+    VEHICLE: [CRIT_NONE, CRIT_NONE, CRIT_AMMO_EXPLOSION, CRIT_CREW_STUNNED, CRIT_FIRE_CONTROL, CRIT_FIRE_CONTROL,
+              CRIT_NONE, CRIT_NONE, CRIT_NONE, CRIT_WEAPON, CRIT_WEAPON, CRIT_CREW_KILLED, CRIT_VEHICLE_ENGINE]
+    # TODO - PROTOMECH crits
+}
+
+# Motive effects, looked up by the 2d6 roll plus the motive type's modifier
+MOTIVE_NONE = 0
+MOTIVE_MINUS_2 = 1
+MOTIVE_HALVED = 2
+MOTIVE_IMMOBILE = 3
+MOTIVE_TABLE = [MOTIVE_NONE] * 9 + [MOTIVE_MINUS_2, MOTIVE_MINUS_2, MOTIVE_HALVED, MOTIVE_IMMOBILE] + [MOTIVE_NONE] * 2
+MOTIVE_ROLL_MODS = {WHEELED: 1, HOVER: 1, VTOL: 2, WIGE: 2}
+
 
 config = {
     "unit_list_path": 'unit_lists/synthetic.json',
+    "catalog": {
+        "cache": True
+    },
     "attacker": None,
     "defender": None,
     "attacker_list": [],
     "defender_list": [],
+    "lance_attacker_list": [],
+    "lance_defender_list": [],
+    "target_policy": "focus_fire",
+    "defender_target_policy": "",
     "log_level": 30,
     "log_file": "",
     "battle_runs": 1000,
+    "workers": 1,
+    "seed": None,
+    "adaptive": {
+        "enabled": False,
+        "tolerance": 0.02,
+        "confidence": 0.95,
+        "batch_runs": 500,
+        "max_runs": 10000
+    },
+    "cache": {
+        "enabled": False,
+        "path": "alphastrike_cache.sqlite",
+        "max_entries": 100000
+    },
     "csv": {
         "output": False,
         "path": "c:/temp/alphastrike.csv"
@@ -61,8 +184,66 @@ config = {
         "output": False,
         "path": "c:/temp/alphastrike.txt"
     },
+    "store": {
+        "output": False,
+        "path": "c:/temp/alphastrike_results.json"
+    },
+    "histogram_csv": {
+        "output": False,
+        "path": "c:/temp/alphastrike_histograms.csv"
+    },
+    "render_store": "",
+    "batch": "",
+    "worker": "",
+    "distributed": {
+        "enabled": False,
+        "address": "localhost:6565",
+        "authkey": "",
+        "task_timeout": 3600,
+        "max_retries": 3,
+        "connect_timeout": 60,
+        "idle_timeout": 600
+    },
+    "optimizer": {
+        "budget": 0,
+        "candidate_list_path": "",
+        "targets": [],
+        "min_units": 1,
+        "max_units": 4,
+        "allow_duplicates": False,
+        "objective": "coverage",
+        "forces": 5,
+        "max_nodes": 1000000,
+        "matrix_path": "alphastrike_matrix.json",
+        "path": "alphastrike_forces.json"
+    },
+    "sweep": {
+        "parameters": {},
+        "path": "alphastrike_sweep.json",
+        "csv_path": "alphastrike_sweep.csv"
+    },
+    "checkpoint": {
+        "enabled": False,
+        "path": "alphastrike_checkpoint.jsonl"
+    },
+    "resume": False,
+    "profile": {
+        "enabled": False,
+        "path": "alphastrike_profile.json"
+    },
+    "trace": {
+        "enabled": False,
+        "path": "alphastrike_trace.jsonl"
+    },
     "max_tolerable_heat": 1,
+    "skill_default": 4,
     "range_determination": "random",
+    "engine": "scalar",
+    "exact_max_states": 3000,
+    "variance_reduction": {
+        "common_random_numbers": "",
+        "antithetic": False
+    },
     "woods_percent": {
         "short": 10,
         "medium": 30,
@@ -75,8 +256,97 @@ config = {
     }
 }
 
+battle_trace = None  # BattleTrace while battles are being traced; always check before building an event
+
+
+class BattleTrace(object):
+    # Collects the events of each scalar-engine battle: one JSON line per battle to trace_file, and/or the debug log
+
+    def __init__(self, trace_file=None, log_events=False):
+        self.trace_file = trace_file
+        self.log_events = log_events
+        self.battle = 0
+        self.units = None
+        self.events = None
+
+    def battle_start(self, first_unit, second_unit):
+        self.battle += 1
+        self.units = [first_unit.name, second_unit.name]
+        self.events = []
+
+    def event(self, event_type, **fields):
+        if self.events is None:
+            # Not inside a battle, e.g. the exact solver calling range_get
+            return
+        fields['event'] = event_type
+        self.events.append(fields)
+        if self.log_events:
+            logging.debug(event_type + ' ' + ' '.join(key + '=' + str(fields[key]) for key in sorted(fields)
+                                                      if key != 'event'))
+
+    def battle_end(self, winner, rounds):
+        if self.trace_file is not None:
+            self.trace_file.write(json.dumps({'battle': self.battle, 'units': self.units, 'winner': winner,
+                                              'rounds': rounds, 'events': self.events},
+                                             separators=(',', ':')) + '\n')
+        self.events = None
+
+    def close(self):
+        if self.trace_file is not None:
+            self.trace_file.close()
+
+battle_profile = None  # BattleProfile while profiling; always check before reading the timer
+
+
+class BattleProfile(object):
+    # Time spent in each phase of the scalar battle loop, event counts, and battles/sec for each cell
+
+    def __init__(self):
+        self.phase_times = dict((phase, 0.0) for phase in PROFILE_PHASES)
+        self.battles = 0
+        self.rounds = 0
+        self.crits = 0
+        self.max_rounds = 0
+        self.rhs_failures = 0
+        self.cells = []
+
+    def cell_add(self, attacker, defender, battle_runs, seconds):
+        self.cells.append({'attacker': attacker['name'], 'defender': defender['name'], 'battle_runs': battle_runs,
+                           'seconds': seconds, 'battles_per_second': battle_runs / max(seconds, 1e-9)})
+
+    def summary(self):
+        phase_times = dict(self.phase_times)
+        # damage_apply is timed from the battle loop, so it includes the apply_crit calls it makes
+        phase_times['damage_apply'] = max(0.0, phase_times['damage_apply'] - phase_times['apply_crit'])
+        battles = max(self.battles, 1)
+        return {'phase_seconds': phase_times, 'battles': self.battles, 'rounds_per_battle': float(self.rounds) / battles,
+                'crits_per_battle': float(self.crits) / battles, 'max_rounds_battles': self.max_rounds,
+                'rhs_failures': self.rhs_failures, 'cells': self.cells}
+
+    def table(self):
+        summary = self.summary()
+        total = max(sum(summary['phase_seconds'].values()), 1e-9)
+        lines = ['{0:<16}{1:>10}{2:>8}'.format('Phase', 'Seconds', 'Share')]
+        for phase in PROFILE_PHASES:
+            seconds = summary['phase_seconds'][phase]
+            lines.append('{0:<16}{1:>10.3f}{2:>7.1f}%'.format(phase, seconds, 100 * seconds / total))
+        lines.append('Battles: ' + str(summary['battles']) + ', rounds/battle: ' +
+                     str(round_half_up(summary['rounds_per_battle'], 2)) + ', crits/battle: ' +
+                     str(round_half_up(summary['crits_per_battle'], 2)) + ', battles reaching MAX_ROUNDS: ' +
+                     str(summary['max_rounds_battles']) + ', RHS failures: ' + str(summary['rhs_failures']))
+        lines.append('{0:<60}{1:>10}{2:>12}'.format('Cell', 'Battles', 'Battles/s'))
+        for cell in summary['cells']:
+            lines.append('{0:<60}{1:>10}{2:>12.0f}'.format(cell['attacker'] + ' vs ' + cell['defender'],
+                                                          cell['battle_runs'], cell['battles_per_second']))
+        return lines
+
 
 class CombatUnit(object):
+    # Built once per unit and reset() between battles rather than rebuilt
+    __slots__ = ('name', 'type', 'armor', 'armor_original', 'structure', 'structure_original', 'weapons',
+                 'weapons_original', 'movement', 'movement_original', 'motive_type', 'jump', 'skill',
+                 'skill_original', 'special', 'sa_flags', 'sa_flags_original', 'heat_damage', 'arm', 'arm_original',
+                 'other_move_mods', 'crit_table', 'motive_table', 'crits', 'heat')
 
     def __init__(self, name, unit_type=MECH, armor=1, structure=1, weapons=[0,0,0], movement=0, skill=4,
                  motive_type=0, jump=None, special=[]):
@@ -87,20 +357,49 @@ class CombatUnit(object):
         self.structure = structure
         self.structure_original = structure
         self.weapons = list(weapons)
+        self.weapons_original = tuple(weapons)
         self.movement = movement
+        self.movement_original = movement
         self.motive_type = motive_type
         self.jump = jump
         self.skill = skill
+        self.skill_original = skill
         if not (special is None):
             self.special = list(special)
         else:
             self.special = []
+        # Specials are compiled once here so the battle only does bit tests and integer reads
+        self.sa_flags = special_compile(self.special)
+        self.heat_damage = heat_damage_parse(self.special)
+        self.arm = self.special.count('ARM')
+        self.other_move_mods = 0
+        for sa in self.special:
+            if sa == 'LG' or sa == 'VLG' or sa == 'SLG':
+                self.other_move_mods -= 1
+        if self.type == PROTOMECH or self.type == BATTLEARMOR:
+            self.other_move_mods += 1
+        self.crit_table = crit_table_get(self.type, self.sa_flags & SA_CR)
+        self.motive_table = motive_table_get(self.type, self.motive_type)
+        self.sa_flags_original = self.sa_flags
+        self.arm_original = self.arm
         self.crits = []
         self.heat = 0
 
+    def reset(self):
+        # Back to the state the unit was created in, ready for the next battle
+        self.armor = self.armor_original
+        self.structure = self.structure_original
+        self.weapons[:] = self.weapons_original
+        self.movement = self.movement_original
+        self.skill = self.skill_original
+        self.sa_flags = self.sa_flags_original
+        self.arm = self.arm_original
+        del self.crits[:]
+        self.heat = 0
+
     def effective_skill(self):
         misc_bonuses = 0
-        if 'SHLD' in self.special:
+        if self.sa_flags & SA_SHLD:
             misc_bonuses += 1
         if self.jump is not None:
             if self.jump > self.movement:
@@ -112,72 +411,66 @@ class CombatUnit(object):
         return max(0, self.movement - (self.heat * 2))
 
     def movement_mod(self):
-        other_mods = 0
-        for sa in self.special:
-            if sa == 'LG' or sa == 'VLG' or sa == 'SLG':
-                other_mods -= 1
-        if self.type == PROTOMECH or self.type == BATTLEARMOR:
-            other_mods += 1
         move_mod = movement_mod(self.effective_movement())
         if self.jump is not None:
             if self.jump > self.movement:
                 move_mod = movement_mod(self.jump) + 1
-        return move_mod + other_mods
+        return move_mod + self.other_move_mods
 
-    def damage_apply(self, damage, attack_range=SHORT_RANGE, attacker_specials='', is_area_effect=False):
-        logging.debug('Applying ' + str(damage) + ' damage to ' + self.name)
+    def damage_apply(self, damage, attack_range=SHORT_RANGE, attacker=None, is_area_effect=False):
+        if battle_trace is not None:
+            battle_trace.event('damage', unit=self.name, damage=damage)
         heat_added = 0
-        if damage > 0:
-            # Check for HT#/#/#
-            for sa in attacker_specials:
-                if len(sa) >= 7:
-                    if sa[:2] == 'HT':
-                        heat_text = sa[2:]
-                        heat_array = heat_text.split('/')
-                        try:
-                            heat_added = int(heat_array[attack_range])
-                        except BaseException as why:
-                            logging.error('Error getting HT number: ' + str(why))
-        if 'RFA' in self.special:
-            if 'ENE' in attacker_specials:
-                logging.debug('Reflective Armor reduces damage by half.')
+        attacker_flags = 0
+        if attacker is not None:
+            attacker_flags = attacker.sa_flags
+            if damage > 0:
+                # HT#/#/#
+                heat_added = attacker.heat_damage[attack_range]
+        if self.sa_flags & SA_RFA:
+            if attacker_flags & SA_ENE:
+                if battle_trace is not None:
+                    battle_trace.event('reduced', unit=self.name, special='RFA')
                 damage = divide_by_two_round_up(damage)
                 heat_added = divide_by_two_round_up(heat_added)
             elif heat_added > 0:
                 heat_added = divide_by_two_round_up(heat_added)
                 damage = max(0, damage - heat_added)
-        if 'SHLD' in self.special:
+        if self.sa_flags & SA_SHLD:
             if not is_area_effect:
-                logging.debug('SHLD prevents 1 point of damage.')
-                damage = max(0, damage - 1)
-        if 'AMS' in self.special or 'RAMS' in self.special:
-            ams_active = False
-            for special in attacker_specials:
-                if special[:3] == 'LRM' or special[:3] == 'SRM' or special[:2] == 'IF':
-                    ams_active = True
-            if ams_active:
-                logging.debug('AMS prevents 1 point of damage.')
+                if battle_trace is not None:
+                    battle_trace.event('reduced', unit=self.name, special='SHLD')
                 damage = max(0, damage - 1)
+        if self.sa_flags & SA_AMS and attacker_flags & SA_MISSILES:
+            if battle_trace is not None:
+                battle_trace.event('reduced', unit=self.name, special='AMS')
+            damage = max(0, damage - 1)
         if heat_added > 0 and self.type != MECH:
             # Not a heat-tracking unit; added HT to Damage
             damage += heat_added
             heat_added = 0
         if damage <= self.armor:
             self.armor -= damage
-            logging.debug(str(damage) + ' applied to armor; ' + str(self.armor) + ' armor remaining.')
+            if battle_trace is not None:
+                battle_trace.event('armor', unit=self.name, damage=damage, armor=self.armor)
         else:
-            if self.armor > 0:
-                # Don't want to see this message unless there was armor before the hit.
-                logging.debug('Armor destroyed.')
             damage -= self.armor
             self.armor = 0
             if damage < self.structure:
                 self.structure -= damage
-                logging.debug(str(damage) + ' applied to structure; ' + str(self.structure) + ' structure remaining.')
-                self.apply_crit(two_d6())
+                if battle_trace is not None:
+                    battle_trace.event('structure', unit=self.name, damage=damage, structure=self.structure)
+                if battle_profile is not None:
+                    phase_start = timeit.default_timer()
+                    self.apply_crit(two_d6())
+                    battle_profile.crits += 1
+                    battle_profile.phase_times['apply_crit'] += timeit.default_timer() - phase_start
+                else:
+                    self.apply_crit(two_d6())
             else:
                 self.structure = 0
-                logging.info('Unit ' + self.name + ' destroyed.')
+                if battle_trace is not None:
+                    battle_trace.event('destroyed', unit=self.name)
         if self.structure > 0 and self.type == MECH and heat_added > 0:
             # Add heat, but not more than 2
             self.heat_apply(min(heat_added, 2))
@@ -185,7 +478,8 @@ class CombatUnit(object):
     def heat_apply(self, heat):
         if self.type == MECH:
             self.heat += heat
-            logging.debug(self.name + ' new heat: ' + str(self.heat))
+            if battle_trace is not None:
+                battle_trace.event('heat', unit=self.name, heat=self.heat)
             return self.heat
         else:
             logging.error('Tried to add heat to a non-heat-tracking unit.')
@@ -193,143 +487,156 @@ class CombatUnit(object):
 
     def heat_remove(self):
         if self.type == MECH and self.structure > 0:
-            logging.debug(self.name + ' cooling off.')
+            if battle_trace is not None:
+                battle_trace.event('heat', unit=self.name, heat=0)
             self.heat = 0
 
     def motive_check(self):
-        if self.type == VEHICLE:
+        if self.motive_table is not None:
             motive_roll = two_d6()
-            if self.motive_type == WHEELED or self.motive_type == HOVER:
-                motive_roll += 1
-            elif self.motive_type == VTOL or self.motive_type == WIGE:
-                motive_roll += 2
-            if motive_roll == 9 or motive_roll == 10:
-                self.movement = max(0, self.movement - 2)
-                logging.info(self.name + ' Motive hit: movement reduced to ' + str(self.movement))
-            elif motive_roll == 11:
-                movement_loss = divide_by_two_round_up(self.movement)
-                self.movement -= movement_loss
-                logging.info(self.name + 'Motive hit: movement reduced to ' + str(self.movement))
-            elif motive_roll == 12:
-                self.movement = 0
-                logging.info(self.name + 'Motive hit: movement reduced to 0')
-            else:
-                logging.debug('Motive hit: No effect.')
+            self.movement = motive_movement(self.movement, self.motive_table[motive_roll])
+            if battle_trace is not None:
+                battle_trace.event('motive', unit=self.name, roll=motive_roll, movement=self.movement)
 
     def apply_crit(self, crit_roll):
-        for sa in self.special:
-            if sa == 'ARM':
-                logging.debug('Armored Component: ignoring crit, and crossing off ARM.')
-                self.special.remove('ARM')
+        if self.arm > 0:
+            if battle_trace is not None:
+                battle_trace.event('crit', unit=self.name, roll=crit_roll, effect='ARM')
+            self.arm -= 1
+            return
+        if self.crit_table is None:
+            return
+        crit = self.crit_table[crit_roll]
+        if battle_trace is not None:
+            battle_trace.event('crit', unit=self.name, roll=crit_roll, effect=CRIT_NAMES[crit])
+        if crit == CRIT_NONE:
+            return
+        elif crit == CRIT_AMMO_EXPLOSION:
+            if self.sa_flags & (SA_ENE | SA_CASEII):
                 return
-        if 'CR' in self.special:
-            logging.debug('Critical Resistant: -2 to crit roll')
-            crit_roll -= 2
-        if self.type == MECH:
-            if crit_roll == 2:
-                logging.debug('Ammo Explosion!')
-                if 'ENE' in self.special or 'CASEII' in self.special:
-                    logging.debug('Ignored due to ENE special.')
-                elif 'CASE' in self .special:
-                    logging.debug('CASE. Appling 1 extra damage.')
-                    self.damage_apply(1)
-                else:
-                    logging.debug('Unit destroyed.')
-                    self.structure = 0
-            elif crit_roll == 3 or crit_roll == 11:
-                logging.debug('Engine hit')
-                if 'Engine hit' in self.crits:
-                    logging.debug('Second engine hit; unit destroyed.')
-                    self.structure = 0
-                else:
-                    self.crits.append('Engine hit')
-            elif crit_roll == 4 or crit_roll == 10:
-                logging.debug('Fire Control hit')
-                self.skill += 2
-            elif crit_roll == 6 or crit_roll == 8:
-                logging.debug('Weapon hit')
-                for range_band in [0, 1, 2]:
-                    self.weapons[range_band] = max(0, self.weapons[range_band] - 1)
-                logging.debug('Weapons now ' + str(self.weapons))
-            elif crit_roll == 7:
-                logging.debug('MP Hit')
-                movement_loss = max(2, divide_by_two_round_up(self.movement))
-                self.movement = max(0, self.movement - movement_loss)
-                logging.debug('New movement mod: ' + str(self.movement_mod()))
-            elif crit_roll == 12:
-                logging.debug('Unit destroyed.')
+            elif self.sa_flags & SA_CASE:
+                self.damage_apply(1)
+            else:
+                self.structure = 0
+        elif crit == CRIT_ENGINE:
+            if 'Engine hit' in self.crits:
                 self.structure = 0
             else:
-                logging.debug('No crit.')
-        elif self.type == VEHICLE:
-            if crit_roll == 2:
-                logging.debug('Ammo Explosion!')
-                if 'ENE' in self.special or 'CASEII' in self.special:
-                    logging.debug('Ignored due to ENE special.')
-                elif 'CASE' in self .special:
-                    logging.debug('CASE. Appling 1 extra damage.')
-                    self.damage_apply(1)
-                else:
-                    logging.debug('Unit destroyed.')
-                    self.structure = 0
-            elif crit_roll == 3:
-                logging.debug('Crew Stunned')
-                self.crits.append('Crew Stunned')
-            elif crit_roll == 4 or crit_roll == 5:
-                logging.debug('Fire Control hit')
-                self.skill += 2
-            elif crit_roll == 9 or crit_roll == 10:
-                logging.debug('Weapon hit')
-                for range_band in [0, 1, 2]:
-                    self.weapons[range_band] = max(0, self.weapons[range_band] - 1)
-                logging.debug('Weapons now ' + str(self.weapons))
-            elif crit_roll == 11:
-                logging.debug('Crew killed!')
+                self.crits.append('Engine hit')
+        elif crit == CRIT_VEHICLE_ENGINE:
+            if 'Engine Hit' in self.crits:
                 self.structure = 0
-            elif crit_roll == 12:
-                logging.debug('Engine Hit.')
-                if 'Engine Hit' in self.crits:
-                    logging.debug('Second hit; vehicle destroyed.')
-                    self.structure = 0
-                else:
-                    self.crits.append('Engine Hit')
-                    self.movement = divide_by_two_round_up(self.movement)
-                    logging.debug('New movement mod: ' + str(self.movement_mod()))
-                    for range_band in [0, 1, 2]:
-                        self.weapons[range_band] = divide_by_two_round_up(self.weapons[range_band])
             else:
-                logging.debug('No crit.')
-        elif self.type == PROTOMECH:
-            logging.debug('Crits not yet implemented for Protomechs')
-            # TODO - implement protomech crits
+                self.crits.append('Engine Hit')
+                self.movement = divide_by_two_round_up(self.movement)
+                for range_band in [0, 1, 2]:
+                    self.weapons[range_band] = divide_by_two_round_up(self.weapons[range_band])
+        elif crit == CRIT_FIRE_CONTROL:
+            self.skill += 2
+        elif crit == CRIT_WEAPON:
+            for range_band in [0, 1, 2]:
+                self.weapons[range_band] = max(0, self.weapons[range_band] - 1)
+        elif crit == CRIT_MP:
+            movement_loss = max(2, divide_by_two_round_up(self.movement))
+            self.movement = max(0, self.movement - movement_loss)
+        elif crit == CRIT_CREW_STUNNED:
+            self.crits.append('Crew Stunned')
+        elif crit == CRIT_DESTROYED or crit == CRIT_CREW_KILLED:
+            self.structure = 0
+        if self.structure == 0 and battle_trace is not None:
+            battle_trace.event('destroyed', unit=self.name)
 
     def crit_clear(self):
         for crit in self.crits[:]:
             if crit in ['Crew Stunned']:
                 self.crits.remove(crit)
-                logging.debug('Crit expired: ' + crit)
+                if battle_trace is not None:
+                    battle_trace.event('crit_expired', unit=self.name, crit=crit)
 
     def state_log(self):
-        logging.debug(self.name + ': ' + str(self.armor) + '/' + str(self.structure) + ' ' +
-                      str(self.weapons) + ' SA:' + str(self.special) + ' Crits:' + str(self.crits) +
-                      ' HT:' + str(self.heat))
+        if battle_trace is not None:
+            battle_trace.event('state', unit=self.name, armor=self.armor, structure=self.structure,
+                               weapons=list(self.weapons), arm=self.arm, crits=list(self.crits), heat=self.heat)
 
     def round_complete(self):
         self.crit_clear()
-        if 'BHJ2' in self.special:
+        if self.sa_flags & SA_BHJ2:
             if self.armor > 0:
                 self.armor = max(self.armor_original, self.armor + 1)
-                logging.debug('Using BHJ2 to restore 1 point of armor.')
-        elif 'BHJ3' in self.special:
+                if battle_trace is not None:
+                    battle_trace.event('armor_repair', unit=self.name, armor=self.armor)
+        elif self.sa_flags & SA_BHJ3:
             if self.armor > 0:
                 self.armor = max(self.armor_original, self.armor + 2)
-                logging.debug('Using BHJ3 to restore 2 points of armor.')
-        if 'RHS' in self.special and self.heat > 0:
-            logging.debug('Using RHS to cool down.')
+                if battle_trace is not None:
+                    battle_trace.event('armor_repair', unit=self.name, armor=self.armor)
+        if self.sa_flags & SA_RHS and self.heat > 0:
             self.heat -= 1
-            if random.randint(1, 6) == 1:
-                logging.info('RHS check rolled a 1. Disabling RHS.')
-                self.special.remove('RHS')
+            if battle_trace is not None:
+                battle_trace.event('heat', unit=self.name, heat=self.heat)
+            if dice.d6() == 1:
+                if battle_trace is not None:
+                    battle_trace.event('rhs_failed', unit=self.name)
+                if battle_profile is not None:
+                    battle_profile.rhs_failures += 1
+                self.sa_flags &= ~SA_RHS
+
+
+def crit_table_get(unit_type, crit_resistant=False):
+    # Crit effect for each unmodified 2d6 roll, or None for unit types without crits
+    if unit_type not in CRIT_TABLES:
+        return None
+    if crit_resistant:
+        return [CRIT_TABLES[unit_type][max(0, crit_roll - 2)] for crit_roll in range(0, 13)]
+    return list(CRIT_TABLES[unit_type])
+
+
+def motive_table_get(unit_type, motive_type):
+    # Motive effect for each unmodified 2d6 roll, or None for units that don't check motive
+    if unit_type != VEHICLE:
+        return None
+    return [MOTIVE_TABLE[motive_roll + MOTIVE_ROLL_MODS.get(motive_type, 0)] for motive_roll in range(0, 13)]
+
+
+def effect_distribution(effect_table):
+    # [(chance, effect)] for a 2d6 roll on a crit or motive table
+    chances = collections.OrderedDict()
+    for roll, odds in TWO_D6_ODDS:
+        chances[effect_table[roll]] = chances.get(effect_table[roll], 0) + odds
+    return [(chance, effect) for effect, chance in chances.items()]
+
+
+def motive_movement(movement, motive):
+    if motive == MOTIVE_MINUS_2:
+        return max(0, movement - 2)
+    elif motive == MOTIVE_HALVED:
+        return movement - divide_by_two_round_up(movement)
+    elif motive == MOTIVE_IMMOBILE:
+        return 0
+    return movement
+
+
+def special_compile(special):
+    sa_flags = 0
+    for sa in special:
+        sa_flags |= SA_FLAGS.get(sa, 0)
+        if sa[:3] == 'LRM' or sa[:3] == 'SRM' or sa[:2] == 'IF':
+            sa_flags |= SA_MISSILES
+    return sa_flags
+
+
+def heat_damage_parse(special):
+    # Mirror damage_apply's HT#/#/# scan: the last readable HT entry wins for each range band
+    heat_damage = [0, 0, 0]
+    for sa in special:
+        if len(sa) >= 7 and sa[:2] == 'HT':
+            heat_array = sa[2:].split('/')
+            for range_band in [SHORT_RANGE, MEDIUM_RANGE, LONG_RANGE]:
+                try:
+                    heat_damage[range_band] = int(heat_array[range_band])
+                except (ValueError, IndexError) as why:
+                    logging.error('Error getting HT number: ' + str(why))
+    return heat_damage
 
 
 def unit_create_from_dict(stat_dict):
@@ -366,7 +673,7 @@ def unit_create_from_dict(stat_dict):
     try:
         unit_skill = stat_dict['skill']
     except KeyError:
-        unit_skill = 4
+        unit_skill = int(config['skill_default'])
     try:
         unit_motive = stat_dict['motive']
     except KeyError:
@@ -384,13 +691,140 @@ def unit_create_from_dict(stat_dict):
 
 
 def unit_list_read_from_json(json_path):
-    with open(json_path) as json_data:
-        units = json_load_byteified(json_data)
+    return unit_catalog_load(json_path, config['catalog']['cache']).units
+
+
+class UnitCatalog(object):
+    # A unit list plus an index of unit names
+
+    def __init__(self, units):
+        self.units = units
+        self.index = {}
+        for position, unit in enumerate(units):
+            # The first unit with a name wins, as it did when lists were searched front to back
+            if unit['name'] not in self.index:
+                self.index[unit['name']] = position
+
+    def unit_get(self, name):
+        try:
+            return self.units[self.index[name]]
+        except KeyError:
+            raise RuntimeError('Unit "' + name + '" not found in unit list.')
+
+
+def unit_catalog_load(json_path, use_cache=True):
+    # Reads the unit list from its sidecar cache (json_path + '.catalog') if the list hasn't changed since the sidecar
+    # was written, otherwise streams the JSON and rewrites the sidecar
+    sidecar_path = json_path + '.catalog'
+    source_stat = os.stat(json_path)
+    header = {'catalog_version': CATALOG_VERSION, 'python': sys.version_info[0], 'mtime': source_stat.st_mtime,
+              'size': source_stat.st_size}
+    if use_cache:
+        units = catalog_sidecar_read(sidecar_path, json_path, header)
+        if units is not None:
+            logging.debug('Reading unit list ' + json_path + ' from ' + sidecar_path)
+            return UnitCatalog(units)
     logging.debug('Reading unit list ' + json_path)
+    units = list(unit_list_stream(json_path))
+    if use_cache:
+        header['sha256'] = file_sha256(json_path)
+        catalog_sidecar_write(sidecar_path, header, units)
+    return UnitCatalog(units)
+
+
+def catalog_sidecar_read(sidecar_path, json_path, header):
+    # The sidecar is a pickled header followed by the pickled units, so a stale one is spotted without loading units.
+    # Same mtime and size means unchanged; otherwise a matching hash of the list (e.g. after a touch or checkout) does.
+    if not os.path.isfile(sidecar_path):
+        return None
+    try:
+        with open(sidecar_path, 'rb') as sidecar_file:
+            sidecar_header = pickle.load(sidecar_file)
+            for key in ['catalog_version', 'python', 'size']:
+                if sidecar_header.get(key) != header[key]:
+                    return None
+            if sidecar_header['mtime'] != header['mtime'] and sidecar_header['sha256'] != file_sha256(json_path):
+                return None
+            units = pickle.load(sidecar_file)
+    except BaseException as why:
+        logging.debug('Ignoring unit catalog ' + sidecar_path + ' - ' + str(why))
+        return None
+    if sidecar_header['mtime'] != header['mtime']:
+        # Only the mtime moved; record it so the next launch doesn't hash the list again
+        sidecar_header['mtime'] = header['mtime']
+        catalog_sidecar_write(sidecar_path, sidecar_header, units)
     return units
 
 
+def catalog_sidecar_write(sidecar_path, header, units):
+    try:
+        with open(sidecar_path, 'wb') as sidecar_file:
+            pickle.dump(header, sidecar_file, pickle.HIGHEST_PROTOCOL)
+            pickle.dump(units, sidecar_file, pickle.HIGHEST_PROTOCOL)
+    except BaseException as why:
+        logging.debug('Unable to write unit catalog ' + sidecar_path + ' - ' + str(why))
+
+
+def file_sha256(file_path):
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as hashed_file:
+        for block in iter(lambda: hashed_file.read(CATALOG_CHUNK_SIZE), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def unit_list_stream(json_path, chunk_size=CATALOG_CHUNK_SIZE):
+    # Yields the units of a JSON list one at a time, reading the file in chunks rather than holding all of its text
+    decoder = json.JSONDecoder()
+    with open(json_path) as json_file:
+        buffer = ''
+        position = 0
+        end_of_file = False
+        expected = '['  # '[' before the first unit, ',' or ']' after each one, None where a unit (or ']') is next
+        first_unit = True
+        while True:
+            position = JSON_WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                if end_of_file:
+                    raise ValueError('Unit list ' + json_path + ' ends unexpectedly')
+                buffer = json_file.read(chunk_size)
+                position = 0
+                end_of_file = len(buffer) == 0
+                continue
+            if expected is not None:
+                if buffer[position] == ']' and expected == ',':
+                    return
+                if buffer[position] != expected:
+                    raise ValueError('Unit list ' + json_path + ' should have "' + expected + '" at "' +
+                                     buffer[position:position + 20] + '"')
+                position += 1
+                expected = None
+                continue
+            if buffer[position] == ']' and first_unit:
+                return
+            try:
+                unit, position = decoder.raw_decode(buffer, position)
+            except ValueError:
+                # The unit runs past the end of the buffer; read on and try again
+                if end_of_file:
+                    raise
+                chunk = json_file.read(chunk_size)
+                end_of_file = len(chunk) == 0
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            expected = ','
+            first_unit = False
+            if PY3:
+                yield unit
+            else:
+                yield _byteify(unit)
+
+
 def json_load_byteified(file_handle):
+    # Python 3 strings are already text, so only Python 2 needs the unicode -> str pass
+    if PY3:
+        return json.load(file_handle)
     return _byteify(
         json.load(file_handle, object_hook=_byteify),
         ignore_dicts=True
@@ -398,6 +832,8 @@ def json_load_byteified(file_handle):
 
 
 def json_loads_byteified(json_text):
+    if PY3:
+        return json.loads(json_text)
     return _byteify(
         json.loads(json_text, object_hook=_byteify),
         ignore_dicts=True
@@ -416,7 +852,7 @@ def _byteify(data, ignore_dicts=False):
     if isinstance(data, dict) and not ignore_dicts:
         return {
             _byteify(key, ignore_dicts=True): _byteify(value, ignore_dicts=True)
-            for key, value in data.iteritems()
+            for key, value in data.items()
         }
     # if it's anything else, return it in its original form
     return data
@@ -444,7 +880,23 @@ def movement_mod(movement, jumped=False):
 
 
 def divide_by_two_round_up(x):
-    return int(round(float(x)/2))
+    # Halves round up, as Python 2's round() did; Python 3's round() sends them to the even number
+    return int(math.floor(x / 2.0 + 0.5))
+
+
+def round_half_up(value, digits=0):
+    # Python 2's round() for reports: Python 3 rounds exact halves (8.25 -> 8.2) to even, which would change the output
+    if PY3:
+        return float(decimal.Decimal(value).quantize(decimal.Decimal(1).scaleb(-digits),
+                                                     rounding=decimal.ROUND_HALF_UP))
+    return round(value, digits)
+
+
+def output_file_open(file_path):
+    # The csv module wants a binary file on Python 2 and a text file with newline='' on Python 3
+    if PY3:
+        return open(file_path, 'w', newline='', encoding='utf-8')
+    return open(file_path, 'wb')
 
 
 def logging_configure(log_path='', log_level=10):
@@ -487,10 +939,85 @@ def logging_configure(log_path='', log_level=10):
         logging.basicConfig(level=log_level, format=log_format)
 
 
+def trace_configure(trace_path='', log_level=30):
+    # Battle events are only built when they go somewhere: a trace file, or the log at debug level
+    global battle_trace
+    battle_trace = None
+    trace_file = None
+    if len(trace_path) > 0:
+        try:
+            trace_file = open(trace_path, 'w')
+        except IOError as why:
+            logging.error('Unable to open trace file ' + trace_path + ' - ' + str(why))
+    if trace_file is not None or log_level <= 10:
+        battle_trace = BattleTrace(trace_file, log_events=log_level <= 10)
+
+
+class DiceSource(object):
+    # Every roll the scalar engine makes, pre-generated in bulk buffers from one seeded generator.
+    # Reseeding gives an independent, reproducible stream; each matchup reseeds with its own cell seed.
+
+    def __init__(self, seed=None, buffer_size=DICE_BUFFER_SIZE):
+        self.reseed(seed, buffer_size=buffer_size)
+
+    def reseed(self, seed=None, mirrored=False, buffer_size=DICE_BUFFER_SIZE):
+        # mirrored gives the antithetic stream of the same seed: each die shows 7 - roll and each chance is 1 - chance
+        self.mirrored = mirrored
+        self.buffer_size = buffer_size
+        if numpy is not None:
+            self.generator = numpy.random.RandomState(seed)
+        else:
+            self.generator = random.Random(seed)
+        self.two_d6_rolls = []
+        self.d6_rolls = []
+        self.d100_rolls = []
+        self.chance_rolls = []
+
+    def rolls(self, low, high, dice=1):
+        # buffer_size sums of dice rolls of low..high inclusive
+        if numpy is not None:
+            rolls = self.generator.randint(low, high + 1, size=(dice, self.buffer_size)).sum(axis=0).tolist()
+        else:
+            # random() rather than randint(), whose algorithm changed in Python 3, so a seed rolls the same on either
+            sides = high - low + 1
+            rolls = [sum(low + int(self.generator.random() * sides) for die in range(dice))
+                     for roll in range(self.buffer_size)]
+        if self.mirrored:
+            return [(low + high) * dice - roll for roll in rolls]
+        return rolls
+
+    def two_d6(self):
+        if not self.two_d6_rolls:
+            self.two_d6_rolls = self.rolls(1, 6, dice=2)
+        return self.two_d6_rolls.pop()
+
+    def d6(self):
+        if not self.d6_rolls:
+            self.d6_rolls = self.rolls(1, 6)
+        return self.d6_rolls.pop()
+
+    def d100(self):
+        if not self.d100_rolls:
+            self.d100_rolls = self.rolls(1, 100)
+        return self.d100_rolls.pop()
+
+    def chance(self):
+        # Uniform in [0, 1)
+        if not self.chance_rolls:
+            if numpy is not None:
+                self.chance_rolls = self.generator.random_sample(self.buffer_size).tolist()
+            else:
+                self.chance_rolls = [self.generator.random() for roll in range(self.buffer_size)]
+            if self.mirrored:
+                self.chance_rolls = [1.0 - chance for chance in self.chance_rolls]
+        return self.chance_rolls.pop()
+
+
+dice = DiceSource()
+
+
 def two_d6():
-    die1 = random.randint(1, 6)
-    die2 = random.randint(1, 6)
-    return die1 + die2
+    return dice.two_d6()
 
 
 def dice_test(times_to_roll):
@@ -508,12 +1035,9 @@ def dice_test(times_to_roll):
 def roll_to_hit(skill, range_mod, def_mod, terrain=0):
     target_number = skill + range_mod + def_mod + terrain
     die_roll = two_d6()
-    if die_roll >= target_number:
-        logging.debug('Hit! (Needed ' + str(target_number) + ', rolled ' + str(die_roll) + ')')
-        return True
-    else:
-        logging.debug('Miss! (Needed ' + str(target_number) + ', rolled ' + str(die_roll) + ')')
-        return False
+    if battle_trace is not None:
+        battle_trace.event('to_hit', target_number=target_number, roll=die_roll, hit=die_roll >= target_number)
+    return die_roll >= target_number
 
 
 def probability_to_hit(target_number):
@@ -547,32 +1071,122 @@ def average_damage(base_damage, target_number):
     return float(base_damage) * probability_to_hit(target_number)
 
 
+range_tables = {}  # (base target number, weapons) -> [(hit chance, expected damage)] for each range band
+range_decisions = {}  # Range choices, keyed by the algorithm and the few numbers the choice depends on
+
+
+def range_table(weapons, base_target_number):
+    # Hit chance and expected damage of weapons at each range band, against base_target_number plus the range mod
+    key = (base_target_number, weapons[SHORT_RANGE], weapons[MEDIUM_RANGE], weapons[LONG_RANGE])
+    try:
+        return range_tables[key]
+    except KeyError:
+        table = []
+        for range_band in [SHORT_RANGE, MEDIUM_RANGE, LONG_RANGE]:
+            target_number = base_target_number + (2 * range_band)
+            table.append((probability_to_hit(target_number), average_damage(weapons[range_band], target_number)))
+        range_tables[key] = table
+        return table
+
+
 def range_for_least_defender_damage(attacker, defender):
-    # set "minimum damage" to 100 for all range bands, since that's much higher than any unit can have
-    attacker_damage = [100, 100, 100]
-    for attacker_range in [SHORT_RANGE, MEDIUM_RANGE, LONG_RANGE]:
-        if defender.weapons[attacker_range] > 0:
-            # Only check if the defender can shoot back
-            target_number = attacker.effective_skill() + (2 * attacker_range) + defender.movement_mod()
-            attacker_damage[attacker_range] = average_damage(defender.weapons[attacker_range], target_number)
-    if attacker_damage[SHORT_RANGE] < attacker_damage[MEDIUM_RANGE]:
-        if attacker_damage[SHORT_RANGE] < attacker_damage[LONG_RANGE]:
-            logging.debug('Best range for defender is short. '
-                          'Expected received damage = ' + str(round(attacker_damage[SHORT_RANGE], 2)))
-            return SHORT_RANGE
+    base_target_number = attacker.effective_skill() + defender.movement_mod()
+    key = (FAST_UNIT_MINIMIZES_DAMAGE, base_target_number, tuple(defender.weapons))
+    try:
+        best_range, best_damage = range_decisions[key]
+    except KeyError:
+        table = range_table(defender.weapons, base_target_number)
+        # set "minimum damage" to 100 for all range bands, since that's much higher than any unit can have
+        attacker_damage = [100, 100, 100]
+        for attacker_range in [SHORT_RANGE, MEDIUM_RANGE, LONG_RANGE]:
+            if defender.weapons[attacker_range] > 0:
+                # Only check if the defender can shoot back
+                attacker_damage[attacker_range] = table[attacker_range][1]
+        if attacker_damage[SHORT_RANGE] < attacker_damage[MEDIUM_RANGE]:
+            if attacker_damage[SHORT_RANGE] < attacker_damage[LONG_RANGE]:
+                best_range = SHORT_RANGE
+            else:
+                best_range = LONG_RANGE
         else:
-            logging.debug('Best range for defender is long. '
-                          'Expected received damage = ' + str(round(attacker_damage[LONG_RANGE], 2)))
-            return LONG_RANGE
+            if attacker_damage[MEDIUM_RANGE] < attacker_damage[LONG_RANGE]:
+                best_range = MEDIUM_RANGE
+            else:
+                best_range = LONG_RANGE
+        best_damage = attacker_damage[best_range]
+        range_decisions[key] = (best_range, best_damage)
+    if battle_trace is not None:
+        battle_trace.event('best_range', range_band=best_range, expected_damage=round_half_up(best_damage, 2))
+    return best_range
+
+
+def range_for_chooser(range_algorithm, chooser, opponent):
+    # The band the unit that picks the range wants.
+    # Minimize hit chance: a band the chooser can shoot at, then the opponent's lowest chance to hit (0 where it has
+    # no weapons), then the most damage dealt. Maximize damage: the most damage dealt, then the least taken.
+    # Remaining ties go to the longer band.
+    outgoing_base = chooser.effective_skill() + opponent.movement_mod()
+    incoming_base = opponent.effective_skill() + chooser.movement_mod()
+    key = (range_algorithm, outgoing_base, tuple(chooser.weapons), incoming_base, tuple(opponent.weapons))
+    try:
+        return range_decisions[key]
+    except KeyError:
+        outgoing = range_table(chooser.weapons, outgoing_base)
+        incoming = range_table(opponent.weapons, incoming_base)
+        scores = []
+        for range_band in [SHORT_RANGE, MEDIUM_RANGE, LONG_RANGE]:
+            if range_algorithm == INITIATIVE_HELPS_FASTER_MINIMIZE_HIT_CHANCE:
+                if opponent.weapons[range_band] > 0:
+                    incoming_hit_chance = incoming[range_band][0]
+                else:
+                    incoming_hit_chance = 0.0
+                scores.append((chooser.weapons[range_band] > 0, -incoming_hit_chance, outgoing[range_band][1]))
+            else:
+                scores.append((outgoing[range_band][1], -incoming[range_band][1]))
+        best_range = LONG_RANGE
+        for range_band in [MEDIUM_RANGE, SHORT_RANGE]:
+            if scores[range_band] > scores[best_range]:
+                best_range = range_band
+        range_decisions[key] = best_range
+        return best_range
+
+
+def initiative_range_chances(unit_1, unit_2):
+    # (chance, unit picking the range, other unit). The faster unit picks unless the slower one wins initiative;
+    # at equal speeds the initiative winner picks. An immobile unit never picks.
+    if unit_1.movement == unit_2.movement:
+        return [(0.5, unit_1, unit_2), (0.5, unit_2, unit_1)]
+    if unit_1.movement > unit_2.movement:
+        faster_unit = unit_1
+        slower_unit = unit_2
     else:
-        if attacker_damage[MEDIUM_RANGE] < attacker_damage[LONG_RANGE]:
-            logging.debug('Best range for defender is medium. '
-                          'Expected received damage = ' + str(round(attacker_damage[MEDIUM_RANGE], 2)))
-            return MEDIUM_RANGE
-        else:
-            logging.debug('Best range for defender is long. '
-                          'Expected received damage = ' + str(round(attacker_damage[LONG_RANGE], 2)))
-            return LONG_RANGE
+        faster_unit = unit_2
+        slower_unit = unit_1
+    if slower_unit.movement == 0:
+        return [(1.0, faster_unit, slower_unit)]
+    return [(1.0 - INITIATIVE_SLOWER_WINS, faster_unit, slower_unit),
+            (INITIATIVE_SLOWER_WINS, slower_unit, faster_unit)]
+
+
+def initiative_range_chooser(unit_1, unit_2):
+    # Rolls the initiative that initiative_range_chances describes: 2d6 each, ties to the faster unit, or rerolled
+    # at equal speeds. Returns (unit picking the range, other unit).
+    if unit_1.movement == unit_2.movement:
+        first_roll = second_roll = 0
+        while first_roll == second_roll:
+            first_roll = dice.two_d6()
+            second_roll = dice.two_d6()
+        if first_roll > second_roll:
+            return unit_1, unit_2
+        return unit_2, unit_1
+    if unit_1.movement > unit_2.movement:
+        faster_unit = unit_1
+        slower_unit = unit_2
+    else:
+        faster_unit = unit_2
+        slower_unit = unit_1
+    if slower_unit.movement > 0 and dice.two_d6() > dice.two_d6():
+        return slower_unit, faster_unit
+    return faster_unit, slower_unit
 
 
 def range_get(range_algorithm, current_round, range_previous, unit_1, unit_2):
@@ -586,7 +1200,7 @@ def range_get(range_algorithm, current_round, range_previous, unit_1, unit_2):
         return MEDIUM_RANGE
     elif range_algorithm == RANDOM_RANGE:
         # Randomly choose between short and medium range
-        range_roll = random.randint(1, 100)
+        range_roll = dice.d100()
         if range_roll <= 10:
             return SHORT_RANGE
         elif range_roll <= 70:
@@ -602,22 +1216,24 @@ def range_get(range_algorithm, current_round, range_previous, unit_1, unit_2):
             slower_unit = unit_1
         speed_difference = abs(unit_1.movement - unit_2.movement)
         if speed_difference == 0:
-            logging.debug('Range calc: No speed difference; stick to long range for first 2 rounds, then medium.')
+            if battle_trace is not None:
+                battle_trace.event('range_reason', reason='No speed difference')
             if current_round <= 2:
                 return LONG_RANGE
             else:
                 return MEDIUM_RANGE
         elif slower_unit.movement == 0:
-            logging.debug('Range calc: Slower unit immobilized. '
-                          'Faster unit picks longest range at which it can deal damage.')
+            if battle_trace is not None:
+                battle_trace.event('range_reason', reason='Slower unit immobilized')
             if faster_unit.weapons[LONG_RANGE] > 0:
                 return LONG_RANGE
             elif faster_unit.weapons[MEDIUM_RANGE] > 0:
                 return MEDIUM_RANGE
             else:
                 return SHORT_RANGE
-        elif current_round < 36/slower_unit.movement:
-            logging.debug('Range calc: On approach. Longest range at which faster unit has weapons.')
+        elif current_round < 36 // slower_unit.movement:
+            if battle_trace is not None:
+                battle_trace.event('range_reason', reason='On approach')
             if faster_unit.weapons[LONG_RANGE] > 0:
                 return LONG_RANGE
             elif faster_unit.weapons[MEDIUM_RANGE] > 0:
@@ -625,8 +1241,8 @@ def range_get(range_algorithm, current_round, range_previous, unit_1, unit_2):
             else:
                 return SHORT_RANGE
         else:
-            logging.debug('Range calc: Dueling. '
-                          'Assuming faster unit can remain at medium range (or short if it has no medium damage).')
+            if battle_trace is not None:
+                battle_trace.event('range_reason', reason='Dueling')
             if faster_unit.weapons[MEDIUM_RANGE] > 0:
                 return MEDIUM_RANGE
             else:
@@ -640,26 +1256,35 @@ def range_get(range_algorithm, current_round, range_previous, unit_1, unit_2):
             slower_unit = unit_1
         speed_difference = abs(unit_1.movement - unit_2.movement)
         if speed_difference == 0:
-            logging.debug('Range calc: No speed difference; stick to long range for first 2 rounds, then medium.')
+            if battle_trace is not None:
+                battle_trace.event('range_reason', reason='No speed difference')
             if current_round <= 2:
                 return LONG_RANGE
             else:
                 return MEDIUM_RANGE
         elif slower_unit.movement == 0:
-            logging.debug('Range calc: Slower unit immobilized. '
-                          'Faster unit picks range to minimize incoming damage.')
+            if battle_trace is not None:
+                battle_trace.event('range_reason', reason='Slower unit immobilized')
             return range_for_least_defender_damage(slower_unit, faster_unit)
         elif current_round == 1:
             if faster_unit.weapons[LONG_RANGE] > 0 or slower_unit.weapons[LONG_RANGE] > 0:
-                logging.debug('Range calc: First round - long range.')
+                if battle_trace is not None:
+                    battle_trace.event('range_reason', reason='First round')
                 return LONG_RANGE
             else:
-                logging.debug('Range calc: First round - no long range weapons on either side, so start at medium.')
+                if battle_trace is not None:
+                    battle_trace.event('range_reason', reason='First round, no long range weapons')
                 return MEDIUM_RANGE
         else:
-            logging.debug('Range calc: Dueling. '
-                          'Faster unit picks range to minimize incoming damage.')
+            if battle_trace is not None:
+                battle_trace.event('range_reason', reason='Dueling')
             return range_for_least_defender_damage(slower_unit, faster_unit)
+    elif range_algorithm == INITIATIVE_HELPS_FASTER_MINIMIZE_HIT_CHANCE or \
+            range_algorithm == INITIATIVE_HELPS_FASTER_MAXIMIZE_DAMAGE:
+        chooser, opponent = initiative_range_chooser(unit_1, unit_2)
+        if battle_trace is not None:
+            battle_trace.event('range_reason', reason=chooser.name + ' picks the range')
+        return range_for_chooser(range_algorithm, chooser, opponent)
 
 
 def woods_mod_calc(range_band, woods_percentages):
@@ -672,7 +1297,7 @@ def woods_mod_calc(range_band, woods_percentages):
     else:
         logging.warning('Bad range band in woods_get. Setting to short.')
         woods_percent = woods_percentages['short']
-    if random.random() * 100 < woods_percent:
+    if dice.chance() * 100 < woods_percent:
         return 2
     else:
         return 0
@@ -688,7 +1313,7 @@ def cover_mod_calc(range_band, cover_percentages):
     else:
         logging.warning('Bad range band in cover. Setting to short.')
         cover_percent = cover_percentages['short']
-    if random.random() * 100 < cover_percent:
+    if dice.chance() * 100 < cover_percent:
         return 2
     else:
         return 0
@@ -707,8 +1332,10 @@ def range_algorithm_from_text(range_algorithm_description):
         range_determination_method = FAST_UNIT_CAUSES_SLOW_APPROACH
     elif range_algorithm_description == 'fast_unit_minimizes_damage':
         range_determination_method = FAST_UNIT_MINIMIZES_DAMAGE
-    # TODO - range_determination = initiative_helps_faster_minimize_hit_chance  ***NOT YET IMPLEMENTED***
-    # TODO - range_determination = initiative_helps_faster_maximize_damage  ***NOT YET IMPLEMENTED***
+    elif range_algorithm_description == 'initiative_helps_faster_minimize_hit_chance':
+        range_determination_method = INITIATIVE_HELPS_FASTER_MINIMIZE_HIT_CHANCE
+    elif range_algorithm_description == 'initiative_helps_faster_maximize_damage':
+        range_determination_method = INITIATIVE_HELPS_FASTER_MAXIMIZE_DAMAGE
     else:
         logging.warning('Undefined range determination option: ' + range_algorithm_description + '; setting to short.')
         range_determination_method = SHORT_RANGE
@@ -716,34 +1343,48 @@ def range_algorithm_from_text(range_algorithm_description):
 
 
 def one_vs_one(first_unit, second_unit):
+    if battle_trace is not None:
+        battle_trace.battle_start(first_unit, second_unit)
+    profiling = battle_profile is not None
     round_count = 0
     range_algorithm = range_algorithm_from_text(config['range_determination'])
     range_previous = LONG_RANGE
     while first_unit.structure > 0 and second_unit.structure > 0:
         round_count += 1
-        logging.debug('========== ROUND ' + str(round_count) + ' ==========')
+        if battle_trace is not None:
+            battle_trace.event('round', round=round_count)
+        if profiling:
+            phase_start = timeit.default_timer()
         range_band = range_get(range_algorithm, round_count, range_previous, first_unit, second_unit)
+        if profiling:
+            battle_profile.phase_times['range_get'] += timeit.default_timer() - phase_start
+        if battle_trace is not None:
+            battle_trace.event('range', range_band=range_band)
         range_mod = 2 * range_band
         range_previous = range_band
         woods_mod = woods_mod_calc(range_band, config['woods_percent'])
         first_unit_cover_mod = cover_mod_calc(range_band, config['cover_percent'])
         second_unit_cover_mod = cover_mod_calc(range_band, config['cover_percent'])
+        if profiling:
+            phase_start = timeit.default_timer()
         if first_unit.heat <= int(config['max_tolerable_heat']):
             # Compute first unit mods and roll to hit
             if first_unit.movement_mod() == 0:
                 first_unit_mods = -1
             else:
                 first_unit_mods = 0
-            if 'STL' in second_unit.special:
+            if second_unit.sa_flags & SA_STL:
                 first_unit_mods += int(float(range_mod) / 2)
-            logging.debug(first_unit.name + ' shoots ' + second_unit.name)
+            if battle_trace is not None:
+                battle_trace.event('shoot', unit=first_unit.name, target=second_unit.name)
             second_unit_was_hit = roll_to_hit(first_unit.effective_skill() + first_unit_mods,
                                               range_mod,
                                               second_unit.movement_mod(),
                                               terrain=woods_mod + second_unit_cover_mod)
             first_unit_fired = True
         else:
-            logging.debug(first_unit.name + ' overheated; does not fire.')
+            if battle_trace is not None:
+                battle_trace.event('overheated', unit=first_unit.name)
             first_unit_fired = False
             second_unit_was_hit = False
         if second_unit.heat <= int(config['max_tolerable_heat']):
@@ -752,26 +1393,41 @@ def one_vs_one(first_unit, second_unit):
                 second_unit_mods = -1
             else:
                 second_unit_mods = 0
-            if 'STL' in first_unit.special:
+            if first_unit.sa_flags & SA_STL:
                 second_unit_mods += int(float(range_mod) / 2)
-            logging.debug(second_unit.name + ' shoots ' + first_unit.name)
+            if battle_trace is not None:
+                battle_trace.event('shoot', unit=second_unit.name, target=first_unit.name)
             first_unit_was_hit = roll_to_hit(second_unit.effective_skill() + second_unit_mods,
                                              range_mod,
                                              first_unit.movement_mod(),
                                              terrain=woods_mod + first_unit_cover_mod)
             second_unit_fired = True
         else:
-            logging.debug(first_unit.name + ' overheated; does not fire.')
+            if battle_trace is not None:
+                battle_trace.event('overheated', unit=second_unit.name)
             second_unit_fired = False
             first_unit_was_hit = False
+        if profiling:
+            battle_profile.phase_times['to_hit'] += timeit.default_timer() - phase_start
         first_unit_weapons = int(first_unit.weapons[range_band])
         second_unit_weapons = int(second_unit.weapons[range_band])
-        if first_unit_was_hit:
-            first_unit.motive_check()
-            first_unit.damage_apply(second_unit_weapons, attack_range=range_band, attacker_specials=second_unit.special)
-        if second_unit_was_hit:
-            second_unit.motive_check()
-            second_unit.damage_apply(first_unit_weapons, attack_range=range_band, attacker_specials=first_unit.special)
+        if profiling:
+            for unit, was_hit, damage, attacker in [(first_unit, first_unit_was_hit, second_unit_weapons, second_unit),
+                                                    (second_unit, second_unit_was_hit, first_unit_weapons, first_unit)]:
+                if was_hit:
+                    phase_start = timeit.default_timer()
+                    unit.motive_check()
+                    phase_middle = timeit.default_timer()
+                    unit.damage_apply(damage, attack_range=range_band, attacker=attacker)
+                    battle_profile.phase_times['motive_check'] += phase_middle - phase_start
+                    battle_profile.phase_times['damage_apply'] += timeit.default_timer() - phase_middle
+        else:
+            if first_unit_was_hit:
+                first_unit.motive_check()
+                first_unit.damage_apply(second_unit_weapons, attack_range=range_band, attacker=second_unit)
+            if second_unit_was_hit:
+                second_unit.motive_check()
+                second_unit.damage_apply(first_unit_weapons, attack_range=range_band, attacker=first_unit)
         # End Phase
         if first_unit_fired and ('Engine hit' in first_unit.crits):
             first_unit.heat_apply(1)
@@ -781,12 +1437,18 @@ def one_vs_one(first_unit, second_unit):
             second_unit.heat_apply(1)
         elif not second_unit_fired:
             second_unit.heat_remove()
+        if profiling:
+            phase_start = timeit.default_timer()
         first_unit.round_complete()
         second_unit.round_complete()
+        if profiling:
+            battle_profile.phase_times['round_complete'] += timeit.default_timer() - phase_start
         first_unit.state_log()
         second_unit.state_log()
         if round_count > MAX_ROUNDS:
             logging.info('Maximum rounds exceeded; calling the battle.')
+            if profiling:
+                battle_profile.max_rounds += 1
             break
     if first_unit.structure > 0 and second_unit.structure > 0:
         logging.info('Draw.')
@@ -804,119 +1466,2084 @@ def one_vs_one(first_unit, second_unit):
     else:
         logging.error('Unsupported game end state.')
         winner = 0
+    if battle_trace is not None:
+        battle_trace.battle_end(winner, round_count)
+    if profiling:
+        battle_profile.battles += 1
+        battle_profile.rounds += round_count
     return {'winner': winner, 'rounds': round_count}
 
 
-def config_set_from_command_line():
-    parser = argparse.ArgumentParser()
-    parser.add_argument('--config', default=CONFIG_FILE,
-                        help='JSON file that will override settings in script, but be overridden by command line',
-                        dest='config_file')
-    parser.add_argument('--config_print', help='Display all configuration options with their current setting',
-                        action="store_true")
-    for argument in config:
-        if isinstance(config[argument], bool):
-            parser.add_argument('--' + argument, action="store_true")
-        elif isinstance(config[argument], int):
-            parser.add_argument('--' + argument, type=int)
-        elif isinstance(config[argument], float):
-            parser.add_argument('--' + argument, type=float)
-        elif isinstance(config[argument], list):
-            parser.add_argument('--' + argument, action="append")
+class UnitStatics(object):
+    # The parts of a unit that cannot change during a battle, for the batch and exact engines
+
+    def __init__(self, unit):
+        self.name = unit.name
+        self.type = unit.type
+        self.motive_type = unit.motive_type
+        self.jump = unit.jump
+        self.armor_original = unit.armor_original
+        self.shield = bool(unit.sa_flags & SA_SHLD)
+        self.reflective = bool(unit.sa_flags & SA_RFA)
+        self.ams = bool(unit.sa_flags & SA_AMS)
+        self.ammo_safe = bool(unit.sa_flags & (SA_ENE | SA_CASEII))
+        self.case = bool(unit.sa_flags & SA_CASE)
+        self.stealth = bool(unit.sa_flags & SA_STL)
+        self.energy = bool(unit.sa_flags & SA_ENE)
+        self.missiles = bool(unit.sa_flags & SA_MISSILES)
+        if unit.sa_flags & SA_BHJ2:
+            self.armor_repair = 1
+        elif unit.sa_flags & SA_BHJ3:
+            self.armor_repair = 2
         else:
-            parser.add_argument('--' + argument)
-    try:
-        args = parser.parse_args()
-    except BaseException as why:
-        if str(why) != '0':
-            print('Command line error: ' + str(why))
-            try:
-                print(parser.print_help())
-            except BaseException as print_error:
-                print('Parser error: ' + str(print_error))
-        sys.exit(1)
-    if args.config_file is not None:
-        json_path = args.config_file
-    if json_path is not None:
-        # Read JSON file, overwrite default config values with anything found & add new params
-        if not os.path.isfile(json_path):
-            raise IOError('Missing config file at ' + json_path)
-        with open(json_path, 'r+') as user_data:
-            try:
-                config_data = json.load(user_data)
-            except BaseException as why:
-                raise IOError('Error loading config file ' + json_path + ': ' + str(why))
-        for config_setting in config_data:
-            setting = config_setting.decode('utf-8')
-            if isinstance(config_data[setting], basestring):
-                config[setting] = config_data[config_setting].decode('utf-8')
-            elif isinstance(config_data[setting], list):
-                new_list = []
-                for list_item in config_data[setting]:
-                    if isinstance(list_item, basestring):
-                        new_list.append(list_item.decode('utf-8'))
-                    else:
-                        new_list.append(list_item)
-                config[setting] = list(new_list)
-            else:
-                config[setting] = config_data[config_setting]
-    # Read command line, overwrite default config values with anything found & add new params
-    for arg in vars(args):
-        if getattr(args, arg) is not None:
-            if getattr(args, arg):
-                config[arg] = getattr(args, arg)
-    if args.config_print:
-        config_print()
+            self.armor_repair = 0
+        self.other_move_mods = unit.other_move_mods
+        self.heat_damage = list(unit.heat_damage)
+        self.crit_table = unit.crit_table
+        self.motive_table = unit.motive_table
 
 
-def config_print(setting=None):
-    if setting is not None:
-        try:
-            print(str(config[setting]))
-        except:
-            print('No config option "' + setting + '"')
+class BatchUnits(UnitStatics):
+    # One side of many simultaneous battles: every stat that can change during a battle is a numpy column.
+
+    def __init__(self, stat_dict, battle_runs):
+        unit = unit_create_from_dict(stat_dict)
+        UnitStatics.__init__(self, unit)
+        self.heat_damage = numpy.array(self.heat_damage, dtype=numpy.int64)
+        if self.crit_table is not None:
+            self.crit_table = numpy.array(self.crit_table, dtype=numpy.int64)
+        if self.motive_table is not None:
+            self.motive_table = numpy.array(self.motive_table, dtype=numpy.int64)
+        self.armor = numpy.full(battle_runs, unit.armor, dtype=numpy.int64)
+        self.structure = numpy.full(battle_runs, unit.structure, dtype=numpy.int64)
+        self.weapons = numpy.tile(numpy.array(unit.weapons, dtype=numpy.float64), (battle_runs, 1))
+        self.movement = numpy.full(battle_runs, unit.movement, dtype=numpy.int64)
+        self.skill = numpy.full(battle_runs, unit.skill, dtype=numpy.int64)
+        self.heat = numpy.zeros(battle_runs, dtype=numpy.int64)
+        self.engine_hit = numpy.zeros(battle_runs, dtype=bool)
+        self.arm = numpy.full(battle_runs, unit.arm, dtype=numpy.int64)
+        self.rhs = numpy.full(battle_runs, bool(unit.sa_flags & SA_RHS), dtype=bool)
+
+    def compress(self, keep):
+        for column in ['armor', 'structure', 'weapons', 'movement', 'skill', 'heat', 'engine_hit', 'arm', 'rhs']:
+            setattr(self, column, getattr(self, column)[keep])
+
+    def effective_skill(self):
+        skill = self.skill + self.heat
+        if self.shield:
+            skill = skill + 1
+        if self.jump is not None:
+            skill = skill + numpy.where(self.jump > self.movement, 2, 0)
+        return skill
+
+    def movement_mod(self):
+        move_mod = batch_movement_mod(numpy.maximum(0, self.movement - (self.heat * 2)))
+        if self.jump is not None:
+            move_mod = numpy.where(self.jump > self.movement, movement_mod(self.jump) + 1, move_mod)
+        return move_mod + self.other_move_mods
+
+
+def batch_movement_mod(movement):
+    move_mod = numpy.searchsorted(numpy.array([5, 9, 13, 19, 35]), movement, side='right')
+    return numpy.where(movement == 0, -4, move_mod)
+
+
+def batch_divide_by_two_round_up(values):
+    return numpy.floor(values / 2.0 + 0.5).astype(values.dtype)
+
+
+class MirroredRandomState(object):
+    # The antithetic twin of numpy.random.RandomState(seed), for the calls the batch engine makes: each randint is
+    # low + high - 1 - draw and each random_sample is 1 - draw
+    def __init__(self, seed=None):
+        self.generator = numpy.random.RandomState(seed)
+
+    def randint(self, low, high, size=None):
+        return low + high - 1 - self.generator.randint(low, high, size)
+
+    def random_sample(self, size=None):
+        return 1.0 - self.generator.random_sample(size)
+
+
+def batch_two_d6(rng, size):
+    return rng.randint(1, 7, size) + rng.randint(1, 7, size)
+
+
+def batch_probability_to_hit(target_number):
+    hit_chances = numpy.array([probability_to_hit(number) for number in range(0, 14)])
+    return hit_chances[numpy.clip(target_number, 0, 13)]
+
+
+def batch_band_percentages(percentages):
+    return numpy.array([percentages['short'], percentages['medium'], percentages['long']], dtype=numpy.float64)
+
+
+def batch_range_for_least_defender_damage(attacker, defender):
+    base_target_number = attacker.effective_skill() + defender.movement_mod()
+    attacker_damage = numpy.full(defender.weapons.shape, 100.0)
+    for attacker_range in [SHORT_RANGE, MEDIUM_RANGE, LONG_RANGE]:
+        defender_weapons = defender.weapons[:, attacker_range]
+        expected_damage = defender_weapons * batch_probability_to_hit(base_target_number + (2 * attacker_range))
+        attacker_damage[:, attacker_range] = numpy.where(defender_weapons > 0, expected_damage, 100.0)
+    short_damage = attacker_damage[:, SHORT_RANGE]
+    medium_damage = attacker_damage[:, MEDIUM_RANGE]
+    long_damage = attacker_damage[:, LONG_RANGE]
+    return numpy.where(short_damage < medium_damage,
+                       numpy.where(short_damage < long_damage, SHORT_RANGE, LONG_RANGE),
+                       numpy.where(medium_damage < long_damage, MEDIUM_RANGE, LONG_RANGE))
+
+
+def batch_range_for_chooser(range_algorithm, chooser, opponent):
+    # range_for_chooser for every battle: the band with the highest score, compared element by element
+    outgoing_base = chooser.effective_skill() + opponent.movement_mod()
+    incoming_base = opponent.effective_skill() + chooser.movement_mod()
+    scores = []
+    for range_band in [SHORT_RANGE, MEDIUM_RANGE, LONG_RANGE]:
+        chooser_weapons = chooser.weapons[:, range_band]
+        opponent_weapons = opponent.weapons[:, range_band]
+        outgoing_damage = chooser_weapons * batch_probability_to_hit(outgoing_base + (2 * range_band))
+        incoming_hit_chance = batch_probability_to_hit(incoming_base + (2 * range_band))
+        if range_algorithm == INITIATIVE_HELPS_FASTER_MINIMIZE_HIT_CHANCE:
+            scores.append([(chooser_weapons > 0).astype(numpy.float64),
+                           -numpy.where(opponent_weapons > 0, incoming_hit_chance, 0.0), outgoing_damage])
+        else:
+            scores.append([outgoing_damage, -(opponent_weapons * incoming_hit_chance)])
+    best_range = numpy.full(len(chooser.movement), LONG_RANGE)
+    best_scores = scores[LONG_RANGE]
+    for range_band in [MEDIUM_RANGE, SHORT_RANGE]:
+        better = numpy.zeros(len(best_range), dtype=bool)
+        tied = numpy.ones(len(best_range), dtype=bool)
+        for score, best_score in zip(scores[range_band], best_scores):
+            better |= tied & (score > best_score)
+            tied &= score == best_score
+        best_range = numpy.where(better, range_band, best_range)
+        best_scores = [numpy.where(better, score, best_score)
+                       for score, best_score in zip(scores[range_band], best_scores)]
+    return best_range
+
+
+def batch_initiative_first_picks(unit_1, unit_2, rng):
+    # initiative_range_chooser for every battle: True where unit_1 picks the range
+    battles = len(unit_1.movement)
+    first_roll = batch_two_d6(rng, battles)
+    second_roll = batch_two_d6(rng, battles)
+    same_speed = unit_1.movement == unit_2.movement
+    ties = same_speed & (first_roll == second_roll)
+    while ties.any():
+        first_roll[ties] = batch_two_d6(rng, ties.sum())
+        second_roll[ties] = batch_two_d6(rng, ties.sum())
+        ties = same_speed & (first_roll == second_roll)
+    first_is_faster = unit_1.movement > unit_2.movement
+    return numpy.where(first_is_faster, (unit_2.movement == 0) | (first_roll >= second_roll),
+                       (first_roll > second_roll) & (same_speed | (unit_1.movement > 0)))
+
+
+def batch_range_get(range_algorithm, current_round, range_previous, unit_1, unit_2, rng):
+    battles = len(range_previous)
+    if range_algorithm == SHORT_RANGE:
+        range_band = numpy.full(battles, SHORT_RANGE)
+    elif range_algorithm == MEDIUM_RANGE or range_algorithm == LONG_RANGE:
+        # range_get has always resolved fixed_long to medium range
+        range_band = numpy.full(battles, MEDIUM_RANGE)
+    elif range_algorithm == RANDOM_RANGE:
+        range_roll = rng.randint(1, 101, battles)
+        range_band = numpy.where(range_roll <= 10, SHORT_RANGE, numpy.where(range_roll <= 70, MEDIUM_RANGE, LONG_RANGE))
+    elif range_algorithm == FAST_UNIT_CAUSES_SLOW_APPROACH or range_algorithm == FAST_UNIT_MINIMIZES_DAMAGE:
+        first_is_faster = unit_1.movement > unit_2.movement
+        faster_weapons = numpy.where(first_is_faster[:, None], unit_1.weapons, unit_2.weapons)
+        slower_movement = numpy.where(first_is_faster, unit_2.movement, unit_1.movement)
+        same_speed = unit_1.movement == unit_2.movement
+        if current_round <= 2:
+            same_speed_band = LONG_RANGE
+        else:
+            same_speed_band = MEDIUM_RANGE
+        if range_algorithm == FAST_UNIT_CAUSES_SLOW_APPROACH:
+            longest_band = numpy.where(faster_weapons[:, LONG_RANGE] > 0, LONG_RANGE,
+                                       numpy.where(faster_weapons[:, MEDIUM_RANGE] > 0, MEDIUM_RANGE, SHORT_RANGE))
+            duel_band = numpy.where(faster_weapons[:, MEDIUM_RANGE] > 0, MEDIUM_RANGE, SHORT_RANGE)
+            approaching = current_round < 36 // numpy.maximum(slower_movement, 1)
+            range_band = numpy.where(slower_movement == 0, longest_band,
+                                     numpy.where(approaching, longest_band, duel_band))
+        else:
+            least_damage_band = numpy.where(first_is_faster,
+                                            batch_range_for_least_defender_damage(unit_2, unit_1),
+                                            batch_range_for_least_defender_damage(unit_1, unit_2))
+            if current_round == 1:
+                has_long = (unit_1.weapons[:, LONG_RANGE] > 0) | (unit_2.weapons[:, LONG_RANGE] > 0)
+                opening_band = numpy.where(has_long, LONG_RANGE, MEDIUM_RANGE)
+                range_band = numpy.where(slower_movement == 0, least_damage_band, opening_band)
+            else:
+                range_band = least_damage_band
+        range_band = numpy.where(same_speed, same_speed_band, range_band)
+    elif range_algorithm == INITIATIVE_HELPS_FASTER_MINIMIZE_HIT_CHANCE or \
+            range_algorithm == INITIATIVE_HELPS_FASTER_MAXIMIZE_DAMAGE:
+        range_band = numpy.where(batch_initiative_first_picks(unit_1, unit_2, rng),
+                                 batch_range_for_chooser(range_algorithm, unit_1, unit_2),
+                                 batch_range_for_chooser(range_algorithm, unit_2, unit_1))
     else:
-        for option in config:
-            print option + ': ' + str(config[option])
+        range_band = numpy.array(range_previous)
+    return numpy.where((unit_1.movement == 0) & (unit_2.movement == 0), range_previous, range_band)
 
 
-def unit_list_fight(unit_list):
-    if config['csv']['output']:
-        try:
-            output_file_csv = open(config['csv']['path'], 'wb')
-        except BaseException as why:
-            logging.error('Failed to open CSV file ' + config['csv']['path'] + ' - ' + str(why))
-            config['csv']['output'] = False
-    if config['bbcode']['output']:
-        try:
-            output_file_bbcode = open(config['bbcode']['path'], 'wb')
-        except BaseException as why:
-            logging.error('Failed to open BBCode file ' + config['bbcode']['path'] + ' - ' + str(why))
-            config['bbcode']['output'] = False
-    defender_list = []
-    completed_attackers = []
-    if config['bbcode']['output']:
-        output_file_bbcode.write('[table][tr][td]Attacker \ Defender[/td]')
-    if config['csv']['output']:
-        csv_fields = ['Attacker']
-    for defender in unit_list:
-        defender_list.append(defender)
-        if config['bbcode']['output']:
-            output_file_bbcode.write('[td][b]' + defender['name'] + ' (Skill ' + str(defender['skill']) + ')[/b][/td]')
-        if config['csv']['output']:
-            csv_fields.append(defender['name'])
-    if config['bbcode']['output']:
-        output_file_bbcode.write('[/tr]')
-    if config['csv']['output']:
+def batch_motive_check(unit, battles, rng):
+    if unit.motive_table is None or len(battles) == 0:
+        return
+    motive = unit.motive_table[batch_two_d6(rng, len(battles))]
+    movement = unit.movement[battles]
+    movement = numpy.where(motive == MOTIVE_MINUS_2, numpy.maximum(0, movement - 2), movement)
+    movement = numpy.where(motive == MOTIVE_HALVED, movement - batch_divide_by_two_round_up(movement), movement)
+    unit.movement[battles] = numpy.where(motive == MOTIVE_IMMOBILE, 0, movement)
+
+
+def batch_structure_damage(unit, battles, damage):
+    # Returns the battles where the damage reached structure without destroying the unit, i.e. that roll a crit
+    armor = unit.armor[battles]
+    structure = unit.structure[battles]
+    through_armor = damage > armor
+    unit.armor[battles] = numpy.where(through_armor, 0, armor - damage)
+    damage = damage - armor
+    crit_rolled = through_armor & (damage < structure)
+    unit.structure[battles] = numpy.where(crit_rolled, structure - damage, numpy.where(through_armor, 0, structure))
+    return battles[crit_rolled]
+
+
+def batch_apply_crit(unit, battles, rng):
+    # Returns the battles where CASE turned an ammo explosion into a further point of damage that needs a crit roll
+    crit_roll = batch_two_d6(rng, len(battles))
+    armored = unit.arm[battles] > 0
+    unit.arm[battles[armored]] -= 1
+    battles = battles[~armored]
+    if unit.crit_table is None:
+        return battles[:0]
+    crit = unit.crit_table[crit_roll[~armored]]
+    motive = battles[crit == CRIT_MP]
+    movement = unit.movement[motive]
+    movement_loss = numpy.maximum(2, batch_divide_by_two_round_up(movement))
+    unit.movement[motive] = numpy.maximum(0, movement - movement_loss)
+    unit.skill[battles[crit == CRIT_FIRE_CONTROL]] += 2
+    weapon_hit = battles[crit == CRIT_WEAPON]
+    unit.weapons[weapon_hit] = numpy.maximum(0, unit.weapons[weapon_hit] - 1)
+    unit.structure[battles[(crit == CRIT_DESTROYED) | (crit == CRIT_CREW_KILLED)]] = 0
+    engine_hit = battles[(crit == CRIT_ENGINE) | (crit == CRIT_VEHICLE_ENGINE)]
+    second_engine_hit = unit.engine_hit[engine_hit]
+    unit.structure[engine_hit[second_engine_hit]] = 0
+    first_engine_hit = engine_hit[~second_engine_hit]
+    unit.engine_hit[first_engine_hit] = True
+    if unit.type == VEHICLE:
+        unit.movement[first_engine_hit] = batch_divide_by_two_round_up(unit.movement[first_engine_hit])
+        unit.weapons[first_engine_hit] = batch_divide_by_two_round_up(unit.weapons[first_engine_hit])
+    ammo_explosion = battles[crit == CRIT_AMMO_EXPLOSION]
+    if unit.ammo_safe:
+        return battles[:0]
+    elif unit.case:
+        # CASE turns the explosion into 1 point of damage, which SHLD soaks entirely
+        if unit.shield:
+            return battles[:0]
+        return batch_structure_damage(unit, ammo_explosion, numpy.ones(len(ammo_explosion), dtype=numpy.int64))
+    unit.structure[ammo_explosion] = 0
+    return battles[:0]
+
+
+def batch_damage_apply(unit, battles, damage, attack_range, attacker, rng):
+    if len(battles) == 0:
+        return
+    heat_added = numpy.where(damage > 0, attacker.heat_damage[attack_range], 0)
+    if unit.reflective:
+        if attacker.energy:
+            damage = batch_divide_by_two_round_up(damage)
+            heat_added = batch_divide_by_two_round_up(heat_added)
+        else:
+            heat_added = batch_divide_by_two_round_up(heat_added)
+            damage = numpy.maximum(0, damage - heat_added)
+    if unit.shield:
+        damage = numpy.maximum(0, damage - 1)
+    if unit.ams and attacker.missiles:
+        damage = numpy.maximum(0, damage - 1)
+    if unit.type != MECH:
+        # Not a heat-tracking unit; added HT to Damage
+        damage = damage + heat_added
+        heat_added = numpy.zeros(len(battles), dtype=numpy.int64)
+    crit_battles = batch_structure_damage(unit, battles, damage)
+    while len(crit_battles) > 0:
+        crit_battles = batch_apply_crit(unit, crit_battles, rng)
+    if unit.type == MECH:
+        heated = (heat_added > 0) & (unit.structure[battles] > 0)
+        unit.heat[battles[heated]] += numpy.minimum(heat_added[heated], 2)
+
+
+def batch_end_phase(unit, fired):
+    if unit.type == MECH:
+        unit.heat[fired & unit.engine_hit] += 1
+        unit.heat[~fired & (unit.structure > 0)] = 0
+
+
+def batch_round_complete(unit, rng):
+    if unit.armor_repair > 0:
+        unit.armor = numpy.where(unit.armor > 0, numpy.maximum(unit.armor_original, unit.armor + unit.armor_repair),
+                                 unit.armor)
+    cooling = numpy.flatnonzero(unit.rhs & (unit.heat > 0))
+    if len(cooling) > 0:
+        unit.heat[cooling] -= 1
+        unit.rhs[cooling[rng.randint(1, 7, len(cooling)) == 1]] = False
+
+
+def batch_shot_hits(shooter, target, fired, range_band, terrain_mod, rng):
+    shooter_mods = numpy.where(shooter.movement_mod() == 0, -1, 0)
+    # stealth is a flag per battle when the targets are gathered from a lance
+    shooter_mods = shooter_mods + numpy.where(target.stealth, range_band, 0)
+    target_number = shooter.effective_skill() + shooter_mods + (2 * range_band) + target.movement_mod() + terrain_mod
+    return fired & (batch_two_d6(rng, len(fired)) >= target_number)
+
+
+def one_vs_one_batch(attacker, defender, battle_runs, rng):
+    # Vectorized one_vs_one: plays battle_runs battles of the same pairing in lockstep, one round per step
+    first_unit = BatchUnits(attacker, battle_runs)
+    second_unit = BatchUnits(defender, battle_runs)
+    range_algorithm = range_algorithm_from_text(config['range_determination'])
+    max_tolerable_heat = int(config['max_tolerable_heat'])
+    woods_percentages = batch_band_percentages(config['woods_percent'])
+    cover_percentages = batch_band_percentages(config['cover_percent'])
+    winners = numpy.zeros(battle_runs, dtype=numpy.int64)
+    rounds = numpy.zeros(battle_runs, dtype=numpy.int64)
+    remaining = numpy.zeros((4, battle_runs), dtype=numpy.int64)  # Attacker armor & structure, then defender's
+    battle_ids = numpy.arange(battle_runs)
+    range_previous = numpy.full(battle_runs, LONG_RANGE)
+    round_count = 0
+    while True:
+        first_alive = first_unit.structure > 0
+        second_alive = second_unit.structure > 0
+        finished = ~(first_alive & second_alive)
+        if round_count > MAX_ROUNDS:
+            finished[:] = True
+        if finished.any():
+            winners[battle_ids[finished]] = numpy.where(first_alive == second_alive, 0,
+                                                        numpy.where(second_alive, 2, 1))[finished]
+            rounds[battle_ids[finished]] = round_count
+            remaining[:, battle_ids[finished]] = [first_unit.armor[finished], first_unit.structure[finished],
+                                                  second_unit.armor[finished], second_unit.structure[finished]]
+            keep = ~finished
+            battle_ids = battle_ids[keep]
+            range_previous = range_previous[keep]
+            first_unit.compress(keep)
+            second_unit.compress(keep)
+        battles = len(battle_ids)
+        if battles == 0:
+            break
+        round_count += 1
+        range_band = batch_range_get(range_algorithm, round_count, range_previous, first_unit, second_unit, rng)
+        range_previous = range_band
+        woods_mod = numpy.where(rng.random_sample(battles) * 100 < woods_percentages[range_band], 2, 0)
+        first_unit_cover_mod = numpy.where(rng.random_sample(battles) * 100 < cover_percentages[range_band], 2, 0)
+        second_unit_cover_mod = numpy.where(rng.random_sample(battles) * 100 < cover_percentages[range_band], 2, 0)
+        first_unit_fired = first_unit.heat <= max_tolerable_heat
+        second_unit_fired = second_unit.heat <= max_tolerable_heat
+        second_unit_was_hit = batch_shot_hits(first_unit, second_unit, first_unit_fired, range_band,
+                                              woods_mod + second_unit_cover_mod, rng)
+        first_unit_was_hit = batch_shot_hits(second_unit, first_unit, second_unit_fired, range_band,
+                                             woods_mod + first_unit_cover_mod, rng)
+        band_rows = numpy.arange(battles)
+        first_unit_weapons = first_unit.weapons[band_rows, range_band].astype(numpy.int64)
+        second_unit_weapons = second_unit.weapons[band_rows, range_band].astype(numpy.int64)
+        hit = numpy.flatnonzero(first_unit_was_hit)
+        batch_motive_check(first_unit, hit, rng)
+        batch_damage_apply(first_unit, hit, second_unit_weapons[hit], range_band[hit], second_unit, rng)
+        hit = numpy.flatnonzero(second_unit_was_hit)
+        batch_motive_check(second_unit, hit, rng)
+        batch_damage_apply(second_unit, hit, first_unit_weapons[hit], range_band[hit], first_unit, rng)
+        # End Phase
+        batch_end_phase(first_unit, first_unit_fired)
+        batch_end_phase(second_unit, second_unit_fired)
+        batch_round_complete(first_unit, rng)
+        batch_round_complete(second_unit, rng)
+    return winners, rounds, remaining
+
+
+class LanceSide(object):
+    # One side of many simultaneous lance battles, as (unit, battle) arrays stacked from each unit's BatchUnits columns
+
+    def __init__(self, units):
+        self.armor = numpy.array([unit.armor for unit in units])
+        self.structure = numpy.array([unit.structure for unit in units])
+        self.weapons = numpy.array([unit.weapons for unit in units])
+        self.movement = numpy.array([unit.movement for unit in units])
+        self.skill = numpy.array([unit.skill for unit in units])
+        self.heat = numpy.array([unit.heat for unit in units])
+        self.alive = self.structure > 0
+        self.shield = numpy.array([unit.shield for unit in units])
+        self.stealth = numpy.array([unit.stealth for unit in units])
+        self.jump = numpy.array([unit.jump or 0 for unit in units])  # No jump never beats movement
+        self.other_move_mods = numpy.array([unit.other_move_mods for unit in units])
+
+    def gather(self, target):
+        return LanceTargets(self, target)
+
+
+class LanceTargets(object):
+    # The unit each battle's shooter aims at, one entry per battle, with the BatchUnits calls the range and to-hit
+    # rules make
+
+    def __init__(self, side, target):
+        battles = numpy.arange(len(target))
+        self.armor = side.armor[target, battles]
+        self.structure = side.structure[target, battles]
+        self.weapons = side.weapons[target, battles]
+        self.movement = side.movement[target, battles]
+        self.skill = side.skill[target, battles]
+        self.heat = side.heat[target, battles]
+        self.shield = side.shield[target]
+        self.stealth = side.stealth[target]
+        self.jump = side.jump[target]
+        self.other_move_mods = side.other_move_mods[target]
+
+    def effective_skill(self):
+        return self.skill + self.heat + self.shield + numpy.where(self.jump > self.movement, 2, 0)
+
+    def movement_mod(self):
+        move_mod = batch_movement_mod(numpy.maximum(0, self.movement - (self.heat * 2)))
+        move_mod = numpy.where(self.jump > self.movement, batch_movement_mod(self.jump) + 1, move_mod)
+        return move_mod + self.other_move_mods
+
+
+def lance_target_focus_fire(shooter_index, shooter, enemies, rng):
+    # Everyone shoots the first enemy still standing, in list order
+    return numpy.argmax(enemies.alive, axis=0)
+
+
+def lance_target_spread(shooter_index, shooter, enemies, rng):
+    # The n-th shooter takes the n-th enemy still standing, wrapping round when there are fewer of them
+    standing = enemies.alive.sum(axis=0)
+    rank = numpy.cumsum(enemies.alive, axis=0) - 1
+    return numpy.argmax(enemies.alive & (rank == shooter_index % numpy.maximum(standing, 1)), axis=0)
+
+
+def lance_target_random(shooter_index, shooter, enemies, rng):
+    return numpy.argmax(numpy.where(enemies.alive, rng.random_sample(enemies.alive.shape), -1.0), axis=0)
+
+
+def lance_target_weakest(shooter_index, shooter, enemies, rng):
+    # The enemy with the least armor and structure left
+    return numpy.argmin(numpy.where(enemies.alive, enemies.armor + enemies.structure, numpy.iinfo(numpy.int64).max),
+                        axis=0)
+
+
+def lance_target_most_dangerous(shooter_index, shooter, enemies, rng):
+    # The enemy with the most damage left across its range bands
+    return numpy.argmax(numpy.where(enemies.alive, enemies.weapons.sum(axis=2), -1.0), axis=0)
+
+
+LANCE_TARGET_POLICIES = {
+    'focus_fire': lance_target_focus_fire,
+    'spread': lance_target_spread,
+    'random': lance_target_random,
+    'weakest': lance_target_weakest,
+    'most_dangerous': lance_target_most_dangerous
+}
+
+
+def lance_target_policy_get(policy_name):
+    if policy_name not in LANCE_TARGET_POLICIES:
+        logging.warning('Undefined target policy: ' + str(policy_name) + '; setting to focus_fire.')
+        policy_name = 'focus_fire'
+    return LANCE_TARGET_POLICIES[policy_name]
+
+
+def lance_remaining(side, units):
+    # Armor and structure left across a side's surviving units
+    return [numpy.where(side.alive[:, units], side.armor[:, units], 0).sum(axis=0),
+            numpy.where(side.alive[:, units], side.structure[:, units], 0).sum(axis=0)]
+
+
+def lance_vs_lance_batch(attackers, defenders, battle_runs, rng, target_policies):
+    # one_vs_one_batch for lances: every unit picks a target with its side's policy, then all shots of a round are
+    # rolled before any damage lands, as in one_vs_one. The range band and woods are rolled once a round for the whole
+    # battle, the band between each side's lead (first standing) unit, and cover once a round for each unit, so a
+    # lance of one plays exactly as one_vs_one. Each side is stacked into (unit, battle) arrays once a round, so a
+    # round costs a few array operations per unit rather than per pairing.
+    sides = [[BatchUnits(attacker, battle_runs) for attacker in attackers],
+             [BatchUnits(defender, battle_runs) for defender in defenders]]
+    range_algorithm = range_algorithm_from_text(config['range_determination'])
+    max_tolerable_heat = int(config['max_tolerable_heat'])
+    woods_percentages = batch_band_percentages(config['woods_percent'])
+    cover_percentages = batch_band_percentages(config['cover_percent'])
+    winners = numpy.zeros(battle_runs, dtype=numpy.int64)
+    rounds = numpy.zeros(battle_runs, dtype=numpy.int64)
+    remaining = numpy.zeros((4, battle_runs), dtype=numpy.int64)  # Attacking side armor & structure, then defending
+    battle_ids = numpy.arange(battle_runs)
+    range_previous = numpy.full(battle_runs, LONG_RANGE)
+    round_count = 0
+    while True:
+        stacked = [LanceSide(side) for side in sides]
+        first_alive = stacked[0].alive.any(axis=0)
+        second_alive = stacked[1].alive.any(axis=0)
+        finished = ~(first_alive & second_alive)
+        if round_count > MAX_ROUNDS:
+            finished[:] = True
+        if finished.any():
+            winners[battle_ids[finished]] = numpy.where(first_alive == second_alive, 0,
+                                                        numpy.where(second_alive, 2, 1))[finished]
+            rounds[battle_ids[finished]] = round_count
+            remaining[:, battle_ids[finished]] = lance_remaining(stacked[0], finished) + \
+                lance_remaining(stacked[1], finished)
+            keep = ~finished
+            battle_ids = battle_ids[keep]
+            range_previous = range_previous[keep]
+            for side in sides:
+                for unit in side:
+                    unit.compress(keep)
+            stacked = [LanceSide(side) for side in sides]
+        battles = len(battle_ids)
+        if battles == 0:
+            break
+        round_count += 1
+        band_rows = numpy.arange(battles)
+        leads = [side.gather(numpy.argmax(side.alive, axis=0)) for side in stacked]
+        range_band = batch_range_get(range_algorithm, round_count, range_previous, leads[0], leads[1], rng)
+        range_previous = range_band
+        woods_mod = numpy.where(rng.random_sample(battles) * 100 < woods_percentages[range_band], 2, 0)
+        cover_mods = [numpy.where(rng.random_sample((len(side), battles)) * 100 < cover_percentages[range_band], 2, 0)
+                      for side in sides]
+        shots = []
+        fired = []
+        for side_index, side in enumerate(sides):
+            enemies = stacked[1 - side_index]
+            side_fired = []
+            for unit_index, unit in enumerate(side):
+                unit_fired = stacked[side_index].alive[unit_index] & (unit.heat <= max_tolerable_heat)
+                target = target_policies[side_index](unit_index, unit, enemies, rng)
+                hit = numpy.flatnonzero(batch_shot_hits(unit, enemies.gather(target), unit_fired, range_band,
+                                                        woods_mod + cover_mods[1 - side_index][target, band_rows], rng))
+                damage = unit.weapons[band_rows, range_band].astype(numpy.int64)
+                shots.append((unit, sides[1 - side_index], hit, target[hit], damage[hit], range_band[hit]))
+                side_fired.append(unit_fired)
+            fired.append(side_fired)
+        for shooter, targets, hit, target, damage, range_band in shots:
+            # Split the hits by target unit, since each unit's own special abilities and crit table apply
+            for target_index in numpy.unique(target):
+                on_target = target == target_index
+                batch_motive_check(targets[target_index], hit[on_target], rng)
+                batch_damage_apply(targets[target_index], hit[on_target], damage[on_target], range_band[on_target],
+                                   shooter, rng)
+        # End Phase
+        for side, side_fired in zip(sides, fired):
+            for unit, unit_fired in zip(side, side_fired):
+                batch_end_phase(unit, unit_fired)
+                batch_round_complete(unit, rng)
+    return winners, rounds, remaining
+
+
+def lance_battles(attackers, defenders, battle_runs, seed=None):
+    # matchup_battles for two lances, with the same result layout; the histograms are totals across each side
+    defender_policy = config['defender_target_policy'] or config['target_policy']
+    target_policies = [lance_target_policy_get(config['target_policy']), lance_target_policy_get(defender_policy)]
+    winners, battle_rounds, remaining = lance_vs_lance_batch(attackers, defenders, battle_runs,
+                                                             numpy.random.RandomState(seed), target_policies)
+    histograms = histograms_new()
+    for histogram, values in zip(HISTOGRAMS, [battle_rounds] + list(remaining)):
+        for value, count in zip(*numpy.unique(values, return_counts=True)):
+            histograms[histogram][str(value)] = int(count)
+    return {'wins': [int(count) for count in numpy.bincount(winners, minlength=3)],
+            'rounds': int(battle_rounds.sum()), 'battle_runs': battle_runs, 'histograms': histograms}
+
+
+EXACT_MIN_CHANCE = 1e-12  # Battle states less likely than this are dropped by the exact solver
+# Rounds up to which a range algorithm's choice can depend on the round number itself (range_get); after them every
+# round steps the same way
+EXACT_ROUND_SENSITIVE = {FAST_UNIT_CAUSES_SLOW_APPROACH: 36, FAST_UNIT_MINIMIZES_DAMAGE: 2}
+# Range algorithms that never look at a unit's skill, so a unit with no weapons left plays the same at any skill
+EXACT_SKILL_FREE_RANGES = [SHORT_RANGE, MEDIUM_RANGE, LONG_RANGE, RANDOM_RANGE]
+
+ExactState = collections.namedtuple('ExactState', ['armor', 'structure', 'heat', 'weapons', 'movement', 'skill',
+                                                   'engine_hit', 'arm', 'rhs'])
+
+
+def two_d6_at_least(target_number):
+    chance = 0.0
+    for roll, odds in TWO_D6_ODDS:
+        if roll >= target_number:
+            chance += odds
+    return chance
+
+
+def percent_chance(percent):
+    # Chance that dice.chance() * 100 < percent
+    return min(1.0, max(0.0, float(percent) / 100))
+
+
+def exact_spread(outcomes, step):
+    spread = []
+    for chance, state in outcomes:
+        for step_chance, next_state in step(state):
+            spread.append((chance * step_chance, next_state))
+    return spread
+
+
+def exact_merge(outcomes):
+    merged = {}
+    for chance, state in outcomes:
+        merged[state] = merged.get(state, 0.0) + chance
+    return [(chance, state) for state, chance in merged.items()]
+
+
+class ExactUnit(UnitStatics):
+    # One side of the exact solver. States are ExactState tuples; each rule returns a list of (chance, new state).
+    # Battles refer to states by number, which is much cheaper to hash.
+
+    def __init__(self, stat_dict, skill_free=False):
+        unit = unit_create_from_dict(stat_dict)
+        UnitStatics.__init__(self, unit)
+        self.template = unit
+        self.skill_free = skill_free
+        self.crit_outcomes = None
+        if self.crit_table is not None:
+            self.crit_outcomes = effect_distribution(self.crit_table)
+        self.motive_outcomes = None
+        if self.motive_table is not None:
+            self.motive_outcomes = effect_distribution(self.motive_table)
+        self.start = ExactState(unit.armor, unit.structure, 0, tuple(unit.weapons), unit.movement, unit.skill, False,
+                                unit.arm, bool(unit.sa_flags & SA_RHS))
+        self.states = []
+        self.state_numbers = {}
+        self.views = []
+        self.profiles = []
+        self.round_outcomes = {}
+
+    def number(self, state):
+        try:
+            return self.state_numbers[state]
+        except KeyError:
+            self.state_numbers[state] = len(self.states)
+            self.states.append(state)
+            self.views.append(None)
+            self.profiles.append(None)
+            return self.state_numbers[state]
+
+    def view(self, number):
+        # A CombatUnit in this state, so range_get and the to-hit mods are computed by the same code as in one_vs_one
+        if self.views[number] is None:
+            state = self.states[number]
+            unit = copy.copy(self.template)
+            unit.armor = state.armor
+            unit.structure = state.structure
+            unit.heat = state.heat
+            unit.weapons = list(state.weapons)
+            unit.movement = state.movement
+            unit.skill = state.skill
+            self.views[number] = unit
+        return self.views[number]
+
+    def profile(self, number):
+        # All that the to-hit rolls need from a state: effective skill and movement modifier
+        if self.profiles[number] is None:
+            unit = self.view(number)
+            self.profiles[number] = (unit.effective_skill(), unit.movement_mod())
+        return self.profiles[number]
+
+    def idle(self, number):
+        # The state with nothing left to happen to it but armor and structure, for ExactSolver.stalemate
+        state = self.states[number]
+        return self.number(ExactState(state.armor, state.structure, 0, state.weapons, 0, state.skill, False, 0, False))
+
+    def canonical(self, state):
+        # A unit with no weapons left can't hit anything, so where the range doesn't depend on it its skill is moot
+        if self.skill_free and not any(state.weapons) and state.skill != self.start.skill:
+            return state._replace(skill=self.start.skill)
+        return state
+
+    def motive_check(self, state):
+        if self.motive_outcomes is None:
+            return [(1.0, state)]
+        return [(chance, state._replace(movement=motive_movement(state.movement, motive)))
+                for chance, motive in self.motive_outcomes]
+
+    def damage_apply(self, state, damage, attack_range, attacker):
+        heat_added = 0
+        if damage > 0:
+            heat_added = attacker.heat_damage[attack_range]
+        if self.reflective:
+            if attacker.energy:
+                damage = divide_by_two_round_up(damage)
+                heat_added = divide_by_two_round_up(heat_added)
+            elif heat_added > 0:
+                heat_added = divide_by_two_round_up(heat_added)
+                damage = max(0, damage - heat_added)
+        if self.shield:
+            damage = max(0, damage - 1)
+        if self.ams and attacker.missiles:
+            damage = max(0, damage - 1)
+        if heat_added > 0 and self.type != MECH:
+            damage += heat_added
+            heat_added = 0
+        outcomes = self.structure_damage(state, damage)
+        if self.type == MECH and heat_added > 0:
+            heated = []
+            for chance, next_state in outcomes:
+                if next_state.structure > 0:
+                    next_state = next_state._replace(heat=next_state.heat + min(heat_added, 2))
+                heated.append((chance, next_state))
+            outcomes = heated
+        return outcomes
+
+    def structure_damage(self, state, damage):
+        if damage <= state.armor:
+            return [(1.0, state._replace(armor=state.armor - damage))]
+        damage -= state.armor
+        if damage < state.structure:
+            return self.apply_crit(state._replace(armor=0, structure=state.structure - damage))
+        return [(1.0, state._replace(armor=0, structure=0))]
+
+    def apply_crit(self, state):
+        if state.arm > 0:
+            return [(1.0, state._replace(arm=state.arm - 1))]
+        if self.crit_outcomes is None:
+            return [(1.0, state)]
+        outcomes = []
+        for odds, crit in self.crit_outcomes:
+            for chance, next_state in self.crit_effect(state, crit):
+                outcomes.append((odds * chance, next_state))
+        return outcomes
+
+    def crit_effect(self, state, crit):
+        if crit == CRIT_AMMO_EXPLOSION:
+            return self.ammo_explosion(state)
+        elif crit == CRIT_ENGINE:
+            if state.engine_hit:
+                state = state._replace(structure=0)
+            else:
+                state = state._replace(engine_hit=True)
+        elif crit == CRIT_VEHICLE_ENGINE:
+            if state.engine_hit:
+                state = state._replace(structure=0)
+            else:
+                state = state._replace(engine_hit=True, movement=divide_by_two_round_up(state.movement),
+                                       weapons=tuple(divide_by_two_round_up(weapon) for weapon in state.weapons))
+        elif crit == CRIT_FIRE_CONTROL:
+            state = state._replace(skill=state.skill + 2)
+        elif crit == CRIT_WEAPON:
+            state = state._replace(weapons=tuple(max(0, weapon - 1) for weapon in state.weapons))
+        elif crit == CRIT_MP:
+            movement_loss = max(2, divide_by_two_round_up(state.movement))
+            state = state._replace(movement=max(0, state.movement - movement_loss))
+        elif crit == CRIT_DESTROYED or crit == CRIT_CREW_KILLED:
+            state = state._replace(structure=0)
+        return [(1.0, state)]
+
+    def ammo_explosion(self, state):
+        if self.ammo_safe:
+            return [(1.0, state)]
+        elif self.case:
+            # CASE turns the explosion into 1 point of damage, which SHLD soaks entirely
+            if self.shield:
+                return self.structure_damage(state, 0)
+            return self.structure_damage(state, 1)
+        return [(1.0, state._replace(structure=0))]
+
+    def end_phase(self, state, fired):
+        if self.type == MECH:
+            if fired and state.engine_hit:
+                return state._replace(heat=state.heat + 1)
+            elif not fired and state.structure > 0:
+                return state._replace(heat=0)
+        return state
+
+    def round_complete(self, state):
+        if self.armor_repair > 0 and state.armor > 0:
+            state = state._replace(armor=max(self.armor_original, state.armor + self.armor_repair))
+        if state.rhs and state.heat > 0:
+            state = state._replace(heat=state.heat - 1)
+            return [(1.0 / 6, state._replace(rhs=False)), (5.0 / 6, state)]
+        return [(1.0, state)]
+
+    def round_outcome(self, number, was_hit, damage, attack_range, attacker, fired):
+        # ([(chance, state number, destroyed, immobile, unarmed)], whether any of them leaves the unit immobile)
+        outcome_key = (number, was_hit, damage, attack_range, fired)
+        try:
+            return self.round_outcomes[outcome_key]
+        except KeyError:
+            outcomes = [(1.0, self.states[number])]
+            if was_hit:
+                outcomes = exact_spread(outcomes, self.motive_check)
+                outcomes = exact_spread(outcomes, lambda hit_state: self.damage_apply(hit_state, damage, attack_range,
+                                                                                      attacker))
+            outcomes = [(chance, self.end_phase(next_state, fired)) for chance, next_state in outcomes]
+            outcomes = exact_merge([(chance, self.canonical(next_state))
+                                    for chance, next_state in exact_spread(outcomes, self.round_complete)])
+            self.round_outcomes[outcome_key] = ([(chance, self.number(next_state), next_state.structure <= 0,
+                                                  next_state.movement == 0, not any(next_state.weapons))
+                                                 for chance, next_state in outcomes],
+                                                any(next_state.movement == 0 for chance, next_state in outcomes))
+            return self.round_outcomes[outcome_key]
+
+
+def exact_range_get(range_algorithm, current_round, range_previous, unit_1, unit_2):
+    if range_algorithm == RANDOM_RANGE and not (unit_1.movement == 0 and unit_2.movement == 0):
+        return [(0.1, SHORT_RANGE), (0.6, MEDIUM_RANGE), (0.3, LONG_RANGE)]
+    if (range_algorithm == INITIATIVE_HELPS_FASTER_MINIMIZE_HIT_CHANCE or
+            range_algorithm == INITIATIVE_HELPS_FASTER_MAXIMIZE_DAMAGE) and \
+            not (unit_1.movement == 0 and unit_2.movement == 0):
+        range_chances = {}
+        for chance, chooser, opponent in initiative_range_chances(unit_1, unit_2):
+            range_band = range_for_chooser(range_algorithm, chooser, opponent)
+            range_chances[range_band] = range_chances.get(range_band, 0.0) + chance
+        return [(chance, range_band) for range_band, chance in sorted(range_chances.items())]
+    return [(1.0, range_get(range_algorithm, current_round, range_previous, unit_1, unit_2))]
+
+
+def exact_hit_chance(shooter_profile, target_stealth, target_profile, range_band, woods_mod, cover_chance):
+    # Profiles are (effective skill, movement modifier), as ExactUnit.profile gives them
+    effective_skill, shooter_movement_mod = shooter_profile
+    range_mod = 2 * range_band
+    if shooter_movement_mod == 0:
+        shooter_mods = -1
+    else:
+        shooter_mods = 0
+    if target_stealth:
+        shooter_mods += int(float(range_mod) / 2)
+    target_number = effective_skill + shooter_mods + range_mod + target_profile[1] + woods_mod
+    return cover_chance * two_d6_at_least(target_number + 2) + (1 - cover_chance) * two_d6_at_least(target_number)
+
+
+class ExactSolver(object):
+    # The battles of one exact matchup and the chances of going from one to another in a round. A battle still being
+    # fought is (first unit's state number, second's, previous range band) and gets a number of its own when it's first
+    # reached; a finished battle only keeps what the results report, each side's armor and structure. States that
+    # can't play differently are merged: the previous range only matters while both units are immobile, a unit with
+    # no weapons left has no use for its skill, and two units that can't damage each other only wait for MAX_ROUNDS.
+
+    def __init__(self, attacker, defender):
+        self.range_algorithm = range_algorithm_from_text(config['range_determination'])
+        skill_free = self.range_algorithm in EXACT_SKILL_FREE_RANGES
+        self.first_unit = ExactUnit(attacker, skill_free)
+        self.second_unit = ExactUnit(defender, skill_free)
+        self.max_tolerable_heat = int(config['max_tolerable_heat'])
+        # Armor repair is the only thing that goes on without weapons
+        self.stalemates = self.first_unit.armor_repair == 0 and self.second_unit.armor_repair == 0
+        self.terrain = [(percent_chance(config['woods_percent'][band]), percent_chance(config['cover_percent'][band]))
+                        for band in ['short', 'medium', 'long']]
+        self.exchanges = {}
+        self.transitions = {}  # (battle, ranges) -> ([(chance, battle number)], [(chance, finished battle number)])
+        self.numbers = {}
+        self.battles = []
+        self.finished_numbers = {}
+        self.finished_battles = []  # (first armor, first structure, second armor, second structure)
+
+    def number(self, battle):
+        try:
+            return self.numbers[battle]
+        except KeyError:
+            self.numbers[battle] = len(self.battles)
+            self.battles.append(battle)
+            return self.numbers[battle]
+
+    def finished_number(self, first_number, second_number):
+        first_state = self.first_unit.states[first_number]
+        second_state = self.second_unit.states[second_number]
+        finished_battle = (first_state.armor, first_state.structure, second_state.armor, second_state.structure)
+        try:
+            return self.finished_numbers[finished_battle]
+        except KeyError:
+            self.finished_numbers[finished_battle] = len(self.finished_battles)
+            self.finished_battles.append(finished_battle)
+            return self.finished_numbers[finished_battle]
+
+    def exchange(self, first_number, second_number, range_band):
+        # [(first unit was hit, second unit was hit, chance)] at range_band; the woods roll covers both shots
+        first_profile = self.first_unit.profile(first_number)
+        second_profile = self.second_unit.profile(second_number)
+        first_unit_fired = self.first_unit.states[first_number].heat <= self.max_tolerable_heat
+        second_unit_fired = self.second_unit.states[second_number].heat <= self.max_tolerable_heat
+        exchange_key = (first_profile, second_profile, first_unit_fired, second_unit_fired, range_band)
+        try:
+            return self.exchanges[exchange_key]
+        except KeyError:
+            pass
+        woods_chance, cover_chance = self.terrain[range_band]
+        hit_chances = {}
+        for terrain_chance, woods_mod in [(woods_chance, 2), (1 - woods_chance, 0)]:
+            second_hit_chance = 0.0
+            first_hit_chance = 0.0
+            if first_unit_fired:
+                second_hit_chance = exact_hit_chance(first_profile, self.second_unit.stealth,
+                                                     second_profile, range_band, woods_mod, cover_chance)
+            if second_unit_fired:
+                first_hit_chance = exact_hit_chance(second_profile, self.first_unit.stealth,
+                                                    first_profile, range_band, woods_mod, cover_chance)
+            for first_unit_was_hit, first_chance in [(True, first_hit_chance), (False, 1 - first_hit_chance)]:
+                for second_unit_was_hit, second_chance in [(True, second_hit_chance),
+                                                           (False, 1 - second_hit_chance)]:
+                    chance = terrain_chance * first_chance * second_chance
+                    if chance > 0:
+                        hits = (first_unit_was_hit, second_unit_was_hit)
+                        hit_chances[hits] = hit_chances.get(hits, 0.0) + chance
+        self.exchanges[exchange_key] = [(hits[0], hits[1], chance) for hits, chance in hit_chances.items()]
+        return self.exchanges[exchange_key]
+
+    def round_transitions(self, battle, current_round):
+        first_number, second_number, range_previous = battle
+        ranges = exact_range_get(self.range_algorithm, current_round, range_previous,
+                                 self.first_unit.view(first_number), self.second_unit.view(second_number))
+        transition_key = (battle, tuple(ranges))
+        try:
+            return self.transitions[transition_key]
+        except KeyError:
+            pass
+        first_state = self.first_unit.states[first_number]
+        second_state = self.second_unit.states[second_number]
+        first_unit_fired = first_state.heat <= self.max_tolerable_heat
+        second_unit_fired = second_state.heat <= self.max_tolerable_heat
+        # Ranges and hits that leave both units facing the same outcomes are added up before the outcomes are paired
+        pairings = {}
+        for range_chance, range_band in ranges:
+            first_hits = [self.first_unit.round_outcome(first_number, was_hit, int(second_state.weapons[range_band]),
+                                                        range_band, self.second_unit, first_unit_fired)
+                          for was_hit in [False, True]]
+            second_hits = [self.second_unit.round_outcome(second_number, was_hit, int(first_state.weapons[range_band]),
+                                                          range_band, self.first_unit, second_unit_fired)
+                           for was_hit in [False, True]]
+            for first_unit_was_hit, second_unit_was_hit, chance in self.exchange(first_number, second_number,
+                                                                                  range_band):
+                first_outcomes, first_immobile = first_hits[first_unit_was_hit]
+                second_outcomes, second_immobile = second_hits[second_unit_was_hit]
+                # The previous range only matters once both units are immobile
+                next_range = LONG_RANGE
+                if first_immobile and second_immobile:
+                    next_range = range_band
+                pairing_key = (id(first_outcomes), id(second_outcomes), next_range)
+                if pairing_key in pairings:
+                    pairings[pairing_key][3] += range_chance * chance
+                else:
+                    pairings[pairing_key] = [first_outcomes, second_outcomes, next_range, range_chance * chance]
+        next_battles = {}
+        finished = {}
+        for first_outcomes, second_outcomes, next_range, chance in pairings.values():
+            for first_outcome_chance, first_next, first_dead, first_immobile, first_unarmed in first_outcomes:
+                first_chance = chance * first_outcome_chance
+                first_idle = self.stalemates and first_unarmed
+                for second_outcome_chance, second_next, second_dead, second_immobile, second_unarmed in \
+                        second_outcomes:
+                    outcome_chance = first_chance * second_outcome_chance
+                    if first_dead or second_dead:
+                        finished_battle = (first_next, second_next)
+                        finished[finished_battle] = finished.get(finished_battle, 0.0) + outcome_chance
+                        continue
+                    if first_idle and second_unarmed:
+                        next_battle = self.stalemate(first_next, second_next)
+                    elif first_immobile and second_immobile:
+                        next_battle = (first_next, second_next, next_range)
+                    else:
+                        next_battle = (first_next, second_next, LONG_RANGE)
+                    next_battles[next_battle] = next_battles.get(next_battle, 0.0) + outcome_chance
+        self.transitions[transition_key] = ([(chance, self.number(next_battle))
+                                             for next_battle, chance in next_battles.items()],
+                                            [(chance, self.finished_number(*finished_battle))
+                                             for finished_battle, chance in finished.items()])
+        return self.transitions[transition_key]
+
+    def stalemate(self, first_number, second_number):
+        # Without weapons neither unit can change the other's armor or structure again, so all that is left is
+        # MAX_ROUNDS: such battles are merged into one immobile, cool battle per armor and structure
+        return self.first_unit.idle(first_number), self.second_unit.idle(second_number), LONG_RANGE
+
+    def explore(self, battle_numbers, current_round, max_states):
+        # Every battle that can still come up from battle_numbers, with its transitions for current_round and all
+        # later rounds. None once more than max_states battles have been numbered.
+        step = {}
+        pending = list(battle_numbers)
+        while len(pending) > 0:
+            battle_number = pending.pop()
+            if battle_number in step:
+                continue
+            if len(self.battles) > max_states:
+                return None
+            step[battle_number] = self.round_transitions(self.battles[battle_number], current_round)
+            for chance, next_number in step[battle_number][0]:
+                if next_number not in step:
+                    pending.append(next_number)
+        return step
+
+    def solve(self, max_states):
+        outcomes = [0.0, 0.0, 0.0]  # Ties, Attacker, Defender
+        rounds = {}
+        finished = {}  # Finished battle number -> chance
+        chances = {self.number((self.first_unit.number(self.first_unit.start),
+                                self.second_unit.number(self.second_unit.start), LONG_RANGE)): 1.0}
+        current_round = 0
+        # While the range can still depend on the round number, rounds are stepped a battle at a time
+        while current_round < min(EXACT_ROUND_SENSITIVE.get(self.range_algorithm, 0), MAX_ROUNDS + 1) and \
+                len(chances) > 0:
+            if len(chances) > max_states:
+                return None
+            current_round += 1
+            next_chances = {}
+            ended = 0.0
+            for battle_number, chance in chances.items():
+                next_battles, finished_battles = self.round_transitions(self.battles[battle_number], current_round)
+                for step_chance, next_number in next_battles:
+                    next_chances[next_number] = next_chances.get(next_number, 0.0) + chance * step_chance
+                for step_chance, finished_number in finished_battles:
+                    finished[finished_number] = finished.get(finished_number, 0.0) + chance * step_chance
+                    ended += chance * step_chance
+            if ended > 0:
+                rounds[current_round] = ended
+            chances = next_chances
+            if current_round <= MAX_ROUNDS:
+                chances = dict((battle_number, chance) for battle_number, chance in chances.items()
+                               if chance >= EXACT_MIN_CHANCE)
+        if current_round <= MAX_ROUNDS and len(chances) > 0:
+            # Every later round steps the same way: number all the battles that can still come up, then carry the
+            # chances forward as arrays
+            step = self.explore(list(chances), current_round + 1, max_states)
+            if step is None:
+                return None
+            if numpy is not None:
+                chances = self.rounds_step_arrays(step, chances, current_round, rounds, finished)
+            else:
+                chances = self.rounds_step(step, chances, current_round, rounds, finished)
+        # Battles still going after MAX_ROUNDS are ties
+        ended = 0.0
+        for battle_number, chance in chances.items():
+            first_number, second_number, range_previous = self.battles[battle_number]
+            finished_number = self.finished_number(first_number, second_number)
+            finished[finished_number] = finished.get(finished_number, 0.0) + chance
+            ended += chance
+        if ended > 0:
+            rounds[MAX_ROUNDS + 1] = rounds.get(MAX_ROUNDS + 1, 0.0) + ended
+        histograms = histograms_new()
+        for finished_number, chance in finished.items():
+            first_armor, first_structure, second_armor, second_structure = self.finished_battles[finished_number]
+            if (first_structure > 0) == (second_structure > 0):
+                outcomes[0] += chance
+            elif second_structure > 0:
+                outcomes[2] += chance
+            else:
+                outcomes[1] += chance
+            for histogram, value in zip(HISTOGRAMS[1:], self.finished_battles[finished_number]):
+                histograms[histogram][str(value)] = histograms[histogram].get(str(value), 0.0) + chance
+        expected_rounds = 0.0
+        for round_count, chance in sorted(rounds.items()):
+            histograms['rounds'][str(round_count)] = chance
+            expected_rounds += round_count * chance
+        return {'outcomes': outcomes, 'rounds': expected_rounds, 'histograms': histograms}
+
+    def rounds_step(self, step, chances, current_round, rounds, finished):
+        # Rounds current_round + 1 to MAX_ROUNDS + 1, without NumPy; returns the chances of the battles still going
+        while current_round <= MAX_ROUNDS and len(chances) > 0:
+            current_round += 1
+            next_chances = {}
+            ended = 0.0
+            for battle_number, chance in chances.items():
+                next_battles, finished_battles = step[battle_number]
+                for step_chance, next_number in next_battles:
+                    next_chances[next_number] = next_chances.get(next_number, 0.0) + chance * step_chance
+                for step_chance, finished_number in finished_battles:
+                    finished[finished_number] = finished.get(finished_number, 0.0) + chance * step_chance
+                    ended += chance * step_chance
+            if ended > 0:
+                rounds[current_round] = ended
+            chances = next_chances
+            if current_round <= MAX_ROUNDS:
+                chances = dict((battle_number, chance) for battle_number, chance in chances.items()
+                               if chance >= EXACT_MIN_CHANCE)
+        return chances
+
+    def rounds_step_arrays(self, step, chances, current_round, rounds, finished):
+        # rounds_step as one sparse matrix-vector product a round: battle numbers index the live part of the vector and
+        # finished battles follow them
+        battle_count = len(self.battles)
+        sources = []
+        targets = []
+        step_chances = []
+        for battle_number, (next_battles, finished_battles) in step.items():
+            for step_chance, next_number in next_battles:
+                sources.append(battle_number)
+                targets.append(next_number)
+                step_chances.append(step_chance)
+            for step_chance, finished_number in finished_battles:
+                sources.append(battle_number)
+                targets.append(battle_count + finished_number)
+                step_chances.append(step_chance)
+        sources = numpy.array(sources, dtype=numpy.int64)
+        targets = numpy.array(targets, dtype=numpy.int64)
+        step_chances = numpy.array(step_chances)
+        size = battle_count + len(self.finished_battles)
+        live = numpy.zeros(battle_count)
+        for battle_number, chance in chances.items():
+            live[battle_number] = chance
+        finished_total = numpy.zeros(len(self.finished_battles))
+        while current_round <= MAX_ROUNDS and live.any():
+            current_round += 1
+            spread = numpy.bincount(targets, weights=live[sources] * step_chances, minlength=size)
+            live = spread[:battle_count]
+            ended = spread[battle_count:].sum()
+            if ended > 0:
+                rounds[current_round] = ended
+            finished_total += spread[battle_count:]
+            if current_round <= MAX_ROUNDS:
+                live[live < EXACT_MIN_CHANCE] = 0.0
+        for finished_number in numpy.nonzero(finished_total)[0]:
+            finished[int(finished_number)] = finished.get(int(finished_number), 0.0) + \
+                float(finished_total[finished_number])
+        return dict((int(battle_number), float(live[battle_number])) for battle_number in numpy.nonzero(live)[0])
+
+
+def one_vs_one_exact(attacker, defender, max_states):
+    # Exact one_vs_one: carries the probability of every reachable battle state forward a round at a time.
+    # Returns None, before working out any more of them, once more than max_states battle states have come up.
+    return ExactSolver(attacker, defender).solve(max_states)
+
+
+def engine_get():
+    if config['engine'] == 'numpy' and numpy is None:
+        logging.warning('NumPy is not installed; falling back to the scalar engine.')
+        config['engine'] = 'scalar'
+    elif config['engine'] not in ['scalar', 'numpy', 'exact']:
+        logging.warning('Undefined engine option: ' + str(config['engine']) + '; setting to scalar.')
+        config['engine'] = 'scalar'
+    return config['engine']
+
+
+def matchup_battles(attacker, defender, battle_runs, seed=None):
+    wins = [0, 0, 0]  # Ties, Attacker, Defender
+    rounds = 0
+    engine = engine_get()
+    if engine == 'exact':
+        exact_result = one_vs_one_exact(attacker, defender, int(config['exact_max_states']))
+        if exact_result is not None:
+            logging.info('Exact odds for ' + attacker['name'] + ' vs ' + defender['name'] + ': ' +
+                         str(exact_result['outcomes'][1]) + '/' + str(exact_result['outcomes'][2]) + '/' +
+                         str(exact_result['outcomes'][0]))
+            # Scaled to battle_runs so the CSV/BBCode output reads the same as for a sampled run, shared out so that
+            # the three counts still add up to battle_runs
+            wins = counts_share(exact_result['outcomes'], battle_runs)
+            histograms = histograms_new()
+            for histogram in HISTOGRAMS:
+                for value, chance in exact_result['histograms'][histogram].items():
+                    histograms[histogram][value] = round_half_up(chance * battle_runs, 6)
+            return {'wins': wins, 'rounds': exact_result['rounds'] * battle_runs, 'battle_runs': battle_runs,
+                    'histograms': histograms}
+        logging.info('Too many states for the exact solver in ' + attacker['name'] + ' vs ' + defender['name'] +
+                     '; sampling instead.')
+        if numpy is not None:
+            engine = 'numpy'
+        else:
+            engine = 'scalar'
+    histograms = histograms_new()
+    variance_reduction = config['variance_reduction']['antithetic'] or \
+        config['variance_reduction']['common_random_numbers'] in ['row', 'column']
+    # With antithetic runs the second half of the battles mirror the dice of the first half, battle for battle
+    streams = battle_runs
+    if config['variance_reduction']['antithetic']:
+        streams = battle_runs - battle_runs // 2
+    if engine == 'numpy':
+        if config['variance_reduction']['antithetic']:
+            # Both halves draw the same shapes, so the pairs line up exactly until the batches drop finished battles
+            # at different rounds; an odd battle out is trimmed from the mirrored half
+            mirrored = battle_runs - streams
+            batch_parts = [one_vs_one_batch(attacker, defender, streams, numpy.random.RandomState(seed)),
+                           one_vs_one_batch(attacker, defender, streams, MirroredRandomState(seed))]
+            winners = numpy.concatenate([batch_parts[0][0], batch_parts[1][0][:mirrored]])
+            battle_rounds = numpy.concatenate([batch_parts[0][1], batch_parts[1][1][:mirrored]])
+            remaining = numpy.concatenate([batch_parts[0][2], batch_parts[1][2][:, :mirrored]], axis=1)
+        else:
+            winners, battle_rounds, remaining = one_vs_one_batch(attacker, defender, battle_runs,
+                                                                 numpy.random.RandomState(seed))
+        battle_winners = winners.tolist()
+        wins = [int(count) for count in numpy.bincount(winners, minlength=3)]
+        rounds = int(battle_rounds.sum())
+        for histogram, values in zip(HISTOGRAMS, [battle_rounds] + list(remaining)):
+            for value, count in zip(*numpy.unique(values, return_counts=True)):
+                histograms[histogram][str(value)] = int(count)
+    else:
+        dice.reseed(seed)
+        attacking_unit = unit_create_from_dict(attacker)
+        defending_unit = unit_create_from_dict(defender)
+        counters = [collections.Counter() for histogram in HISTOGRAMS]
+        battle_winners = []
+        for battle in range(0, battle_runs):
+            if variance_reduction:
+                # Battle n of every cell sharing this seed starts from the same dice, however long earlier battles ran
+                dice.reseed(seed_derive(seed, battle % streams), mirrored=battle >= streams,
+                            buffer_size=BATTLE_DICE_BUFFER_SIZE)
+            attacking_unit.reset()
+            defending_unit.reset()
+            result_dict = one_vs_one(attacking_unit, defending_unit)
+            if variance_reduction:
+                battle_winners.append(result_dict['winner'])
+            wins[result_dict['winner']] += 1
+            rounds += result_dict['rounds']
+            counters[0][result_dict['rounds']] += 1
+            counters[1][attacking_unit.armor] += 1
+            counters[2][attacking_unit.structure] += 1
+            counters[3][defending_unit.armor] += 1
+            counters[4][defending_unit.structure] += 1
+        for histogram, counter in zip(HISTOGRAMS, counters):
+            for value, count in counter.items():
+                histograms[histogram][str(value)] = count
+    result_dict = {'wins': wins, 'rounds': rounds, 'battle_runs': battle_runs, 'histograms': histograms}
+    # On the numpy engine antithetic pairs drift apart once their batches drop finished battles at different rounds,
+    # so they can't be scored as pairs
+    if variance_reduction and not (engine == 'numpy' and config['variance_reduction']['antithetic']):
+        result_dict['variance_units'] = variance_units(battle_winners, streams)
+    return result_dict
+
+
+def variance_units(battle_winners, streams):
+    # The attacker's wins as independent samples: one per battle, or one per antithetic pair (the pair's mean)
+    attacker_wins = [float(winner == 1) for winner in battle_winners]
+    if not config['variance_reduction']['antithetic']:
+        return attacker_wins
+    return [(attacker_wins[battle] + attacker_wins[streams + battle]) / 2
+            for battle in range(0, len(battle_winners) - streams)]
+
+
+def sample_variance(values):
+    mean = sum(values) / len(values)
+    return sum((value - mean) ** 2 for value in values) / (len(values) - 1)
+
+
+def variance_reduction_report(attacker_list, defender_list, cell_units):
+    # Variance of the attacker win rates (and of the differences between neighbouring cells of a row or column)
+    # against what independent battles would have given. A factor of 4 means a quarter of the battles for the same
+    # precision.
+    cells = [cell for cell in sorted(cell_units) if len(cell_units[cell]) > 1]
+    if len(cells) == 0:
+        return
+    battles_per_unit = 1
+    if config['variance_reduction']['antithetic']:
+        battles_per_unit = 2
+    independent = {}
+    achieved = {}
+    for cell in cells:
+        units = cell_units[cell]
+        win_rate = sum(units) / len(units)
+        independent[cell] = win_rate * (1 - win_rate) / (len(units) * battles_per_unit)
+        achieved[cell] = sample_variance(units) / len(units)
+    logging.critical('====================')
+    if config['variance_reduction']['antithetic'] and sum(achieved.values()) > 0:
+        logging.critical('Antithetic runs: win rate variance reduced ' +
+                         str(round_half_up(sum(independent.values()) / sum(achieved.values()), 2)) + 'x over ' +
+                         str(len(cells)) + ' cells')
+    common_random_numbers = config['variance_reduction']['common_random_numbers']
+    if common_random_numbers in ['row', 'column']:
+        # Neighbouring cells that share their dice: same attacker for 'row', same defender for 'column'
+        if common_random_numbers == 'row':
+            groups = sorted(cells)
+        else:
+            groups = sorted(cells, key=lambda cell: (cell[1], cell[0]))
+        separate = 0.0
+        shared = 0.0
+        comparisons = 0
+        for first_cell, second_cell in zip(groups, groups[1:]):
+            if common_random_numbers == 'row' and first_cell[0] != second_cell[0]:
+                continue
+            if common_random_numbers == 'column' and first_cell[1] != second_cell[1]:
+                continue
+            units = min(len(cell_units[first_cell]), len(cell_units[second_cell]))
+            if units < 2:
+                continue
+            differences = [cell_units[first_cell][unit] - cell_units[second_cell][unit] for unit in range(0, units)]
+            separate += achieved[first_cell] + achieved[second_cell]
+            shared += sample_variance(differences) / units
+            comparisons += 1
+        if shared > 0:
+            logging.critical('Common random numbers: variance of win rate differences along each ' +
+                             common_random_numbers + ' reduced ' + str(round_half_up(separate / shared, 2)) +
+                             'x over ' + str(comparisons) + ' neighbouring pairs')
+
+
+def histograms_new():
+    # Battles (or, from the exact solver, expected battles) per value, keyed by str(value) so they survive JSON
+    return dict((histogram, {}) for histogram in HISTOGRAMS)
+
+
+def result_merge(result_dict, more_results):
+    wins = [result_dict['wins'][winner] + more_results['wins'][winner] for winner in [0, 1, 2]]
+    merged = {'wins': wins, 'rounds': result_dict['rounds'] + more_results['rounds'],
+              'battle_runs': result_dict['battle_runs'] + more_results['battle_runs']}
+    if 'variance_units' in result_dict or 'variance_units' in more_results:
+        merged['variance_units'] = result_dict.get('variance_units', []) + more_results.get('variance_units', [])
+    if 'histograms' in result_dict and 'histograms' in more_results:
+        # Results cached before histograms were kept can't be merged into a complete histogram
+        merged['histograms'] = histograms_new()
+        for histogram in HISTOGRAMS:
+            for part in [result_dict, more_results]:
+                for value, count in part['histograms'][histogram].items():
+                    merged['histograms'][histogram][value] = merged['histograms'][histogram].get(value, 0) + count
+    return merged
+
+
+def z_score(confidence):
+    # Two-sided normal quantile for the confidence level, found by bisection on erf
+    low = 0.0
+    high = 10.0
+    for step in range(0, 60):
+        middle = (low + high) / 2
+        if math.erf(middle / math.sqrt(2)) < confidence:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+def win_rate_interval(wins, battle_runs, z):
+    # Wilson score interval
+    rate = float(wins) / battle_runs
+    denominator = 1 + z * z / battle_runs
+    centre = (rate + z * z / (2 * battle_runs)) / denominator
+    margin = z * math.sqrt(rate * (1 - rate) / battle_runs + z * z / (4 * battle_runs * battle_runs)) / denominator
+    return [max(0.0, centre - margin), min(1.0, centre + margin)]
+
+
+def adaptive_intervals(result_dict):
+    z = z_score(float(config['adaptive']['confidence']))
+    return [win_rate_interval(wins, result_dict['battle_runs'], z) for wins in result_dict['wins']]
+
+
+def adaptive_done(result_dict):
+    if result_dict['battle_runs'] >= int(config['adaptive']['max_runs']):
+        return True
+    intervals = adaptive_intervals(result_dict)
+    widest = max(intervals[1][1] - intervals[1][0], intervals[2][1] - intervals[2][0])
+    return widest <= 2 * float(config['adaptive']['tolerance'])
+
+
+def matchup_run_adaptive(attacker, defender, seed=None, result_dict=None):
+    # Run batches until the attacker and defender win rates are both known to within the tolerance
+    while result_dict is None or not adaptive_done(result_dict):
+        runs_done = 0
+        if result_dict is not None:
+            runs_done = result_dict['battle_runs']
+        batch_runs = max(1, min(int(config['adaptive']['batch_runs']), int(config['adaptive']['max_runs']) - runs_done))
+        batch_seed = None
+        if seed is not None:
+            batch_seed = seed_derive(seed, runs_done)
+        batch_results = matchup_battles(attacker, defender, batch_runs, seed=batch_seed)
+        if result_dict is None:
+            result_dict = batch_results
+        else:
+            result_dict = result_merge(result_dict, batch_results)
+    return result_dict
+
+
+def matchup_complete(result_dict):
+    # Whether an earlier (cached) result already covers what this run asks for
+    if engine_get() == 'exact':
+        return result_dict['battle_runs'] == int(config['battle_runs'])
+    elif config['adaptive']['enabled']:
+        return adaptive_done(result_dict)
+    return result_dict['battle_runs'] >= int(config['battle_runs'])
+
+
+def counts_share(weights, total):
+    # Largest remainder: each weight's share of total, rounded so that the shares still add up to total
+    weight_sum = float(sum(weights))
+    shares = [weight * total / weight_sum for weight in weights]
+    counts = [int(math.floor(share)) for share in shares]
+    order = sorted(range(0, len(shares)), key=lambda index: (counts[index] - shares[index], index))
+    for index in order[:total - sum(counts)]:
+        counts[index] += 1
+    return counts
+
+
+def result_scale(result_dict, battle_runs):
+    # The result as if only battle_runs of its battles had been played, so a cell cached with more battles counts the
+    # same number as the rest of the grid
+    scale = float(battle_runs) / result_dict['battle_runs']
+    scaled = {'wins': counts_share(result_dict['wins'], battle_runs), 'rounds': result_dict['rounds'] * scale,
+              'battle_runs': battle_runs}
+    if 'histograms' in result_dict:
+        scaled['histograms'] = histograms_new()
+        for histogram in HISTOGRAMS:
+            values = sorted(result_dict['histograms'][histogram])
+            counts = counts_share([result_dict['histograms'][histogram][value] for value in values], battle_runs)
+            for value, count in zip(values, counts):
+                if count > 0:
+                    scaled['histograms'][histogram][value] = count
+    return scaled
+
+
+def matchup_run(attacker, defender, seed=None, cached=None):
+    adaptive = config['adaptive']['enabled'] and engine_get() != 'exact'
+    if cached is not None and matchup_complete(cached):
+        result_dict = dict(cached)
+        if not adaptive and result_dict['battle_runs'] > int(config['battle_runs']):
+            result_dict = result_scale(result_dict, int(config['battle_runs']))
+    elif adaptive:
+        result_dict = matchup_run_adaptive(attacker, defender, seed=seed, result_dict=cached)
+    elif cached is not None and engine_get() != 'exact':
+        # Top the cached cell up to battle_runs
+        top_up_seed = None
+        if seed is not None:
+            top_up_seed = seed_derive(seed, cached['battle_runs'])
+        result_dict = result_merge(cached, matchup_battles(attacker, defender,
+                                                           int(config['battle_runs']) - cached['battle_runs'],
+                                                           seed=top_up_seed))
+    else:
+        result_dict = matchup_battles(attacker, defender, int(config['battle_runs']), seed=seed)
+    result_dict.pop('intervals', None)
+    if adaptive:
+        result_dict['intervals'] = adaptive_intervals(result_dict)
+    return result_dict
+
+
+class ResultCache(object):
+    # On-disk store of matchup results, keyed by matchup_cache_key and evicted least-recently-used first
+
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, payload TEXT, '
+                                'battle_runs INTEGER, last_used REAL)')
+        self.connection.commit()
+
+    def get(self, key):
+        row = self.connection.execute('SELECT payload FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        self.connection.execute('UPDATE results SET last_used = ? WHERE key = ?', (time.time(), key))
+        self.connection.commit()
+        return json.loads(row[0])
+
+    def put(self, key, result_dict):
+        payload = dict(result_dict)
+        payload.pop('intervals', None)
+        self.connection.execute('INSERT OR REPLACE INTO results (key, payload, battle_runs, last_used) '
+                                'VALUES (?, ?, ?, ?)', (key, json.dumps(payload), payload['battle_runs'], time.time()))
+        entries = self.connection.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        if entries > self.max_entries:
+            self.connection.execute('DELETE FROM results WHERE key IN '
+                                    '(SELECT key FROM results ORDER BY last_used LIMIT ?)',
+                                    (entries - self.max_entries,))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+
+def result_cache_open():
+    if not config['cache']['enabled']:
+        return None
+    try:
+        return ResultCache(config['cache']['path'], int(config['cache']['max_entries']))
+    except sqlite3.Error as why:
+        logging.error('Failed to open result cache ' + config['cache']['path'] + ' - ' + str(why))
+        return None
+
+
+def unit_stats(stat_dict):
+    # The entries of a unit list entry that affect a battle (not its name, points or comments)
+    stats = {}
+    for stat in ['type', 'armor', 'structure', 'weapons', 'move', 'skill', 'motive', 'jump', 'special']:
+        if stat in stat_dict:
+            stats[stat] = stat_dict[stat]
+    if 'skill' not in stats:
+        stats['skill'] = int(config['skill_default'])
+    return stats
+
+
+def matchup_cache_key(attacker, defender):
+    key_data = {
+        'attacker': unit_stats(attacker),
+        'defender': unit_stats(defender),
+        'range_determination': config['range_determination'],
+        'woods_percent': config['woods_percent'],
+        'cover_percent': config['cover_percent'],
+        'max_tolerable_heat': int(config['max_tolerable_heat']),
+        'exact': engine_get() == 'exact',
+        'rules_version': RULES_VERSION
+    }
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def average_rounds(result_dict):
+    return round_half_up(float(result_dict['rounds']) / float(result_dict['battle_runs']), 1)
+
+
+def interval_text(result_dict, winner):
+    # Runs used and win-rate interval for adaptive runs; empty otherwise
+    if 'intervals' not in result_dict:
+        return ''
+    interval = result_dict['intervals'][winner]
+    return '[' + str(result_dict['battle_runs']) + ' runs, ' + str(round_half_up(interval[0], 3)) + '-' + \
+           str(round_half_up(interval[1], 3)) + ']'
+
+
+def matchup_result_log(attacker, defender, result_dict):
+    wins = result_dict['wins']
+    logging.critical('====================')
+    logging.critical(attacker['name'] + ': ' + str(wins[1]))
+    logging.critical(defender['name'] + ': ' + str(wins[2]))
+    logging.critical('Ties: ' + str(wins[0]))
+    logging.critical('Average battle length: ' + str(average_rounds(result_dict)))
+    if 'intervals' in result_dict:
+        logging.critical('Battles run: ' + str(result_dict['battle_runs']))
+        logging.critical(attacker['name'] + ' win rate: ' + str(round_half_up(result_dict['intervals'][1][0], 3)) +
+                         '-' + str(round_half_up(result_dict['intervals'][1][1], 3)))
+
+
+def master_seed_get():
+    if config['seed'] is None:
+        config['seed'] = random.SystemRandom().randint(0, 2 ** 31 - 1)
+        logging.info('No seed given; using seed ' + str(config['seed']))
+    return int(config['seed'])
+
+
+def seed_derive(*seed_parts):
+    seed_key = '|'.join([str(part) for part in seed_parts])
+    if not isinstance(seed_key, bytes):
+        seed_key = seed_key.encode('utf-8')
+    return int(hashlib.sha256(seed_key).hexdigest()[:8], 16)
+
+
+def cell_seed(master_seed, attacker, defender):
+    # Taken from the pairing itself rather than its place in the run, so results don't depend on the worker count.
+    # With common random numbers every cell of a row (same attacker) or column (same defender) gets the same seed.
+    if config['variance_reduction']['common_random_numbers'] == 'row':
+        return seed_derive(master_seed, attacker['name'], 'row')
+    elif config['variance_reduction']['common_random_numbers'] == 'column':
+        return seed_derive(master_seed, 'column', defender['name'])
+    return seed_derive(master_seed, attacker['name'], defender['name'])
+
+
+def grid_worker_init(parent_config):
+    config.update(parent_config)
+    logging_configure('', int(config['log_level']))
+    trace_configure('', int(config['log_level']))
+
+
+def grid_cell_run(task):
+    cell, attacker, defender, seed, cached = task
+    if battle_profile is not None:
+        cell_start = timeit.default_timer()
+        result_dict = matchup_run(attacker, defender, seed=seed, cached=cached)
+        battle_profile.cell_add(attacker, defender, result_dict['battle_runs'], timeit.default_timer() - cell_start)
+        return cell, result_dict
+    return cell, matchup_run(attacker, defender, seed=seed, cached=cached)
+
+
+def checkpoint_run_key(attacker_list, defender_list, pairings):
+    # Identifies a grid run: a checkpoint is only resumed by the same run
+    key_data = {
+        'attackers': attacker_list,
+        'defenders': defender_list,
+        'pairings': pairings,
+        'rules_version': RULES_VERSION
+    }
+    for setting in ['battle_runs', 'seed', 'adaptive', 'engine', 'exact_max_states', 'range_determination',
+                    'woods_percent', 'cover_percent', 'max_tolerable_heat', 'variance_reduction', 'skill_default']:
+        key_data[setting] = config[setting]
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def checkpoint_start(attacker_list, defender_list, pairings):
+    # Returns the checkpoint file to append finished cells to (or None), the cells already finished and the master seed
+    if not config['checkpoint']['enabled']:
+        return None, {}, master_seed_get()
+    checkpoint_path = config['checkpoint']['path']
+    run_key = checkpoint_run_key(attacker_list, defender_list, pairings)
+    finished = {}
+    header = None
+    if config['resume'] and os.path.isfile(checkpoint_path):
+        with open(checkpoint_path) as checkpoint_file:
+            checkpoint_lines = checkpoint_file.readlines()
+        try:
+            header = json_loads_byteified(checkpoint_lines[0])
+        except (ValueError, IndexError):
+            header = None
+        if header is not None and header['run'] == run_key:
+            for line in checkpoint_lines[1:]:
+                try:
+                    attacker_index, defender_index, result_dict = json_loads_byteified(line)
+                except ValueError:
+                    # The line being written when the run stopped
+                    break
+                finished[(attacker_index, defender_index)] = result_dict
+            config['seed'] = header['master_seed']
+            logging.warning('Resuming from ' + checkpoint_path + ': ' + str(len(finished)) + ' of ' +
+                            str(len(pairings)) + ' cells already done.')
+        else:
+            header = None
+            logging.warning('Checkpoint ' + checkpoint_path + ' is from a different run; starting over.')
+    if header is None:
+        header = {'run': run_key, 'master_seed': master_seed_get()}
+    try:
+        checkpoint_file = open(checkpoint_path, 'w')
+        checkpoint_file.write(json.dumps(header) + '\n')
+        for cell in sorted(finished):
+            checkpoint_write(checkpoint_file, cell, finished[cell])
+    except IOError as why:
+        logging.error('Unable to write checkpoint ' + checkpoint_path + ' - ' + str(why))
+        checkpoint_file = None
+    return checkpoint_file, finished, master_seed_get()
+
+
+def checkpoint_write(checkpoint_file, cell, result_dict):
+    checkpoint_file.write(json.dumps([cell[0], cell[1], result_dict], separators=(',', ':')) + '\n')
+    checkpoint_file.flush()
+    os.fsync(checkpoint_file.fileno())
+
+
+batch_results = None  # Finished cells shared by the jobs of a batch, by batch_result_key; None outside a batch
+
+
+def batch_result_key(attacker, defender, seed):
+    # Everything a cell's result depends on, so a cell repeated in another job of the batch is taken as-is
+    key_data = [matchup_cache_key(attacker, defender), seed, engine_get(), int(config['battle_runs']),
+                config['adaptive'], int(config['exact_max_states']), config['variance_reduction']]
+    return json.dumps(key_data, sort_keys=True)
+
+
+def grid_run(attacker_list, defender_list, pairings):
+    checkpoint_file, results, master_seed = checkpoint_start(attacker_list, defender_list, pairings)
+    cache = result_cache_open()
+    cache_keys = {}
+    batch_keys = {}
+    cell_units = {}
+    tasks = []
+    for attacker_index, defender_index in pairings:
+        cell = (attacker_index, defender_index)
+        if cell in results:
+            continue
+        attacker = attacker_list[attacker_index]
+        defender = defender_list[defender_index]
+        if batch_results is not None:
+            batch_keys[cell] = batch_result_key(attacker, defender, cell_seed(master_seed, attacker, defender))
+            if batch_keys[cell] in batch_results:
+                logging.info('Using result from an earlier job for ' + attacker['name'] + ' vs ' + defender['name'])
+                results[cell] = copy.deepcopy(batch_results[batch_keys[cell]])
+                if checkpoint_file is not None:
+                    checkpoint_write(checkpoint_file, cell, results[cell])
+                continue
+        cached = None
+        if cache is not None:
+            cache_keys[cell] = matchup_cache_key(attacker, defender)
+            cached = cache.get(cache_keys[cell])
+            if cached is not None and matchup_complete(cached):
+                logging.info('Using cached result for ' + attacker['name'] + ' vs ' + defender['name'])
+                results[cell] = matchup_run(attacker, defender, cached=cached)
+                if batch_results is not None:
+                    batch_results[batch_keys[cell]] = copy.deepcopy(results[cell])
+                if checkpoint_file is not None:
+                    checkpoint_write(checkpoint_file, cell, results[cell])
+                continue
+        tasks.append((cell, attacker, defender, cell_seed(master_seed, attacker, defender), cached))
+    if config['variance_reduction']['antithetic'] and engine_get() == 'numpy' and len(tasks) > 0:
+        logging.warning('Antithetic pairs drift apart on the numpy engine; no variance reduction is reported for them. '
+                        'Use the scalar engine to measure it.')
+    workers = min(int(config['workers']), len(tasks))
+    distributed = config['distributed']['enabled'] and len(tasks) > 0
+    if (workers > 1 or distributed) and battle_trace is not None and battle_trace.trace_file is not None:
+        logging.warning('Tracing battles to a file; running on a single worker.')
+        workers = 1
+        distributed = False
+    if (workers > 1 or distributed) and battle_profile is not None:
+        logging.warning('Profiling; running on a single worker.')
+        workers = 1
+        distributed = False
+    if distributed:
+        pool = None
+        cell_results = coordinator_get().run(tasks)
+    elif workers > 1:
+        # One cell per task, handed out as workers free up, so long matchups don't leave the other cores idle
+        pool = multiprocessing.Pool(workers, initializer=grid_worker_init, initargs=(config,))
+        cell_results = pool.imap_unordered(grid_cell_run, tasks)
+    else:
+        pool = None
+        cell_results = (grid_cell_run(task) for task in tasks)
+    try:
+        for cell, result_dict in cell_results:
+            if 'variance_units' in result_dict:
+                cell_units[cell] = result_dict.pop('variance_units')
+            results[cell] = result_dict
+            if cache is not None:
+                cache.put(cache_keys[cell], result_dict)
+            if batch_results is not None:
+                batch_results[batch_keys[cell]] = copy.deepcopy(result_dict)
+            if checkpoint_file is not None:
+                checkpoint_write(checkpoint_file, cell, result_dict)
+        if pool is not None:
+            pool.close()
+    except BaseException:
+        if pool is not None:
+            pool.terminate()
+        raise
+    finally:
+        if cache is not None:
+            cache.close()
+        if checkpoint_file is not None:
+            checkpoint_file.close()
+    if pool is not None:
+        pool.join()
+    if len(cell_units) > 0:
+        variance_reduction_report(attacker_list, defender_list, cell_units)
+    return results
+
+
+def address_parse(address):
+    host, separator, port = address.rpartition(':')
+    return host, int(port)
+
+
+def authkey_get():
+    # Connections carry pickled data, so there is no default key: the coordinator and its workers must share one
+    authkey = config['distributed']['authkey'] or os.environ.get(AUTHKEY_VARIABLE, '')
+    if len(authkey) == 0:
+        raise RuntimeError('Distributed runs need an authkey: set "distributed": {"authkey": ...} in the config or '
+                           'the ' + AUTHKEY_VARIABLE + ' environment variable, the same on the coordinator and every '
+                           'worker.')
+    return authkey.encode('utf-8')
+
+
+grid_coordinator = None  # GridCoordinator serving this run's cells to workers, once the first distributed grid starts
+
+
+class GridCoordinator(object):
+    # Serves grid cells to workers over TCP, one thread per connected worker. A worker is sent the config once per
+    # grid, then one cell at a time, and answers each with its result. A cell whose worker drops, errors or times out
+    # goes back on the queue for another worker, up to max_retries times.
+
+    def __init__(self, address):
+        self.address = address
+        self.task_timeout = float(config['distributed']['task_timeout'])
+        self.max_retries = int(config['distributed']['max_retries'])
+        self.idle_timeout = float(config['distributed']['idle_timeout'])
+        self.tasks = queue.Queue()  # (grid, attempts, task)
+        self.results = queue.Queue()  # (grid, cell, result_dict or None when out of retries)
+        self.grid = 0
+        self.grid_config = None
+        self.closing = False
+        self.threads = []
+        self.workers = 0  # Connected workers
+        self.workers_lock = threading.Lock()
+        self.listener = Listener(address_parse(address), authkey=authkey_get())
+        accept_thread = threading.Thread(target=self.accept_loop)
+        accept_thread.daemon = True
+        accept_thread.start()
+        logging.warning('Coordinator listening on ' + address + '; start workers with --worker ' + address)
+
+    def accept_loop(self):
+        while not self.closing:
+            try:
+                connection = self.listener.accept()
+            except (EOFError, IOError, OSError, multiprocessing.AuthenticationError) as why:
+                if not self.closing:
+                    logging.warning('Refused a worker connection - ' + str(why))
+                continue
+            connection_thread = threading.Thread(target=self.connection_serve, args=(connection,))
+            connection_thread.daemon = True
+            connection_thread.start()
+            self.threads.append(connection_thread)
+
+    def task_next(self):
+        # The next cell of the current grid; None once the coordinator is closing
+        while not self.closing:
+            try:
+                task = self.tasks.get(timeout=COORDINATOR_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if task[0] == self.grid:
+                return task
+        return None
+
+    def task_retry(self, task, worker_name, why):
+        grid, attempts, cell_task = task
+        logging.warning('Worker ' + worker_name + ' failed ' + cell_task[1]['name'] + ' vs ' + cell_task[2]['name'] +
+                        ' - ' + str(why))
+        if attempts + 1 >= self.max_retries:
+            self.results.put((grid, cell_task[0], None))
+        else:
+            self.tasks.put((grid, attempts + 1, cell_task))
+
+    def connection_serve(self, connection):
+        worker_name = 'unknown'
+        task = None
+        with self.workers_lock:
+            self.workers += 1
+        try:
+            worker_name = str(connection.recv())
+            logging.info('Worker ' + worker_name + ' connected.')
+            worker_grid = None
+            while True:
+                task = self.task_next()
+                if task is None:
+                    connection.send(('done', None))
+                    return
+                grid, attempts, cell_task = task
+                if worker_grid != grid:
+                    connection.send(('config', self.grid_config))
+                    worker_grid = grid
+                connection.send(('task', cell_task))
+                if self.task_timeout > 0 and not connection.poll(self.task_timeout):
+                    raise IOError('no result after ' + str(self.task_timeout) + ' seconds')
+                status, result_dict = connection.recv()
+                if status == 'result':
+                    self.results.put((grid, cell_task[0], result_dict))
+                else:
+                    self.task_retry(task, worker_name, result_dict)
+                task = None
+        except (EOFError, IOError, OSError) as why:
+            if task is not None:
+                self.task_retry(task, worker_name, str(why) or 'connection closed')
+            else:
+                logging.info('Worker ' + worker_name + ' disconnected - ' + str(why))
+        finally:
+            with self.workers_lock:
+                self.workers -= 1
+            connection.close()
+
+    def run(self, tasks):
+        # Yields (cell, result_dict) as workers finish them, like the pool's imap_unordered
+        self.grid += 1
+        self.grid_config = copy.deepcopy(config)
+        for task in tasks:
+            self.tasks.put((self.grid, 0, task))
+        finished = 0
+        idle_since = time.time()
+        while finished < len(tasks):
+            try:
+                grid, cell, result_dict = self.results.get(timeout=COORDINATOR_POLL_SECONDS)
+            except queue.Empty:
+                # A cell may take a long time, but without any worker connected none will ever finish
+                if self.workers > 0:
+                    idle_since = time.time()
+                elif self.idle_timeout > 0 and time.time() - idle_since > self.idle_timeout:
+                    raise RuntimeError('No workers connected for ' + str(self.idle_timeout) + ' seconds; ' +
+                                       str(len(tasks) - finished) + ' of ' + str(len(tasks)) + ' cells unfinished.')
+                continue
+            if grid != self.grid:
+                continue
+            if result_dict is None:
+                raise RuntimeError('Cell ' + str(cell) + ' failed on ' + str(self.max_retries) + ' attempts.')
+            finished += 1
+            yield cell, result_dict
+
+    def close(self):
+        # Tells waiting workers the run is over
+        self.closing = True
+        for connection_thread in self.threads:
+            connection_thread.join(2 * COORDINATOR_POLL_SECONDS)
+        self.listener.close()
+
+
+def coordinator_get():
+    global grid_coordinator
+    if grid_coordinator is None:
+        grid_coordinator = GridCoordinator(config['distributed']['address'])
+    return grid_coordinator
+
+
+def coordinator_close():
+    global grid_coordinator
+    if grid_coordinator is not None:
+        grid_coordinator.close()
+        grid_coordinator = None
+
+
+def worker_run(address):
+    # Works through cells for the coordinator at address until it has none left, in workers processes
+    authkey_get()  # Fail here rather than in every worker process
+    workers = max(1, int(config['workers']))
+    if workers == 1:
+        worker_loop(address)
+        return
+    processes = [multiprocessing.Process(target=worker_process, args=(address, config)) for worker in range(workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+
+
+def worker_process(address, parent_config):
+    grid_worker_init(parent_config)
+    worker_loop(address)
+
+
+def worker_loop(address):
+    worker_name = socket.gethostname() + '/' + str(os.getpid())
+    connect_timeout = float(config['distributed']['connect_timeout'])
+    give_up = time.time() + connect_timeout
+    while True:
+        try:
+            connection = Client(address_parse(address), authkey=authkey_get())
+        except (EOFError, IOError, OSError) as why:
+            if time.time() > give_up:
+                logging.error('No coordinator at ' + address + ' - ' + str(why))
+                return
+            time.sleep(1)
+            continue
+        try:
+            connection.send(worker_name)
+            while True:
+                message, payload = connection.recv()
+                if message == 'done':
+                    return
+                elif message == 'config':
+                    # The coordinator's settings, but keep working for the same address
+                    config.clear()
+                    config.update(payload)
+                else:
+                    try:
+                        cell, result_dict = grid_cell_run(payload)
+                    except Exception as why:
+                        connection.send(('error', str(why)))
+                        continue
+                    connection.send(('result', result_dict))
+        except (EOFError, IOError, OSError) as why:
+            logging.warning('Lost the coordinator at ' + address + ' - ' + (str(why) or 'connection closed') +
+                            '; reconnecting.')
+            give_up = time.time() + connect_timeout
+        finally:
+            connection.close()
+
+
+def unit_list_pairings(unit_list):
+    # The cells unit_list_fight simulates: identical units are skipped, as are attackers whose row is already done
+    pairings = []
+    completed_attackers = []
+    for attacker_index, attacker in enumerate(unit_list):
+        if attacker['name'] not in completed_attackers:
+            for defender_index, defender in enumerate(unit_list):
+                if attacker['name'] != defender['name']:
+                    pairings.append((attacker_index, defender_index))
+        completed_attackers.append(attacker['name'])
+    return pairings
+
+
+def config_set_from_command_line():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', default=CONFIG_FILE,
+                        help='JSON file that will override settings in script, but be overridden by command line',
+                        dest='config_file')
+    parser.add_argument('--config_print', help='Display all configuration options with their current setting',
+                        action="store_true")
+    for argument in config:
+        if isinstance(config[argument], bool):
+            parser.add_argument('--' + argument, action="store_true")
+        elif isinstance(config[argument], int):
+            parser.add_argument('--' + argument, type=int)
+        elif isinstance(config[argument], float):
+            parser.add_argument('--' + argument, type=float)
+        elif isinstance(config[argument], list):
+            parser.add_argument('--' + argument, action="append")
+        else:
+            parser.add_argument('--' + argument)
+    try:
+        args = parser.parse_args()
+    except BaseException as why:
+        if str(why) != '0':
+            print('Command line error: ' + str(why))
+            try:
+                print(parser.print_help())
+            except BaseException as print_error:
+                print('Parser error: ' + str(print_error))
+        sys.exit(1)
+    if args.config_file is not None:
+        config_update_from_json(args.config_file)
+    config_update_from_args(args)
+    if args.config_print:
+        config_print()
+    return args
+
+
+def config_update_from_json(json_path):
+    # Read JSON file, overwrite default config values with anything found & add new params
+    if not os.path.isfile(json_path):
+        raise IOError('Missing config file at ' + json_path)
+    with open(json_path, 'r+') as user_data:
+        try:
+            config_data = json.load(user_data)
+        except BaseException as why:
+            raise IOError('Error loading config file ' + json_path + ': ' + str(why))
+    config_update(config_data)
+
+
+def config_update(config_data):
+    for setting in config_data:
+        if isinstance(config.get(setting), dict):
+            # A section such as "adaptive": {"enabled": true} keeps the defaults of the entries it leaves out
+            if not isinstance(config_data[setting], dict):
+                raise ValueError('Config setting "' + setting + '" must be an object like ' +
+                                 json.dumps(config[setting]))
+            section = dict(config[setting])
+            section.update(config_data[setting])
+            config[setting] = section
+        elif isinstance(config_data[setting], list):
+            config[setting] = list(config_data[setting])
+        else:
+            config[setting] = config_data[setting]
+
+
+def config_update_from_args(args):
+    # Read command line, overwrite default config values with anything found & add new params
+    for arg in vars(args):
+        if getattr(args, arg) is not None:
+            if getattr(args, arg):
+                config[arg] = getattr(args, arg)
+
+
+def config_print(setting=None):
+    if setting is not None:
+        try:
+            print(str(config[setting]))
+        except:
+            print('No config option "' + setting + '"')
+    else:
+        for option in config:
+            print(option + ': ' + str(config[option]))
+
+
+def unit_list_fight(unit_list):
+    pairings = unit_list_pairings(unit_list)
+    if len(config['sweep']['parameters']) > 0:
+        sweep_run('unit_list', unit_list, unit_list, pairings)
+        return
+    results = grid_run(unit_list, unit_list, pairings)
+    for attacker_index, defender_index in pairings:
+        matchup_result_log(unit_list[attacker_index], unit_list[defender_index],
+                           results[(attacker_index, defender_index)])
+    if battle_profile is not None:
+        phase_start = timeit.default_timer()
+    result_store_render(result_store_write('unit_list', unit_list, unit_list, results))
+    if battle_profile is not None:
+        battle_profile.phase_times['output'] += timeit.default_timer() - phase_start
+
+
+def unit_list_render(unit_list, results):
+    if config['csv']['output']:
+        try:
+            output_file_csv = output_file_open(config['csv']['path'])
+        except BaseException as why:
+            logging.error('Failed to open CSV file ' + config['csv']['path'] + ' - ' + str(why))
+            config['csv']['output'] = False
+    if config['bbcode']['output']:
+        try:
+            output_file_bbcode = output_file_open(config['bbcode']['path'])
+        except BaseException as why:
+            logging.error('Failed to open BBCode file ' + config['bbcode']['path'] + ' - ' + str(why))
+            config['bbcode']['output'] = False
+    defender_list = []
+    completed_attackers = []
+    if config['bbcode']['output']:
+        output_file_bbcode.write('[table][tr][td]Attacker \\ Defender[/td]')
+    if config['csv']['output']:
+        csv_fields = ['Attacker']
+    for defender in unit_list:
+        defender_list.append(defender)
+        if config['bbcode']['output']:
+            output_file_bbcode.write('[td][b]' + defender['name'] + ' (Skill ' + str(defender['skill']) + ')[/b][/td]')
+        if config['csv']['output']:
+            csv_fields.append(defender['name'])
+    if config['bbcode']['output']:
+        output_file_bbcode.write('[/tr]')
+    if config['csv']['output']:
         csv_writer = csv.DictWriter(output_file_csv, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL,
                                     fieldnames=csv_fields)
         csv_writer.writeheader()
-    for attacker in unit_list:
+    for attacker_index, attacker in enumerate(unit_list):
         if config['bbcode']['output']:
             output_file_bbcode.write('[tr][td][b]' + attacker['name'] + ' (Skill ' + str(attacker['skill']) + ')[/b][/td]')
         if config['csv']['output']:
             csv_line = {'Attacker': attacker['name']}
-        for defender in defender_list:
+        for defender_index, defender in enumerate(defender_list):
             if attacker['name'] == defender['name']:
                 logging.debug('Identical units; skipping.')
                 if config['bbcode']['output']:
@@ -932,38 +3559,26 @@ def unit_list_fight(unit_list):
                 if config['csv']['output']:
                     csv_line[defender['name']] = 'N/A'
                 continue
-            wins = [0, 0, 0]  # Ties, Attacker, Defender
-            rounds = 0
-            for battle in range(0, int(config['battle_runs'])):
-                attacking_unit = unit_create_from_dict(attacker)
-                defending_unit = unit_create_from_dict(defender)
-                result_dict = one_vs_one(attacking_unit, defending_unit)
-                wins[result_dict['winner']] += 1
-                rounds += result_dict['rounds']
+            result_dict = results[(attacker_index, defender_index)]
+            wins = result_dict['wins']
             if config['bbcode']['output']:
                 if wins[1] > wins[2]:
                     output_file_bbcode.write('[td]' + attacker['name'] + ': ' + str(wins[1]) + '/' + str(wins[2]) +
-                                             '/' + str(wins[0]) + '(' +
-                                             str(round(float(rounds) / float(int(config['battle_runs'])), 1)) +
-                                             ')[/td]')
+                                             '/' + str(wins[0]) + '(' + str(average_rounds(result_dict)) + ')' +
+                                             interval_text(result_dict, 1) + '[/td]')
                 else:
                     output_file_bbcode.write('[td]' + defender['name'] + ': ' + str(wins[2]) + '/' + str(wins[1]) +
-                                             '/' + str(wins[0]) + '(' +
-                                             str(round(float(rounds) / float(int(config['battle_runs'])), 1)) +
-                                             ')[/td]')
-            logging.critical('====================')
-            logging.critical(attacker['name'] + ': ' + str(wins[1]))
-            logging.critical(defender['name'] + ': ' + str(wins[2]))
-            logging.critical('Ties: ' + str(wins[0]))
-            logging.critical('Average battle length: ' +
-                             str(round(float(rounds) / float(int(config['battle_runs'])), 1)))
+                                             '/' + str(wins[0]) + '(' + str(average_rounds(result_dict)) + ')' +
+                                             interval_text(result_dict, 2) + '[/td]')
             if config['csv']['output']:
                 if wins[1] > wins[2]:
                     output_text = attacker['name'] + ':' + str(wins[1]) + '/' + str(wins[2]) + '/' + \
-                                  str(wins[0]) + '(' + str(round(float(rounds) / float(config['battle_runs']), 1)) + ')'
+                                  str(wins[0]) + '(' + str(average_rounds(result_dict)) + ')' + \
+                                  interval_text(result_dict, 1)
                 else:
                     output_text = defender['name'] + ':' + str(wins[2]) + '/' + str(wins[1]) + '/' + \
-                                  str(wins[0]) + '(' + str(round(float(rounds) / float(config['battle_runs']), 1)) + ')'
+                                  str(wins[0]) + '(' + str(average_rounds(result_dict)) + ')' + \
+                                  interval_text(result_dict, 2)
                 csv_line[defender['name']] = output_text
         completed_attackers.append(attacker['name'])
         if config['bbcode']['output']:
@@ -978,20 +3593,39 @@ def unit_list_fight(unit_list):
 
 
 def list_vs_list(attacker_list, defender_list):
+    pairings = []
+    for attacker_index in range(0, len(attacker_list)):
+        for defender_index in range(0, len(defender_list)):
+            pairings.append((attacker_index, defender_index))
+    if len(config['sweep']['parameters']) > 0:
+        sweep_run('list_vs_list', attacker_list, defender_list, pairings)
+        return
+    results = grid_run(attacker_list, defender_list, pairings)
+    for attacker_index, defender_index in pairings:
+        matchup_result_log(attacker_list[attacker_index], defender_list[defender_index],
+                           results[(attacker_index, defender_index)])
+    if battle_profile is not None:
+        phase_start = timeit.default_timer()
+    result_store_render(result_store_write('list_vs_list', attacker_list, defender_list, results))
+    if battle_profile is not None:
+        battle_profile.phase_times['output'] += timeit.default_timer() - phase_start
+
+
+def list_vs_list_render(attacker_list, defender_list, results):
     if config['csv']['output']:
         try:
-            output_file_csv = open(config['csv']['path'], 'wb')
+            output_file_csv = output_file_open(config['csv']['path'])
         except BaseException as why:
             logging.error('Failed to open CSV file ' + config['csv']['path'] + ' - ' + str(why))
             config['csv']['output'] = False
     if config['bbcode']['output']:
         try:
-            output_file_bbcode = open(config['bbcode']['path'], 'wb')
+            output_file_bbcode = output_file_open(config['bbcode']['path'])
         except BaseException as why:
             logging.error('Failed to open BBCode file ' + config['bbcode']['path'] + ' - ' + str(why))
             config['bbcode']['output'] = False
     if config['bbcode']['output']:
-        output_file_bbcode.write('[table][tr][td]Attacker \ Defender[/td]')
+        output_file_bbcode.write('[table][tr][td]Attacker \\ Defender[/td]')
     if config['csv']['output']:
         csv_fields = ['Attacker']
     for defender in defender_list:
@@ -1005,34 +3639,21 @@ def list_vs_list(attacker_list, defender_list):
         csv_writer = csv.DictWriter(output_file_csv, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL,
                                     fieldnames=csv_fields)
         csv_writer.writeheader()
-    for attacker in attacker_list:
+    for attacker_index, attacker in enumerate(attacker_list):
         if config['bbcode']['output']:
             output_file_bbcode.write('[tr][td][b]' + attacker['name'] + ' (Skill ' + str(attacker['skill']) + ')[/b][/td]')
         if config['csv']['output']:
             csv_line = {'Attacker': attacker['name']}
-        for defender in defender_list:
-            wins = [0, 0, 0]  # Ties, Attacker, Defender
-            rounds = 0
-            for battle in range(0, int(config['battle_runs'])):
-                attacking_unit = unit_create_from_dict(attacker)
-                defending_unit = unit_create_from_dict(defender)
-                result_dict = one_vs_one(attacking_unit, defending_unit)
-                wins[result_dict['winner']] += 1
-                rounds += result_dict['rounds']
+        for defender_index, defender in enumerate(defender_list):
+            result_dict = results[(attacker_index, defender_index)]
+            wins = result_dict['wins']
             if config['bbcode']['output']:
                 output_file_bbcode.write('[td]' + str(wins[1]) + '/' + str(wins[2]) +
-                                         '/' + str(wins[0]) + '/' +
-                                         str(round(float(rounds) / float(int(config['battle_runs'])), 1)) +
-                                         '[/td]')
-            logging.critical('====================')
-            logging.critical(attacker['name'] + ': ' + str(wins[1]))
-            logging.critical(defender['name'] + ': ' + str(wins[2]))
-            logging.critical('Ties: ' + str(wins[0]))
-            logging.critical('Average battle length: ' +
-                             str(round(float(rounds) / float(int(config['battle_runs'])), 1)))
+                                         '/' + str(wins[0]) + '/' + str(average_rounds(result_dict)) +
+                                         interval_text(result_dict, 1) + '[/td]')
             if config['csv']['output']:
                 output_text = str(wins[1]) + '/' + str(wins[2]) + '/' + \
-                              str(wins[0]) + '/' + str(round(float(rounds) / float(config['battle_runs']), 1))
+                              str(wins[0]) + '/' + str(average_rounds(result_dict)) + interval_text(result_dict, 1)
                 csv_line[defender['name']] = output_text
         if config['bbcode']['output']:
             output_file_bbcode.write('[/tr]')
@@ -1045,6 +3666,342 @@ def list_vs_list(attacker_list, defender_list):
         output_file_csv.close()
 
 
+def unit_hash(stat_dict):
+    return hashlib.sha256(json.dumps(unit_stats(stat_dict), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def result_store_write(mode, attacker_list, defender_list, results):
+    # Everything the reports are made from, so they can be re-rendered with --render_store instead of re-run
+    store = {
+        'version': __version__,
+        'rules_version': RULES_VERSION,
+        'mode': mode,
+        'config': config,
+        'attackers': attacker_list,
+        'defenders': defender_list,
+        'attacker_hashes': [unit_hash(attacker) for attacker in attacker_list],
+        'defender_hashes': [unit_hash(defender) for defender in defender_list],
+        'cells': [[cell[0], cell[1], results[cell]] for cell in sorted(results)]
+    }
+    if config['store']['output']:
+        try:
+            with open(config['store']['path'], 'w') as store_file:
+                json.dump(store, store_file, separators=(',', ':'))
+        except BaseException as why:
+            logging.error('Failed to write result store ' + config['store']['path'] + ' - ' + str(why))
+    return store
+
+
+def result_store_read(store_path):
+    with open(store_path) as store_file:
+        store = json_load_byteified(store_file)
+    if store['rules_version'] != RULES_VERSION:
+        logging.warning('Result store ' + store_path + ' was made under rules version ' +
+                        str(store['rules_version']) + '; this is version ' + str(RULES_VERSION) + '.')
+    return store
+
+
+def result_store_render(store):
+    results = {}
+    for attacker_index, defender_index, result_dict in store['cells']:
+        results[(attacker_index, defender_index)] = result_dict
+    if store['mode'] == 'unit_list':
+        unit_list_render(store['attackers'], results)
+    else:
+        list_vs_list_render(store['attackers'], store['defenders'], results)
+    if config['histogram_csv']['output']:
+        histogram_render(store)
+
+
+def histogram_render(store):
+    # One row per (cell, measure, value): the rounds each battle took, and the armor and structure left at the end
+    try:
+        output_file_csv = output_file_open(config['histogram_csv']['path'])
+    except BaseException as why:
+        logging.error('Failed to open histogram CSV file ' + config['histogram_csv']['path'] + ' - ' + str(why))
+        return
+    csv_writer = csv.writer(output_file_csv, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    csv_writer.writerow(['Attacker', 'Defender', 'Measure', 'Value', 'Battles'])
+    for attacker_index, defender_index, result_dict in store['cells']:
+        if 'histograms' not in result_dict:
+            continue
+        for histogram in HISTOGRAMS:
+            counts = result_dict['histograms'][histogram]
+            for value in sorted(counts, key=int):
+                csv_writer.writerow([store['attackers'][attacker_index]['name'],
+                                     store['defenders'][defender_index]['name'], histogram, value, counts[value]])
+    output_file_csv.close()
+
+
+def sweep_values(parameter, spec):
+    # A list of values, or {"from": ..., "to": ..., "step": ...} with "to" included
+    if isinstance(spec, list):
+        return spec
+    try:
+        start = spec['from']
+        step = spec.get('step', 1)
+        steps = int(math.floor((spec['to'] - start) / float(step) + 1e-9))
+    except (KeyError, TypeError, ZeroDivisionError):
+        raise ValueError('Sweep values for ' + parameter + ' must be a list or {"from": ..., "to": ..., "step": ...}')
+    return [start + step * index for index in range(0, steps + 1)]
+
+
+def sweep_setting_apply(parameter, value):
+    # parameter is a setting, or setting.key for one entry of a setting such as woods_percent.long
+    keys = parameter.split('.')
+    settings = config
+    for key in keys[:-1]:
+        settings = settings[key]
+    if keys[-1] not in settings:
+        raise ValueError('Unknown sweep parameter ' + parameter)
+    settings[keys[-1]] = value
+
+
+def sweep_point_path(file_path, point_index):
+    path_root, path_extension = os.path.splitext(file_path)
+    return path_root + '_' + str(point_index + 1) + path_extension
+
+
+def sweep_run(mode, attacker_list, defender_list, pairings):
+    # Runs the grid once for every combination of the sweep parameters' values. Every point uses the same master seed,
+    # so each cell rolls the same dice at every point and the differences between points come from the parameters.
+    parameters = sorted(config['sweep']['parameters'])
+    values = [sweep_values(parameter, config['sweep']['parameters'][parameter]) for parameter in parameters]
+    points = list(itertools.product(*values))
+    master_seed_get()
+    sweep_config = copy.deepcopy(config)
+    cube = []
+    try:
+        for point_index, point in enumerate(points):
+            config.clear()
+            config.update(copy.deepcopy(sweep_config))
+            for parameter, value in zip(parameters, point):
+                sweep_setting_apply(parameter, value)
+            if config['checkpoint']['enabled']:
+                config['checkpoint']['path'] = sweep_point_path(sweep_config['checkpoint']['path'], point_index)
+            logging.critical('Sweep point ' + str(point_index + 1) + '/' + str(len(points)) + ': ' +
+                             ', '.join([parameter + '=' + json.dumps(value) for parameter, value in zip(parameters,
+                                                                                                        point)]))
+            results = grid_run(attacker_list, defender_list, pairings)
+            cube.append({'point': dict(zip(parameters, point)),
+                         'cells': [[cell[0], cell[1], results[cell]] for cell in sorted(results)]})
+    finally:
+        config.clear()
+        config.update(sweep_config)
+    sweep = {
+        'version': __version__,
+        'rules_version': RULES_VERSION,
+        'mode': mode,
+        'config': config,
+        'parameters': parameters,
+        'values': values,
+        'attackers': attacker_list,
+        'defenders': defender_list,
+        'points': cube
+    }
+    try:
+        with open(config['sweep']['path'], 'w') as sweep_file:
+            json.dump(sweep, sweep_file, separators=(',', ':'))
+    except BaseException as why:
+        logging.error('Failed to write sweep results ' + config['sweep']['path'] + ' - ' + str(why))
+    sweep_csv_write(sweep)
+    return sweep
+
+
+def sweep_csv_write(sweep):
+    # The cube flattened: one row per sweep point and cell
+    try:
+        output_file_csv = output_file_open(config['sweep']['csv_path'])
+    except BaseException as why:
+        logging.error('Failed to open sweep CSV file ' + config['sweep']['csv_path'] + ' - ' + str(why))
+        return
+    csv_writer = csv.writer(output_file_csv, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
+    csv_writer.writerow(sweep['parameters'] + ['Attacker', 'Defender', 'Attacker wins', 'Defender wins', 'Ties',
+                                               'Battles', 'Average rounds'])
+    for sweep_point in sweep['points']:
+        point_values = []
+        for parameter in sweep['parameters']:
+            value = sweep_point['point'][parameter]
+            if isinstance(value, (dict, list)):
+                value = json.dumps(value, sort_keys=True)
+            point_values.append(value)
+        for attacker_index, defender_index, result_dict in sweep_point['cells']:
+            wins = result_dict['wins']
+            csv_writer.writerow(point_values + [sweep['attackers'][attacker_index]['name'],
+                                                sweep['defenders'][defender_index]['name'], wins[1], wins[2], wins[0],
+                                                result_dict['battle_runs'], average_rounds(result_dict)])
+    output_file_csv.close()
+
+
+def matchup_score(wins, battle_runs):
+    # The attacker's share of battles won, counting a tie as half a win
+    return (wins[1] + 0.5 * wins[0]) / float(battle_runs)
+
+
+def matchup_matrix(candidates, targets):
+    # score[candidate][target], from the matrix file where it has the pair under the current settings; only the
+    # missing pairs are simulated, and then added to the file
+    matrix_path = config['optimizer']['matrix_path']
+    matrix = {}
+    if os.path.isfile(matrix_path):
+        try:
+            with open(matrix_path) as matrix_file:
+                matrix = json_load_byteified(matrix_file)
+        except (IOError, ValueError) as why:
+            logging.error('Ignoring unreadable matchup matrix ' + matrix_path + ' - ' + str(why))
+    keys = {}
+    missing = []
+    for candidate_index, candidate in enumerate(candidates):
+        for target_index, target in enumerate(targets):
+            key = matchup_cache_key(candidate, target)
+            keys[(candidate_index, target_index)] = key
+            if key not in matrix or (matrix[key]['battle_runs'] < int(config['battle_runs']) and
+                                     not config['adaptive']['enabled']):
+                missing.append((candidate_index, target_index))
+    logging.warning('Matchup matrix: ' + str(len(keys) - len(missing)) + ' of ' + str(len(keys)) + ' pairs in ' +
+                    matrix_path + '; simulating ' + str(len(missing)) + '.')
+    if len(missing) > 0:
+        results = grid_run(candidates, targets, missing)
+        for cell in missing:
+            matrix[keys[cell]] = {'wins': results[cell]['wins'], 'battle_runs': results[cell]['battle_runs']}
+        try:
+            with open(matrix_path, 'w') as matrix_file:
+                json.dump(matrix, matrix_file, sort_keys=True, separators=(',', ':'))
+        except BaseException as why:
+            logging.error('Failed to write matchup matrix ' + matrix_path + ' - ' + str(why))
+    return [[matchup_score(matrix[keys[(candidate_index, target_index)]]['wins'],
+                           matrix[keys[(candidate_index, target_index)]]['battle_runs'])
+             for target_index in range(0, len(targets))] for candidate_index in range(0, len(candidates))]
+
+
+def force_search(points, scores, budget):
+    # Branch and bound over forces of min_units to max_units candidates costing at most budget. Candidates are tried
+    # best first, and a branch is dropped once even its best possible completion can't beat the forces already kept.
+    # "coverage" scores a force by the best score any of its units has against each target, averaged over the
+    # targets; "total" adds up its units' average scores. Returns up to "forces" (score, points, candidates), best
+    # first.
+    options = config['optimizer']
+    objective = options['objective']
+    if objective not in ['coverage', 'total']:
+        logging.warning('Undefined optimizer objective: ' + str(objective) + '; setting to coverage.')
+        objective = 'coverage'
+    min_units = int(options['min_units'])
+    max_units = int(options['max_units'])
+    forces_kept = int(options['forces'])
+    max_nodes = int(options['max_nodes'])
+    target_count = len(scores[0])
+    values = [sum(row) / float(target_count) for row in scores]
+    order = sorted(range(0, len(scores)), key=lambda candidate: (-values[candidate], points[candidate]))
+    # The best score still available against each target (coverage) and the best values still available (total) from
+    # each position in the search order on
+    remaining_best = [[0.0] * target_count for position in range(0, len(order) + 1)]
+    for position in range(len(order) - 1, -1, -1):
+        remaining_best[position] = [max(score, later) for score, later in zip(scores[order[position]],
+                                                                              remaining_best[position + 1])]
+    kept = []  # Heap of (score, -points, force): the worst kept force first
+    nodes = [0]
+
+    def force_score(force, best_scores):
+        if objective == 'coverage':
+            return sum(best_scores) / target_count
+        return sum(values[candidate] for candidate in force)
+
+    def branch(position, force, force_points, best_scores):
+        nodes[0] += 1
+        if nodes[0] > max_nodes:
+            return
+        if len(force) >= min_units:
+            entry = (force_score(force, best_scores), -force_points, tuple(force))
+            if len(kept) < forces_kept:
+                heapq.heappush(kept, entry)
+            elif entry > kept[0]:
+                heapq.heapreplace(kept, entry)
+        slots = max_units - len(force)
+        if slots == 0 or position >= len(order):
+            return
+        if len(kept) == forces_kept:
+            if objective == 'coverage':
+                bound = sum(max(best, later) for best, later in zip(best_scores, remaining_best[position]))
+                bound /= target_count
+            elif options['allow_duplicates']:
+                bound = force_score(force, best_scores) + values[order[position]] * slots
+            else:
+                bound = force_score(force, best_scores) + sum(values[candidate]
+                                                              for candidate in order[position:position + slots])
+            if bound < kept[0][0]:
+                return
+        for next_position in range(position, len(order)):
+            candidate = order[next_position]
+            if force_points + points[candidate] > budget:
+                continue
+            if options['allow_duplicates']:
+                following = next_position
+            else:
+                following = next_position + 1
+            branch(following, force + [candidate], force_points + points[candidate],
+                   [max(best, score) for best, score in zip(best_scores, scores[candidate])])
+            if nodes[0] > max_nodes:
+                return
+
+    branch(0, [], 0, [0.0] * target_count)
+    if nodes[0] > max_nodes:
+        logging.warning('Optimizer stopped after ' + str(max_nodes) + ' search nodes; the forces found are the best '
+                        'seen, not necessarily the best there are.')
+    else:
+        logging.info('Optimizer searched ' + str(nodes[0]) + ' nodes.')
+    return [(score, -negative_points, list(force)) for score, negative_points, force in sorted(kept, reverse=True)]
+
+
+def optimizer_run(unit_catalog):
+    budget = float(config['optimizer']['budget'])
+    if len(config['optimizer']['candidate_list_path']) > 0:
+        candidates = unit_catalog_load(config['optimizer']['candidate_list_path'], config['catalog']['cache']).units
+    elif len(config['attacker_list']) > 0:
+        candidates = [unit_catalog.unit_get(attacker) for attacker in config['attacker_list']]
+    else:
+        candidates = unit_catalog.units
+    target_names = config['optimizer']['targets'] or config['defender_list']
+    if len(target_names) == 0:
+        raise RuntimeError('The optimizer needs targets (or a defender_list) to build forces against.')
+    targets = [unit_catalog.unit_get(target) for target in target_names]
+    unpriced = [candidate['name'] for candidate in candidates if 'points' not in candidate]
+    if len(unpriced) > 0:
+        logging.warning('Leaving out ' + str(len(unpriced)) + ' candidates without points: ' + ', '.join(unpriced))
+    names = set()
+    affordable = []
+    for candidate in candidates:
+        if 'points' in candidate and candidate['points'] <= budget and candidate['name'] not in names:
+            names.add(candidate['name'])
+            affordable.append(candidate)
+    if len(affordable) == 0:
+        raise RuntimeError('No candidates fit a budget of ' + str(config['optimizer']['budget']) + ' points.')
+    scores = matchup_matrix(affordable, targets)
+    forces = force_search([candidate['points'] for candidate in affordable], scores, budget)
+    report = []
+    for rank, (score, force_points, force) in enumerate(forces):
+        logging.critical('====================')
+        logging.critical('Force ' + str(rank + 1) + ': ' + config['optimizer']['objective'] + ' ' +
+                         str(round_half_up(score, 3)) + ', ' + str(force_points) + ' points: ' +
+                         ', '.join([affordable[candidate]['name'] for candidate in force]))
+        answers = []
+        for target_index, target in enumerate(targets):
+            best = max(force, key=lambda candidate: scores[candidate][target_index])
+            answers.append({'target': target['name'], 'unit': affordable[best]['name'],
+                            'score': scores[best][target_index]})
+            logging.critical('  vs ' + target['name'] + ': ' + affordable[best]['name'] + ' ' +
+                             str(round_half_up(scores[best][target_index], 3)))
+        report.append({'score': score, 'points': force_points,
+                       'units': [affordable[candidate]['name'] for candidate in force], 'answers': answers})
+    try:
+        with open(config['optimizer']['path'], 'w') as forces_file:
+            json.dump({'budget': config['optimizer']['budget'], 'objective': config['optimizer']['objective'],
+                       'targets': target_names, 'forces': report}, forces_file, sort_keys=True, indent=4,
+                      separators=(',', ': '))
+    except BaseException as why:
+        logging.error('Failed to write forces ' + config['optimizer']['path'] + ' - ' + str(why))
+    return forces
+
+
 def combatant_stat_string(combatant):
     stat_string = combatant['name'] + ': '
     stat_list = ['Skill', 'Points', 'Type', 'Armor', 'Structure', 'Weapons', 'Move', 'Jump', 'Special']
@@ -1058,48 +4015,150 @@ def combatant_stat_string(combatant):
 def single_fight(attacker, defender):
     logging.critical(combatant_stat_string(attacker))
     logging.critical(combatant_stat_string(defender))
-    wins = [0, 0, 0]  # Ties, Attacker, Defender
-    rounds = 0
-    for battle in range(0, int(config['battle_runs'])):
-        attacking_unit = unit_create_from_dict(attacker)
-        defending_unit = unit_create_from_dict(defender)
-        result_dict = one_vs_one(attacking_unit, defending_unit)
-        wins[result_dict['winner']] += 1
-        rounds += result_dict['rounds']
-    logging.critical('====================')
-    logging.critical(attacker['name'] + ': ' + str(wins[1]))
-    logging.critical(defender['name'] + ': ' + str(wins[2]))
-    logging.critical('Ties: ' + str(wins[0]))
-    logging.critical('Average battle length: ' +
-                     str(round(float(rounds) / float(int(config['battle_runs'])), 1)))
+    result_dict = grid_run([attacker], [defender], [(0, 0)])[(0, 0)]
+    matchup_result_log(attacker, defender, result_dict)
 
 
-def unit_from_list_by_name(name, unit_list):
-    for unit in unit_list:
-        if name == unit['name']:
-            return unit
-    raise RuntimeError('Unit "' + name + '" not found in unit list.')
+def lance_fight(attackers, defenders):
+    if numpy is None:
+        logging.error('Lance battles need NumPy, which is not installed.')
+        return
+    for combatant in attackers + defenders:
+        logging.critical(combatant_stat_string(combatant))
+    seed = seed_derive(master_seed_get(), 'lance', *[unit['name'] for unit in attackers + defenders])
+    result_dict = lance_battles(attackers, defenders, int(config['battle_runs']), seed=seed)
+    matchup_result_log({'name': 'Attackers (' + ', '.join([unit['name'] for unit in attackers]) + ')'},
+                       {'name': 'Defenders (' + ', '.join([unit['name'] for unit in defenders]) + ')'}, result_dict)
 
 
-def main():
-    config_set_from_command_line()
-    logging_configure(config['log_file'], int(config['log_level']))
-    random.seed()
-    unit_list = unit_list_read_from_json(config['unit_list_path'])
-    if config['attacker'] is not None and config['defender'] is not None:
-        attacker = unit_from_list_by_name(config['attacker'], unit_list)
-        defender = unit_from_list_by_name(config['defender'], unit_list)
+def profile_configure(enabled=False):
+    global battle_profile
+    battle_profile = None
+    if enabled:
+        battle_profile = BattleProfile()
+
+
+def profile_report(profile):
+    for line in profile.table():
+        logging.critical(line)
+    try:
+        with open(config['profile']['path'], 'w') as profile_file:
+            json.dump(profile.summary(), profile_file, sort_keys=True, indent=4, separators=(',', ': '))
+    except BaseException as why:
+        logging.error('Failed to write profile ' + config['profile']['path'] + ' - ' + str(why))
+
+
+def batch_run(manifest_path, args):
+    # Runs every config in the manifest as a job of this process. Each job starts from the batch's own config, then
+    # its config file, its manifest settings and the command line, as a separate launch would. Unit lists are read
+    # once and cells that come up again in a later job (same units, settings and seed) are reused.
+    global batch_results
+    with open(manifest_path) as manifest_file:
+        manifest = json_load_byteified(manifest_file)
+    master_seed_get()  # Jobs without their own seed share the batch's, so their repeated cells can be reused
+    batch_config = copy.deepcopy(config)
+    batch_results = {}
+    unit_catalogs = {}
+    failed_jobs = []
+    try:
+        for job_number, job in enumerate(manifest):
+            # A job is a config file path, or settings with an optional "config" file path they are applied on top of
+            if isinstance(job, dict):
+                job_settings = dict(job)
+                job_path = job_settings.pop('config', None)
+            else:
+                job_settings = {}
+                job_path = job
+            job_name = job_path if job_path is not None else 'job ' + str(job_number + 1)
+            logging.critical('Batch job ' + str(job_number + 1) + '/' + str(len(manifest)) + ': ' + job_name)
+            config.clear()
+            config.update(copy.deepcopy(batch_config))
+            known_results = set(batch_results)
+            try:
+                if job_path is not None:
+                    config_update_from_json(job_path)
+                config_update(job_settings)
+                config_update_from_args(args)
+                catalog_key = (config['unit_list_path'], bool(config['catalog']['cache']))
+                if catalog_key not in unit_catalogs:
+                    unit_catalogs[catalog_key] = unit_catalog_load(config['unit_list_path'],
+                                                                   config['catalog']['cache'])
+                job_run(unit_catalogs[catalog_key])
+            except Exception as why:
+                logging.error('Batch job ' + job_name + ' failed - ' + str(why))
+                failed_jobs.append(job_name)
+                # Only finished jobs' cells are reused
+                for result_key in set(batch_results) - known_results:
+                    del batch_results[result_key]
+            finally:
+                job_state_reset()
+                config.clear()
+                config.update(copy.deepcopy(batch_config))
+    finally:
+        batch_results = None
+        config.clear()
+        config.update(batch_config)
+    if len(failed_jobs) > 0:
+        logging.error('Failed batch jobs: ' + ', '.join(failed_jobs))
+
+
+def job_state_reset():
+    # Closes what a job opened so a job that stopped part way leaves nothing behind for the next one
+    global battle_trace, battle_profile
+    if battle_trace is not None:
+        battle_trace.close()
+    battle_trace = None
+    battle_profile = None
+
+
+def job_run(unit_catalog):
+    if config['trace']['enabled']:
+        trace_configure(config['trace']['path'], int(config['log_level']))
+    else:
+        trace_configure('', int(config['log_level']))
+    profile_configure(config['profile']['enabled'])
+    if float(config['optimizer']['budget']) > 0:
+        optimizer_run(unit_catalog)
+    elif len(config['lance_attacker_list']) > 0 and len(config['lance_defender_list']) > 0:
+        lance_fight([unit_catalog.unit_get(attacker) for attacker in config['lance_attacker_list']],
+                    [unit_catalog.unit_get(defender) for defender in config['lance_defender_list']])
+    elif config['attacker'] is not None and config['defender'] is not None:
+        attacker = unit_catalog.unit_get(config['attacker'])
+        defender = unit_catalog.unit_get(config['defender'])
         single_fight(attacker, defender)
     elif len(config['attacker_list']) > 0 and len(config['defender_list']) > 0:
         attacker_list = []
         defender_list = []
         for attacker in config['attacker_list']:
-            attacker_list.append(unit_from_list_by_name(attacker, unit_list))
+            attacker_list.append(unit_catalog.unit_get(attacker))
         for defender in config['defender_list']:
-            defender_list.append(unit_from_list_by_name(defender, unit_list))
+            defender_list.append(unit_catalog.unit_get(defender))
         list_vs_list(attacker_list, defender_list)
     else:
-        unit_list_fight(unit_list)
+        unit_list_fight(unit_catalog.units)
+    if battle_trace is not None:
+        battle_trace.close()
+    if battle_profile is not None:
+        profile_report(battle_profile)
+
+
+def main():
+    args = config_set_from_command_line()
+    logging_configure(config['log_file'], int(config['log_level']))
+    if len(config['render_store']) > 0:
+        result_store_render(result_store_read(config['render_store']))
+        return
+    if len(config['worker']) > 0:
+        trace_configure('', int(config['log_level']))
+        worker_run(config['worker'])
+        return
+    try:
+        if len(config['batch']) > 0:
+            batch_run(config['batch'], args)
+        else:
+            job_run(unit_catalog_load(config['unit_list_path'], config['catalog']['cache']))
+    finally:
+        coordinator_close()
 
 
 if __name__ == "__main__":
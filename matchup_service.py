@@ -0,0 +1,367 @@
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import copy
+import hashlib
+import json
+import logging
+import os
+import signal
+import urllib.parse
+import damage_simulator
+
+# Python 3.7 or later only: the simulator itself still runs on Python 2.7, this service needs asyncio
+
+settings = {
+    'config': damage_simulator.CONFIG_FILE,  # Simulator settings the service starts from; requests can override some
+    'host': '127.0.0.1',
+    'port': 8047,
+    'workers': 2,  # Processes running simulations, so the event loop only ever parses requests and looks up results
+    'memo_entries': 10000,  # Results kept in memory, least recently used dropped first
+    'max_battle_runs': 100000,  # Largest battle_runs a request may ask for
+    'unit_lists': [],  # Unit lists requests may name besides the config's unit_list_path
+    'unit_list_dir': '',  # Requests may also name any .json list under this directory, relative to it
+    'max_catalogs': 8,  # Unit lists kept loaded, least recently used dropped first
+    'debug': False
+}
+
+REQUEST_SETTINGS = ['battle_runs', 'seed', 'engine', 'range_determination', 'max_tolerable_heat']
+# Everything else a result depends on, besides the two units
+MEMO_SETTINGS = REQUEST_SETTINGS + ['adaptive', 'exact_max_states', 'woods_percent', 'cover_percent',
+                                    'variance_reduction']
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 403: 'Forbidden', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error'}
+MAX_BODY_SIZE = 65536
+
+
+class RequestError(Exception):
+    def __init__(self, status, message):
+        Exception.__init__(self, message)
+        self.status = status
+
+
+def settings_get_from_command_line():
+    parser = argparse.ArgumentParser()
+    for argument in settings:
+        if isinstance(settings[argument], bool):
+            parser.add_argument('--' + argument, action="store_true")
+        elif isinstance(settings[argument], int):
+            parser.add_argument('--' + argument, type=int)
+        elif isinstance(settings[argument], float):
+            parser.add_argument('--' + argument, type=float)
+        elif isinstance(settings[argument], list):
+            parser.add_argument('--' + argument, action="append")
+        else:
+            parser.add_argument('--' + argument)
+    args = parser.parse_args()
+    for arg in vars(args):
+        if getattr(args, arg) is not None:
+            if getattr(args, arg):
+                settings[arg] = getattr(args, arg)
+
+
+def logging_configure(debug=False):
+    if debug:
+        log_level = logging.DEBUG
+    else:
+        log_level = logging.INFO
+    log_format = '%(asctime)s %(message)s'
+    logging.basicConfig(level=log_level, format=log_format)
+
+
+def service_worker_init(base_config):
+    # Forked workers inherit the service's logging, which would otherwise log every battle at INFO, and its SIGTERM
+    # handler, which belongs to the event loop
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    damage_simulator.grid_worker_init(base_config)
+    if not settings['debug']:
+        logging.getLogger().setLevel(logging.WARNING)
+
+
+def matchup_compute(attacker, defender, job_config):
+    # Runs in a pool process: one matchup under the request's settings, through the on-disk cache when it's enabled
+    damage_simulator.config.clear()
+    damage_simulator.config.update(job_config)
+    seed = None
+    if job_config['seed'] is not None:
+        seed = damage_simulator.cell_seed(int(job_config['seed']), attacker, defender)
+    cache = damage_simulator.result_cache_open()
+    cached = None
+    if cache is not None:
+        cache_key = damage_simulator.matchup_cache_key(attacker, defender)
+        cached = cache.get(cache_key)
+    try:
+        result_dict = damage_simulator.matchup_run(attacker, defender, seed=seed, cached=cached)
+        result_dict.pop('variance_units', None)
+        if cache is not None and (cached is None or not damage_simulator.matchup_complete(cached)):
+            cache.put(cache_key, result_dict)
+    finally:
+        if cache is not None:
+            cache.close()
+    return result_dict
+
+
+def request_settings(params, base_config):
+    # The simulator settings for one request: the service's own, with the request's overrides
+    job_config = copy.deepcopy(base_config)
+    for setting in REQUEST_SETTINGS:
+        if setting not in params:
+            continue
+        value = params[setting]
+        if setting in ['battle_runs', 'seed', 'max_tolerable_heat']:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise RequestError(400, setting + ' must be a whole number')
+        job_config[setting] = value
+    if job_config['engine'] not in ['scalar', 'numpy', 'exact']:
+        raise RequestError(400, 'Unknown engine ' + str(job_config['engine']))
+    # The simulator quietly falls back to short range for a name it doesn't know
+    if job_config['range_determination'] not in base_config.get('range_determination_options',
+                                                                 [base_config['range_determination']]):
+        raise RequestError(400, 'Unknown range_determination ' + str(job_config['range_determination']))
+    if not 0 < int(job_config['battle_runs']) <= int(settings['max_battle_runs']):
+        raise RequestError(400, 'battle_runs must be between 1 and ' + str(settings['max_battle_runs']))
+    return job_config
+
+
+def memo_key(attacker, defender, job_config):
+    key_data = [damage_simulator.unit_stats(attacker), damage_simulator.unit_stats(defender),
+                damage_simulator.RULES_VERSION] + [job_config[setting] for setting in MEMO_SETTINGS]
+    return hashlib.sha256(json.dumps(key_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def unit_list_resolve(unit_list, base_config):
+    # Requests only reach the unit lists the service was set up with: loading a list reads it and writes a pickled
+    # sidecar next to it, so a path from a request must never be opened as given
+    allowed = [base_config['unit_list_path']] + list(settings['unit_lists'])
+    if unit_list is None:
+        return base_config['unit_list_path']
+    if not isinstance(unit_list, str):
+        raise RequestError(400, 'unit_list must be a string')
+    if unit_list in allowed:
+        return unit_list
+    if len(settings['unit_list_dir']) > 0 and unit_list.endswith('.json'):
+        unit_list_dir = os.path.realpath(settings['unit_list_dir'])
+        unit_list_path = os.path.realpath(os.path.join(unit_list_dir, unit_list))
+        if unit_list_path.startswith(unit_list_dir + os.sep):
+            return unit_list_path
+    raise RequestError(403, 'Unit list ' + unit_list + ' is not served here')
+
+
+def matchup_response(attacker, defender, result_dict, source):
+    wins = result_dict['wins']
+    response = {
+        'attacker': attacker['name'],
+        'defender': defender['name'],
+        'battle_runs': result_dict['battle_runs'],
+        'wins': {'attacker': wins[1], 'defender': wins[2], 'ties': wins[0]},
+        'attacker_win_rate': float(wins[1]) / result_dict['battle_runs'],
+        'defender_win_rate': float(wins[2]) / result_dict['battle_runs'],
+        'average_rounds': float(result_dict['rounds']) / result_dict['battle_runs'],
+        'source': source  # memo, shared (merged into an identical request in flight) or computed
+    }
+    if 'intervals' in result_dict:
+        response['intervals'] = {'attacker': result_dict['intervals'][1], 'defender': result_dict['intervals'][2]}
+    return response
+
+
+class MatchupService(object):
+    # Keeps unit catalogs and finished results in memory. Identical requests that arrive while their matchup is
+    # still being simulated wait on the same future rather than starting another simulation.
+
+    def __init__(self, base_config):
+        self.base_config = base_config
+        self.catalogs = collections.OrderedDict()  # Unit list path -> (mtime, UnitCatalog)
+        self.memo = collections.OrderedDict()
+        self.in_flight = {}  # Memo key -> future of the running simulation
+        self.stats = collections.Counter()
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=int(settings['workers']),
+                                                           initializer=service_worker_init,
+                                                           initargs=(base_config,))
+
+    async def catalog_get(self, unit_list):
+        # Reloaded when the list changes on disk; loading runs off the event loop
+        unit_list_path = unit_list_resolve(unit_list, self.base_config)
+        if unit_list is None:
+            unit_list = unit_list_path
+        try:
+            mtime = os.path.getmtime(unit_list_path)
+        except OSError:
+            raise RequestError(404, 'No unit list ' + unit_list)
+        if unit_list_path not in self.catalogs or self.catalogs[unit_list_path][0] != mtime:
+            loop = asyncio.get_running_loop()
+            try:
+                unit_catalog = await loop.run_in_executor(None, damage_simulator.unit_catalog_load, unit_list_path,
+                                                          self.base_config['catalog']['cache'])
+            except Exception as why:
+                # The details stay in the log: parse errors quote the list's contents
+                logging.error('Failed to load unit list ' + unit_list_path + ' - ' + str(why))
+                raise RequestError(500, 'Unit list ' + unit_list + ' could not be read')
+            self.catalogs[unit_list_path] = (mtime, unit_catalog)
+            while len(self.catalogs) > int(settings['max_catalogs']):
+                self.catalogs.popitem(last=False)
+            logging.info('Loaded ' + str(len(unit_catalog.units)) + ' units from ' + unit_list_path)
+        self.catalogs.move_to_end(unit_list_path)
+        return self.catalogs[unit_list_path][1]
+
+    async def unit_get(self, params, role):
+        if role not in params:
+            raise RequestError(400, 'Missing ' + role)
+        if not isinstance(params[role], str):
+            raise RequestError(400, role + ' must be a string')
+        unit_catalog = await self.catalog_get(params.get('unit_list'))
+        try:
+            return unit_catalog.unit_get(params[role])
+        except RuntimeError as why:
+            raise RequestError(404, str(why))
+
+    async def matchup(self, params):
+        attacker = await self.unit_get(params, 'attacker')
+        defender = await self.unit_get(params, 'defender')
+        job_config = request_settings(params, self.base_config)
+        key = memo_key(attacker, defender, job_config)
+        self.stats['matchups'] += 1
+        if key in self.memo:
+            self.memo.move_to_end(key)
+            self.stats['memo'] += 1
+            return matchup_response(attacker, defender, self.memo[key], 'memo')
+        if key in self.in_flight:
+            self.stats['shared'] += 1
+            return matchup_response(attacker, defender, await self.in_flight[key], 'shared')
+        loop = asyncio.get_running_loop()
+        self.in_flight[key] = loop.run_in_executor(self.pool, matchup_compute, attacker, defender, job_config)
+        try:
+            result_dict = await self.in_flight[key]
+        finally:
+            del self.in_flight[key]
+        self.stats['computed'] += 1
+        self.memo[key] = result_dict
+        while len(self.memo) > int(settings['memo_entries']):
+            self.memo.popitem(last=False)
+        return matchup_response(attacker, defender, result_dict, 'computed')
+
+    async def units(self, params):
+        unit_catalog = await self.catalog_get(params.get('unit_list'))
+        return {'units': [unit['name'] for unit in unit_catalog.units]}
+
+    def status(self):
+        return {'memo_entries': len(self.memo), 'in_flight': len(self.in_flight), 'requests': dict(self.stats),
+                'unit_lists': sorted(self.catalogs)}
+
+    async def route(self, method, target, body):
+        url = urllib.parse.urlsplit(target)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        if method == 'POST':
+            try:
+                body_params = json.loads(body.decode('utf-8') or '{}')
+            except ValueError as why:
+                raise RequestError(400, 'Bad JSON body - ' + str(why))
+            if not isinstance(body_params, dict):
+                raise RequestError(400, 'The JSON body must be an object')
+            params.update(body_params)
+        elif method != 'GET':
+            raise RequestError(405, 'Use GET or POST')
+        if url.path == '/matchup':
+            return await self.matchup(params)
+        elif url.path == '/units':
+            return await self.units(params)
+        elif url.path == '/status':
+            return self.status()
+        raise RequestError(404, 'No such endpoint ' + url.path)
+
+    async def connection_handle(self, reader, writer):
+        # HTTP/1.1 with keep-alive: one request at a time per connection
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    await http_respond(writer, 400, {'error': 'Bad request line'}, False)
+                    break
+                headers = {}
+                while True:
+                    header_line = await reader.readline()
+                    if header_line in [b'\r\n', b'\n', b'']:
+                        break
+                    name, separator, value = header_line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                body = b''
+                try:
+                    content_length = int(headers.get('content-length', 0) or 0)
+                except ValueError:
+                    content_length = -1
+                if content_length < 0:
+                    # Without a length the body can't be told from the next request, so the connection ends here
+                    await http_respond(writer, 400, {'error': 'Bad Content-Length'}, False)
+                    break
+                if content_length > MAX_BODY_SIZE:
+                    await http_respond(writer, 400, {'error': 'Body too large'}, False)
+                    break
+                if content_length > 0:
+                    body = await reader.readexactly(content_length)
+                try:
+                    status, response = 200, await self.route(method.upper(), target, body)
+                except RequestError as why:
+                    status, response = why.status, {'error': str(why)}
+                except Exception as why:
+                    logging.exception('Failed ' + method + ' ' + target)
+                    status, response = 500, {'error': str(why)}
+                logging.debug(method + ' ' + target + ' ' + str(status))
+                await http_respond(writer, status, response, keep_alive)
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    def close(self):
+        self.pool.shutdown()
+
+
+async def http_respond(writer, status, response, keep_alive):
+    body = json.dumps(response, sort_keys=True).encode('utf-8')
+    if keep_alive:
+        connection = 'keep-alive'
+    else:
+        connection = 'close'
+    head = 'HTTP/1.1 ' + str(status) + ' ' + HTTP_REASONS[status] + '\r\nContent-Type: application/json\r\n' + \
+           'Content-Length: ' + str(len(body)) + '\r\nConnection: ' + connection + '\r\n\r\n'
+    writer.write(head.encode('latin-1') + body)
+    await writer.drain()
+
+
+async def serve(service):
+    # The default unit list is loaded up front so the first request doesn't pay for it
+    try:
+        await service.catalog_get(None)
+    except RequestError as why:
+        logging.warning(str(why))
+    server = await asyncio.start_server(service.connection_handle, settings['host'], int(settings['port']))
+    logging.info('Serving matchups on http://' + settings['host'] + ':' + str(settings['port']))
+    try:
+        # Stop like Ctrl-C does, so the pool's processes are shut down with the service rather than orphaned
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, server.close)
+    except NotImplementedError:
+        pass  # Windows
+    async with server:
+        await server.serve_forever()
+
+
+if __name__ == "__main__":
+    settings_get_from_command_line()
+    logging_configure(settings['debug'])
+    damage_simulator.config_update_from_json(settings['config'])
+    matchup_service = MatchupService(copy.deepcopy(damage_simulator.config))
+    try:
+        asyncio.run(serve(matchup_service))
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        pass
+    finally:
+        matchup_service.close()